@@ -0,0 +1,175 @@
+import time
+import zlib
+import struct
+import tarfile
+from typing import Iterable, Iterator, List, Optional
+
+# 打包下载：边读取文件边生成 ZIP / tar.gz，不在磁盘上生成临时压缩包，
+# 内存占用与文件大小和数量无关（每次只读取一块）
+# ZIP 由这里直接按格式生成（总是使用 ZIP64 扩展，支持超过 4GB 的文件和压缩包），
+# 不压缩 (store) 时压缩包的大小可以在发送前算出，用作 Content-Length
+
+READ_BLOCK_SIZE = 1024 * 1024
+# 缓冲达到该大小后发送一次
+OUTPUT_CHUNK_SIZE = 256 * 1024
+DEFLATE_LEVEL = 6
+
+class ArchiveEntry:
+    """
+    压缩包中的一项：arcname 为包内路径，目录以 / 结尾；
+    size 为打包开始前的文件大小，发送时只读取这么多字节
+    """
+
+    def __init__(self, arcname: str, path: Optional[str], size: int, mtime: float, is_dir: bool = False):
+        self.arcname = arcname.rstrip("/") + "/" if is_dir else arcname
+        self.path = path
+        self.size = 0 if is_dir else size
+        self.mtime = mtime
+        self.is_dir = is_dir
+
+def read_blocks(entry: ArchiveEntry) -> Iterator[bytes]:
+    """
+    读取恰好 entry.size 字节：打包期间文件变长时截断，变短或被删除时补零，
+    保证压缩包的实际大小与预先计算的 Content-Length 一致
+    """
+    remaining = entry.size
+    try:
+        with open(entry.path, "rb") as f:
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+    except OSError:
+        pass
+    while remaining > 0:
+        block = bytes(min(READ_BLOCK_SIZE, remaining))
+        remaining -= len(block)
+        yield block
+
+def _buffered(parts: Iterable[bytes]) -> Iterator[bytes]:
+    buffer = []
+    buffered = 0
+    for part in parts:
+        if not part:
+            continue
+        buffer.append(part)
+        buffered += len(part)
+        if buffered >= OUTPUT_CHUNK_SIZE:
+            yield b"".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+# ZIP 格式常量
+ZIP_VERSION = 45 # 4.5: ZIP64
+ZIP_FLAGS = 0x08 | 0x800 # 大小和 CRC 写在数据之后的数据描述符中；文件名为 UTF-8
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+LOCAL_HEADER_SIZE = 30
+LOCAL_ZIP64_EXTRA_SIZE = 20
+DATA_DESCRIPTOR_SIZE = 24
+CENTRAL_HEADER_SIZE = 46
+CENTRAL_ZIP64_EXTRA_SIZE = 28
+END_RECORDS_SIZE = 56 + 20 + 22
+
+def _dos_time(mtime: float):
+    t = time.localtime(max(mtime, 315532800)) # ZIP 的时间从 1980 年开始
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+def zip_size(entries: List[ArchiveEntry]):
+    """
+    不压缩时 ZIP 的精确大小
+    """
+    total = END_RECORDS_SIZE
+    for entry in entries:
+        name_length = len(entry.arcname.encode("utf-8"))
+        total += (LOCAL_HEADER_SIZE + name_length + LOCAL_ZIP64_EXTRA_SIZE + entry.size + DATA_DESCRIPTOR_SIZE
+                  + CENTRAL_HEADER_SIZE + name_length + CENTRAL_ZIP64_EXTRA_SIZE)
+    return total
+
+def _zip_parts(entries: List[ArchiveEntry], compression: str):
+    offset = 0
+    central = []
+    for entry in entries:
+        name = entry.arcname.encode("utf-8")
+        method = ZIP_DEFLATED if compression == "deflate" and not entry.is_dir else ZIP_STORED
+        dos_time, dos_date = _dos_time(entry.mtime)
+        header = struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, ZIP_VERSION, ZIP_FLAGS, method, dos_time, dos_date,
+            0, 0xFFFFFFFF, 0xFFFFFFFF, len(name), LOCAL_ZIP64_EXTRA_SIZE
+        ) + name + struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+        yield header
+        header_offset = offset
+        offset += len(header)
+
+        crc = 0
+        compressed_size = 0
+        if not entry.is_dir:
+            compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15) if method == ZIP_DEFLATED else None
+            for block in read_blocks(entry):
+                crc = zlib.crc32(block, crc)
+                if compressor:
+                    block = compressor.compress(block)
+                compressed_size += len(block)
+                yield block
+            if compressor:
+                block = compressor.flush()
+                compressed_size += len(block)
+                yield block
+        descriptor = struct.pack("<IIQQ", 0x08074b50, crc, compressed_size, entry.size)
+        yield descriptor
+        offset += compressed_size + len(descriptor)
+
+        external_attr = (0o40755 << 16) | 0x10 if entry.is_dir else 0o100644 << 16
+        central.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | ZIP_VERSION, ZIP_VERSION, ZIP_FLAGS, method,
+            dos_time, dos_date, crc, 0xFFFFFFFF, 0xFFFFFFFF, len(name), CENTRAL_ZIP64_EXTRA_SIZE, 0, 0, 0,
+            external_attr, 0xFFFFFFFF
+        ) + name + struct.pack("<HHQQQ", 0x0001, 24, entry.size, compressed_size, header_offset))
+
+    central_offset = offset
+    central_size = sum(len(record) for record in central)
+    yield from central
+    count = len(entries)
+    yield struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, (3 << 8) | ZIP_VERSION, ZIP_VERSION, 0, 0,
+                      count, count, central_size, central_offset)
+    yield struct.pack("<IIQI", 0x07064b50, 0, central_offset + central_size, 1)
+    yield struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0)
+
+def stream_zip(entries: List[ArchiveEntry], compression: str = "store") -> Iterator[bytes]:
+    """
+    compression: store 不压缩 / deflate
+    """
+    return _buffered(_zip_parts(entries, compression))
+
+def _tar_parts(entries: List[ArchiveEntry]):
+    for entry in entries:
+        info = tarfile.TarInfo(entry.arcname.rstrip("/"))
+        info.mtime = int(entry.mtime)
+        if entry.is_dir:
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+        else:
+            info.size = entry.size
+            info.mode = 0o644
+        yield info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        if not entry.is_dir:
+            yield from read_blocks(entry)
+            padding = -entry.size % tarfile.BLOCKSIZE
+            if padding:
+                yield bytes(padding)
+    # 结束标记：两个空块
+    yield bytes(tarfile.BLOCKSIZE * 2)
+
+def stream_tar_gz(entries: List[ArchiveEntry]) -> Iterator[bytes]:
+    # wbits=31: 带 gzip 头和尾的 deflate 流
+    compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, 31)
+
+    def parts():
+        for part in _tar_parts(entries):
+            yield compressor.compress(part)
+        yield compressor.flush()
+
+    return _buffered(parts())
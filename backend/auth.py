@@ -1,19 +1,30 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from . import models, schemas, database
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas, database, crud_async
+from .user_cache import user_cache
 
 # 密钥配置 (生产环境应从环境变量获取)
 SECRET_KEY = "your-secret-key-for-development-only"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 300
 
+# bcrypt 的工作因子，修改后已有用户在下次登录时自动按新的值重新哈希
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# 执行 bcrypt 的线程数，限制同时进行的哈希计算，登录高峰不会占满 CPU 和默认线程池
+PASSWORD_HASH_THREADS = int(os.getenv("PASSWORD_HASH_THREADS", "2"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_THREADS, thread_name_prefix="neoshare-bcrypt")
+
 def verify_password(plain_password, hashed_password):
     try:
         return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
@@ -21,7 +32,36 @@ def verify_password(plain_password, hashed_password):
         return False
 
 def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+def password_needs_rehash(hashed_password: str):
+    # bcrypt 哈希格式: $2b$<rounds>$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+async def _run_password_task(func, *args):
+    # bcrypt 计算期间释放 GIL，放到独立线程池中执行不会阻塞事件循环
+    return await asyncio.get_running_loop().run_in_executor(_password_pool, func, *args)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_password_task(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_password_task(get_password_hash, password)
+
+async def authenticate_user(db: AsyncSession, user: models.User, password: str):
+    """
+    在线程池中校验密码，成功且哈希的工作因子与 BCRYPT_ROUNDS 不一致时重新哈希并保存
+    """
+    if not await verify_password_async(password, user.password_hash):
+        return False
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = await get_password_hash_async(password)
+        await db.commit()
+        user_cache.invalidate(user.username)
+    return True
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -33,7 +73,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -47,9 +87,16 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
+    # 缓存命中时不查询数据库，返回的是脱离 Session 的副本
+    user = user_cache.get(token_data.username)
+    if user is not None:
+        return user
+    user = await crud_async.get_user_by_username(db, token_data.username)
+    # 鉴权只读，查询后立即结束事务归还连接，上传等长时间的请求不会一直占用连接
+    await db.close()
     if user is None:
         raise credentials_exception
+    user_cache.put(user)
     return user
 
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
@@ -0,0 +1,181 @@
+import os
+import stat
+import time
+import hashlib
+import secrets
+from typing import Iterable, Optional
+from .storage import UPLOAD_DIR
+
+# 内容寻址存储（可选，STORAGE_MODE=dedup 时启用）
+# 上传的文件在写入时计算 SHA-256，内容相同的文件在磁盘上只保存一份：
+# uploads/.blobs/<前两位>/<三四位>/<摘要> 是数据本身，用户目录中的文件是指向它的硬链接，
+# 目录结构、同步、下载（包括 X-Accel-Redirect）都不受影响
+# 数据库中 files.content_hash 记录文件引用的数据块，blobs.ref_count 为引用计数，
+# 计数归零时删除数据块
+# 硬链接共享同一份数据，数据块被设为只读；应用内的写入都是写临时文件再替换，
+# 外部工具不能原地修改 uploads 中的文件
+
+# plain: 每个文件单独存储；dedup: 启用内容寻址存储
+STORAGE_MODE = os.getenv("STORAGE_MODE", "plain")
+# 小于该大小的文件不参与去重
+DEDUP_MIN_SIZE = int(os.getenv("DEDUP_MIN_SIZE", "4096"))
+# 不参与去重的文件后缀（逗号分隔）；Jupyter 保存 Notebook 时会原地写入，默认排除
+DEDUP_EXCLUDE = tuple(s.strip().lower() for s in os.getenv("DEDUP_EXCLUDE", ".ipynb").split(",") if s.strip())
+
+BLOB_DIR = os.path.join(UPLOAD_DIR, ".blobs")
+HASH_BLOCK_SIZE = 1024 * 1024
+GC_GRACE_SECONDS = 3600
+
+def enabled():
+    return STORAGE_MODE == "dedup"
+
+def new_hasher():
+    """
+    上传写入数据时使用的哈希对象，未启用时返回 None
+    """
+    return hashlib.sha256() if enabled() else None
+
+def blob_path(digest: str):
+    return os.path.join(BLOB_DIR, digest[:2], digest[2:4], digest)
+
+def hash_file(file_path: str):
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def eligible(filename: str, size: int):
+    return enabled() and size >= DEDUP_MIN_SIZE and not filename.lower().endswith(DEDUP_EXCLUDE)
+
+def ingest(file_path: str, digest: Optional[str] = None) -> Optional[str]:
+    """
+    把已经写入 file_path 的文件纳入内容存储，返回内容摘要；不参与去重时返回 None
+    已有相同内容时 file_path 被替换为指向已有数据块的硬链接，刚写入的数据随之释放
+    """
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    if not eligible(os.path.basename(file_path), file_stat.st_size):
+        return None
+    digest = digest or hash_file(file_path)
+    path = blob_path(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for _ in range(2):
+        try:
+            blob_stat = os.stat(path)
+            if blob_stat.st_ino == file_stat.st_ino:
+                return digest
+            if blob_stat.st_size != file_stat.st_size:
+                return None
+            # 先链接到同目录的临时名称再替换，目标路径任何时候都是完整的文件
+            temp_path = os.path.join(os.path.dirname(file_path), f".{secrets.token_hex(8)}.link")
+            os.link(path, temp_path)
+            try:
+                os.replace(temp_path, file_path)
+            except OSError:
+                os.remove(temp_path)
+                raise
+            return digest
+        except FileNotFoundError:
+            # 新内容：当前文件本身成为数据块
+            try:
+                os.link(file_path, path)
+            except FileExistsError:
+                # 其他请求同时写入了相同的内容，改为链接到它
+                continue
+            except OSError:
+                return None
+            os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            return digest
+        except OSError:
+            # 跨文件系统、文件系统不支持硬链接或链接数超过上限时不去重
+            return None
+    return None
+
+def link_copy(digest: str, target_path: str):
+    """
+    把数据块硬链接到 target_path，用于服务端复制；数据块不存在时返回 False
+    """
+    try:
+        os.link(blob_path(digest), target_path)
+        return True
+    except OSError:
+        return False
+
+def remove(digests: Iterable[str]):
+    # 引用计数归零的数据块；仍然存在的用户文件硬链接不受影响
+    for digest in digests:
+        try:
+            os.remove(blob_path(digest))
+        except OSError:
+            pass
+
+def collect_garbage(db):
+    """
+    清理没有数据库记录或引用计数已经归零的数据块文件，以及计数归零的记录
+    （正常情况下删除文件时会立即清理，这里处理进程异常退出等遗留）
+    """
+    from . import models
+
+    db.query(models.Blob).filter(models.Blob.ref_count <= 0).delete(synchronize_session=False)
+    db.commit()
+    known = {row.digest for row in db.query(models.Blob.digest)}
+    # 刚写入、记录还未提交的数据块不能删除
+    cutoff = time.time() - GC_GRACE_SECONDS
+    removed = 0
+    for root, _, names in os.walk(BLOB_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                if name not in known and os.stat(path).st_ctime < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+def dedup_existing(db, batch_size: int = 500):
+    """
+    为启用去重之前上传的文件计算摘要并纳入内容存储
+    """
+    from . import models, crud
+    from .storage import get_physical_path
+
+    count = 0
+    last_id = 0
+    while True:
+        db_files = db.query(models.File).filter(
+            models.File.type == "file", models.File.content_hash.is_(None), models.File.id > last_id
+        ).order_by(models.File.id).limit(batch_size).all()
+        if not db_files:
+            return count
+        for db_file in db_files:
+            last_id = db_file.id
+            file_path = get_physical_path(db_file)
+            digest = ingest(file_path)
+            if digest:
+                # 替换为已有数据块的硬链接后修改时间随之变化，同步记录，避免被同步视为内容修改
+                db_file.mtime = os.stat(file_path).st_mtime
+                crud.attach_blob(db, db_file, digest, commit=False)
+                count += 1
+        db.commit()
+
+if __name__ == "__main__":
+    import sys
+    from .database import SessionLocal
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "gc"
+    db = SessionLocal()
+    try:
+        if command == "dedup":
+            if not enabled():
+                sys.exit("Set STORAGE_MODE=dedup first")
+            print(f"Deduplicated {dedup_existing(db)} files")
+        print(f"Removed {collect_garbage(db)} unreferenced blobs")
+    finally:
+        db.close()
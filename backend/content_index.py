@@ -0,0 +1,245 @@
+import os
+import json
+import threading
+from typing import Iterable
+from sqlalchemy import text, func, or_, Integer, Float, String, delete, table, column
+from sqlalchemy.orm import Session
+from . import models
+from .database import SessionLocal
+from .search import has_fts, fts_phrase, escape_like, MIN_TRIGRAM_LENGTH
+from .storage import get_physical_path, try_worker_lock
+
+# 文本内容索引
+# 后台线程读取文本文件和 Notebook 单元格的内容，写入倒排索引（按文件 id 组织），
+# 搜索时只查询数据库，不读取磁盘
+# SQLite: FTS5 虚拟表 file_contents_fts (trigram 分词，支持子串和中文)
+# PostgreSQL: file_contents.content 列上的 pg_trgm GIN 索引
+
+CONTENT_FTS_TABLE = "file_contents_fts"
+
+# 可以作为文本读取的 MIME 类型（与 get_file_content 允许编辑的类型一致）
+TEXT_MIME_TYPES = ["text/plain", "text/markdown", "application/json", "application/javascript", "text/x-python", "text/html", "text/css"]
+# mimetypes 无法识别或识别错误的常见源代码扩展名
+TEXT_EXTENSIONS = [
+    ".txt", ".md", ".py", ".js", ".jsx", ".ts", ".tsx", ".json", ".css", ".html",
+    ".sh", ".ps1", ".sql", ".go", ".java", ".yaml", ".yml", ".csv", ".log", ".ipynb",
+]
+
+# 每个文件最多索引的字节数
+CONTENT_INDEX_MAX_BYTES = int(os.getenv("CONTENT_INDEX_MAX_BYTES", str(1024 * 1024)))
+# 后台索引间隔（秒），0 表示不启动后台索引线程
+CONTENT_INDEX_INTERVAL = int(os.getenv("CONTENT_INDEX_INTERVAL", "300"))
+# 每批索引的文件数，每批提交一次
+CONTENT_INDEX_BATCH = 100
+
+def setup(conn):
+    """
+    创建内容索引，由数据库迁移调用
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        try:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {CONTENT_FTS_TABLE} USING fts5(content, tokenize='trigram')"
+            ))
+        except Exception as e:
+            print(f"FTS5 trigram index unavailable, content search disabled: {e}")
+    elif dialect == "postgresql":
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_file_contents_trgm ON file_contents USING gin (content gin_trgm_ops)"))
+
+def is_indexable_filter():
+    # 与 is_indexable 对应的 SQL 条件
+    return or_(
+        models.File.mime_type.in_(TEXT_MIME_TYPES),
+        models.File.mime_type.like("text/%"),
+        *[models.File.name.like(f"%{ext}") for ext in TEXT_EXTENSIONS]
+    )
+
+def _notebook_text(raw: str):
+    # 只索引单元格源码（代码和 Markdown），不索引输出
+    notebook = json.loads(raw)
+    parts = []
+    for cell in notebook.get("cells", []):
+        source = cell.get("source", "")
+        parts.append("".join(source) if isinstance(source, list) else source)
+    return "\n".join(parts)
+
+def extract_text(file_path: str, name: str):
+    with open(file_path, "rb") as f:
+        if name.endswith(".ipynb"):
+            # Notebook 需要完整解析 JSON
+            raw = f.read().decode("utf-8", errors="ignore")
+            try:
+                return _notebook_text(raw)[:CONTENT_INDEX_MAX_BYTES]
+            except ValueError:
+                return ""
+        data = f.read(CONTENT_INDEX_MAX_BYTES)
+    if b"\x00" in data[:8192]:
+        # 二进制文件
+        return ""
+    return data.decode("utf-8", errors="ignore")
+
+def index_file(db: Session, file_record: models.File):
+    """
+    为单个文件建立索引，不提交事务
+    读取失败（例如文件已被删除）时记录为空内容，直到 size/mtime 再次变化
+    """
+    try:
+        content = extract_text(get_physical_path(file_record), file_record.name)
+    except OSError:
+        content = ""
+
+    fts = has_fts(db, CONTENT_FTS_TABLE)
+    if fts:
+        db.execute(text(f"DELETE FROM {CONTENT_FTS_TABLE} WHERE rowid = :id"), {"id": file_record.id})
+        db.execute(
+            text(f"INSERT INTO {CONTENT_FTS_TABLE} (rowid, content) VALUES (:id, :content)"),
+            {"id": file_record.id, "content": content}
+        )
+
+    state = db.get(models.FileContent, file_record.id)
+    if state is None:
+        state = models.FileContent(file_id=file_record.id)
+        db.add(state)
+    state.size = file_record.size or 0
+    state.mtime = file_record.mtime or 0
+    state.content = None if fts else content
+
+def remove_files(db: Session, file_ids: Iterable[int]):
+    """
+    删除文件的内容索引，由文件 CRUD 在同一个事务中调用
+    """
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+    if has_fts(db, CONTENT_FTS_TABLE):
+        db.execute(text(f"DELETE FROM {CONTENT_FTS_TABLE} WHERE rowid = :id"), [{"id": i} for i in file_ids])
+    db.query(models.FileContent).filter(models.FileContent.file_id.in_(file_ids)).delete(synchronize_session=False)
+
+def remove_selected(db: Session, id_select):
+    # 按子查询删除内容索引
+    if has_fts(db, CONTENT_FTS_TABLE):
+        fts = table(CONTENT_FTS_TABLE, column("rowid"))
+        db.execute(delete(fts).where(fts.c.rowid.in_(id_select)))
+    db.query(models.FileContent).filter(models.FileContent.file_id.in_(id_select)).delete(synchronize_session=False)
+
+def pending_files(db: Session, limit: int = CONTENT_INDEX_BATCH):
+    # 从未索引过、或 size/mtime 与索引时不同的文本文件
+    return db.query(models.File).outerjoin(
+        models.FileContent, models.FileContent.file_id == models.File.id
+    ).filter(
+        models.File.type == "file",
+        is_indexable_filter(),
+        or_(
+            models.FileContent.file_id.is_(None),
+            models.FileContent.size != models.File.size,
+            models.FileContent.mtime != func.coalesce(models.File.mtime, 0)
+        )
+    ).order_by(models.File.id).limit(limit).all()
+
+def index_pending(db: Session, batch_size: int = CONTENT_INDEX_BATCH):
+    """
+    增量索引所有待处理的文件，每批提交一次
+    返回值: 本次索引的文件数量
+    """
+    total = 0
+    while True:
+        batch = pending_files(db, batch_size)
+        if not batch:
+            return total
+        for file_record in batch:
+            index_file(db, file_record)
+        db.commit()
+        total += len(batch)
+
+def apply_content_search(db: Session, sql_query, query: str):
+    """
+    在已经按作用域过滤的文件查询上增加内容匹配，
+    追加一列摘要并按相关度排序，查询结果为 (文件记录, 摘要)
+    """
+    if has_fts(db, CONTENT_FTS_TABLE):
+        if len(query) >= MIN_TRIGRAM_LENGTH:
+            condition = f"{CONTENT_FTS_TABLE} MATCH :q"
+            params = {"q": fts_phrase(query)}
+        else:
+            # 少于 3 个字符时 trigram 无法使用索引，在索引表中扫描
+            condition = "content LIKE :q ESCAPE '\\'"
+            params = {"q": f"%{escape_like(query)}%"}
+        matches = text(
+            f"SELECT rowid AS id, bm25({CONTENT_FTS_TABLE}) AS rank, "
+            f"snippet({CONTENT_FTS_TABLE}, 0, '', '', '...', 16) AS snippet "
+            f"FROM {CONTENT_FTS_TABLE} WHERE {condition}"
+        ).bindparams(**params).columns(id=Integer, rank=Float, snippet=String).subquery()
+        return sql_query.join(matches, matches.c.id == models.File.id).add_columns(
+            matches.c.snippet
+        ).order_by(matches.c.rank, models.File.id)
+
+    sql_query = sql_query.join(models.FileContent, models.FileContent.file_id == models.File.id).filter(
+        models.FileContent.content.ilike(f"%{escape_like(query)}%", escape="\\")
+    )
+    if db.get_bind().dialect.name == "postgresql":
+        # pg_trgm 的 GIN 索引支持 ILIKE，相似度用于排序
+        position = func.strpos(func.lower(models.FileContent.content), func.lower(query))
+        return sql_query.add_columns(
+            func.substr(models.FileContent.content, func.greatest(position - 40, 1), 120)
+        ).order_by(func.similarity(models.FileContent.content, query).desc(), models.File.id)
+    # 不支持 FTS5 trigram 的 SQLite：逐行匹配，不计算相关度
+    position = func.instr(func.lower(models.FileContent.content), func.lower(query))
+    return sql_query.add_columns(
+        func.substr(models.FileContent.content, func.max(position - 40, 1), 120)
+    ).order_by(models.File.id)
+
+class ContentIndexer(threading.Thread):
+    """
+    后台索引线程：定期为新增或修改过的文本文件建立索引
+    """
+
+    def __init__(self, interval: int = CONTENT_INDEX_INTERVAL):
+        super().__init__(name="neoshare-content-indexer", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            db = SessionLocal()
+            try:
+                index_pending(db)
+            except Exception as e:
+                db.rollback()
+                print(f"Content index error: {e}")
+            finally:
+                db.close()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+_indexer = None
+_indexer_lock = None
+
+def start_indexer():
+    # 多个 uvicorn worker 中只允许一个运行索引线程
+    global _indexer, _indexer_lock
+    if _indexer is not None or CONTENT_INDEX_INTERVAL <= 0:
+        return None
+    _indexer_lock = try_worker_lock("content-indexer")
+    if not _indexer_lock:
+        return None
+    _indexer = ContentIndexer()
+    _indexer.start()
+    return _indexer
+
+def stop_indexer():
+    global _indexer
+    if _indexer is not None:
+        _indexer.stop()
+        _indexer = None
+
+if __name__ == "__main__":
+    # 手动执行一次索引: python -m backend.content_index
+    db = SessionLocal()
+    try:
+        print(f"Indexed {index_pending(db)} files")
+    finally:
+        db.close()
@@ -1,5 +1,9 @@
-from sqlalchemy.orm import Session
-from . import models, schemas, auth
+from collections import defaultdict, Counter
+from typing import List, Optional, Tuple
+from sqlalchemy import or_, select, literal, Integer, String, func, event
+from sqlalchemy.orm import Session, aliased
+from . import models, schemas, auth, search, content_index, notebook_preview, thumbnails, blob_store
+from .storage import get_scope
 
 # User operations
 def get_user(db: Session, user_id: int):
@@ -39,14 +43,20 @@ def update_user(db: Session, user_id: int, user_update: schemas.UserUpdate):
         setattr(db_user, key, value)
         
     db.commit()
+    auth.user_cache.invalidate(db_user.username)
     db.refresh(db_user)
     return db_user
 
 def delete_user(db: Session, user_id: int):
     db_user = get_user(db, user_id)
     if db_user:
+        username = db_user.username
+        release_blobs(db, [row.content_hash for row in db.query(models.File.content_hash).filter(
+            models.File.user_id == user_id, models.File.content_hash.isnot(None)
+        )])
         db.delete(db_user)
         db.commit()
+        auth.user_cache.invalidate(username)
         return True
     return False
 
@@ -54,45 +64,498 @@ def delete_user(db: Session, user_id: int):
 def get_file(db: Session, file_id: int):
     return db.query(models.File).filter(models.File.id == file_id).first()
 
-def get_files(db: Session, path: str = "/", is_public: bool = True, user_id: int = None):
-    query = db.query(models.File).filter(models.File.path == path)
+def get_files_by_ids(db: Session, file_ids: List[int]):
+    # 一次查询取出多条记录，不存在的 ID 不出现在结果中
+    return db.query(models.File).filter(models.File.id.in_(file_ids)).all()
+
+def scope_filter(query, is_public: bool, user_id: int = None):
+    # 公共区按 is_public 区分，私有区还需要按用户区分
     if is_public:
-        query = query.filter(models.File.is_public == True)
-    elif user_id:
+        return query.filter(models.File.is_public == True)
+    query = query.filter(models.File.is_public == False)
+    if user_id:
         query = query.filter(models.File.user_id == user_id)
-    return query.all()
+    return query
 
-def create_file(db: Session, file: schemas.FileCreate, user_id: int):
-    db_file = models.File(**file.model_dump(), user_id=user_id)
-    db.add(db_file)
-    db.commit()
-    db.refresh(db_file)
-    return db_file
+def get_files_query(db: Session, path: str = "/", is_public: bool = True, user_id: int = None):
+    query = db.query(models.File).filter(models.File.path == path)
+    return scope_filter(query, is_public, user_id)
 
-def delete_file(db: Session, file_id: int):
-    db_file = get_file(db, file_id)
-    if db_file:
-        db.delete(db_file)
-        db.commit()
-        return True
-    return False
+def get_files(db: Session, path: str = "/", is_public: bool = True, user_id: int = None):
+    return get_files_query(db, path, is_public, user_id).all()
+
+def get_full_path(db_file: models.File):
+    # 目录记录自身的完整路径，如 path="/a", name="b" -> "/a/b"
+    return f"{db_file.path.rstrip('/')}/{db_file.name}"
+
+def _escape_like(value: str):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
-def search_files(db: Session, query: str, is_public: bool, user_id: int = None):
-    # 简单的模糊搜索
-    sql_query = db.query(models.File).filter(
-        models.File.name.ilike(f"%{query}%"),
-        models.File.is_public == is_public
+def subtree_filter(full_path: str):
+    # 匹配某个目录下所有后代记录
+    return or_(
+        models.File.path == full_path,
+        models.File.path.like(_escape_like(full_path) + "/%", escape="\\")
     )
-    if not is_public and user_id:
-        sql_query = sql_query.filter(models.File.user_id == user_id)
-    
+
+def get_directory(db: Session, full_path: str, is_public: bool, user_id: int = None):
+    """
+    按完整路径查找目录记录，如 "/a/b" -> (path="/a", name="b")
+    命中 (作用域, path, name) 唯一索引
+    """
+    full_path = full_path.rstrip("/")
+    if not full_path:
+        return None
+    parent, name = full_path.rsplit("/", 1)
+    query = db.query(models.File).filter(
+        models.File.path == (parent or "/"),
+        models.File.name == name,
+        models.File.type == "directory"
+    )
+    return scope_filter(query, is_public, user_id).first()
+
+def _resolve_parent_id(db: Session, db_file: models.File):
+    if db_file.parent_id is not None:
+        return db_file.parent_id
+    parent = get_directory(db, db_file.path, db_file.is_public, db_file.user_id)
+    return parent.id if parent else None
+
+def adjust_ancestor_aggregates(db: Session, parent_id: Optional[int], size_delta: int, count_delta: int):
+    """
+    把大小和文件数的变化累加到 parent_id 及其所有祖先目录上
+    沿 parent_id 递归查找祖先，每一步都是主键查找
+    不提交事务，由调用方与文件记录的修改一起提交
+    """
+    if parent_id is None or (size_delta == 0 and count_delta == 0):
+        return
+    ancestors = select(literal(parent_id, Integer).label("id")).cte("ancestors", recursive=True)
+    parent = aliased(models.File)
+    ancestors = ancestors.union_all(
+        select(parent.parent_id).where(parent.id == ancestors.c.id, parent.parent_id.isnot(None))
+    )
+    db.query(models.File).filter(models.File.id.in_(select(ancestors.c.id))).update({
+        models.File.size: models.File.size + size_delta,
+        models.File.file_count: models.File.file_count + count_delta,
+    }, synchronize_session=False)
+
+def _aggregate_of(db_file: models.File):
+    # 记录对祖先目录贡献的 (大小, 文件数)
+    if db_file.type == "directory":
+        return db_file.size or 0, db_file.file_count or 0
+    return db_file.size or 0, 1
+
+def _apply_aggregate_deltas(db: Session, deltas: dict):
+    # deltas: parent_id -> [size_delta, count_delta]
+    # 同一父目录下的多条记录只需要一次 UPDATE
+    for parent_id, (size_delta, count_delta) in deltas.items():
+        adjust_ancestor_aggregates(db, parent_id, size_delta, count_delta)
+
+def _adopt_children(db: Session, db_dir: models.File, exclude_ids: set):
+    """
+    新建目录时，接管数据库中已存在但还没有父目录的直接子项
+    （例如先同步了子目录再同步父目录）：补全 parent_id，并把它们计入目录的聚合值
+    子目录的聚合值已经包含了其后代，因此只需要处理直接子项
+    """
+    query = scope_filter(db.query(models.File), db_dir.is_public, db_dir.user_id).filter(
+        models.File.path == get_full_path(db_dir),
+        models.File.parent_id.is_(None)
+    )
+    if exclude_ids:
+        query = query.filter(models.File.id.notin_(exclude_ids))
+    for child in query.all():
+        size_delta, count_delta = _aggregate_of(child)
+        db_dir.size = (db_dir.size or 0) + size_delta
+        db_dir.file_count = (db_dir.file_count or 0) + count_delta
+        child.parent_id = db_dir.id
+
+def _delete_subtree(db: Session, db_file: models.File):
+    # 删除目录的所有后代记录及其同步指纹
+    full_path = get_full_path(db_file)
+    subtree = scope_filter(db.query(models.File), db_file.is_public, db_file.user_id).filter(
+        subtree_filter(full_path)
+    )
+    # 索引按子查询删除，大目录的后代 id 不需要读到内存中
+    subtree_ids = subtree.with_entities(models.File.id).statement
+    search.remove_selected(db, subtree_ids)
+    content_index.remove_selected(db, subtree_ids)
+    release_blobs(db, [row.content_hash for row in subtree.with_entities(models.File.content_hash).filter(
+        models.File.content_hash.isnot(None)
+    )])
+    cached = notebook_preview.cached_ids() | thumbnails.cached_ids()
+    if cached:
+        cached_ids = [row.id for row in subtree.with_entities(models.File.id).filter(models.File.id.in_(cached))]
+        notebook_preview.invalidate(cached_ids)
+        thumbnails.invalidate(cached_ids)
+    subtree.delete(synchronize_session=False)
+    db.query(models.DirectoryState).filter(
+        models.DirectoryState.scope == get_scope(db_file.is_public, db_file.user_id),
+        or_(
+            models.DirectoryState.path == full_path,
+            models.DirectoryState.path.like(_escape_like(full_path) + "/%", escape="\\")
+        )
+    ).delete(synchronize_session=False)
+
+def _finish(db: Session, commit: bool):
+    # commit=False 时只 flush，由调用方在同一个事务中统一提交
+    if commit:
+        db.commit()
+    else:
+        db.flush()
+
+def create_file(db: Session, file: schemas.FileCreate, user_id: int, commit: bool = True):
+    db_file = bulk_create_files(db, [file], user_id, commit=commit)[0]
+    if commit:
+        db.refresh(db_file)
+    return db_file
+
+def delete_file(db: Session, file_id: int, recursive: bool = True, commit: bool = True):
+    """
+    删除文件记录，并从祖先目录的聚合值中扣除
+    recursive: 删除目录时同时删除其所有后代记录
+    """
+    return bulk_delete_files(db, [file_id], recursive=recursive, commit=commit) > 0
+
+def search_files_query(db: Session, query: str, is_public: bool, user_id: int = None,
+                       path_prefix: Optional[str] = None, ranked: bool = True):
+    """
+    按文件名搜索，使用全文索引
+    path_prefix: 只搜索该目录及其子目录
+    ranked: 按相关度排序，为 False 时由调用方排序
+    """
+    sql_query = scope_filter(db.query(models.File), is_public, user_id)
+    if path_prefix and path_prefix.rstrip("/"):
+        sql_query = sql_query.filter(subtree_filter(path_prefix.rstrip("/")))
+    return search.apply_name_search(db, sql_query, query, ranked=ranked)
+
+def search_files(db: Session, query: str, is_public: bool, user_id: int = None,
+                 path_prefix: Optional[str] = None, limit: Optional[int] = None, offset: int = 0):
+    sql_query = search_files_query(db, query, is_public, user_id, path_prefix)
+    if offset:
+        sql_query = sql_query.offset(offset)
+    if limit is not None:
+        sql_query = sql_query.limit(limit)
     return sql_query.all()
 
-def update_file_size(db: Session, file_id: int, size: int):
+def search_file_contents(db: Session, query: str, is_public: bool, user_id: int = None,
+                         path_prefix: Optional[str] = None, limit: int = 50, offset: int = 0):
+    """
+    在内容索引中搜索，返回 [(文件记录, 摘要), ...]，按相关度排序
+    """
+    sql_query = scope_filter(db.query(models.File), is_public, user_id)
+    if path_prefix and path_prefix.rstrip("/"):
+        sql_query = sql_query.filter(subtree_filter(path_prefix.rstrip("/")))
+    sql_query = content_index.apply_content_search(db, sql_query, query)
+    return [(row[0], row[1]) for row in sql_query.offset(offset).limit(limit).all()]
+
+def update_file_size(db: Session, file_id: int, size: int, mtime: float = None, commit: bool = True):
+    if not bulk_update_file_sizes(db, [(file_id, size, mtime)], commit=commit):
+        return None
     db_file = get_file(db, file_id)
-    if db_file:
-        db_file.size = size
-        db.commit()
+    if commit:
         db.refresh(db_file)
+    return db_file
+
+# Batch file operations
+# 批量版本在一个事务中完成所有修改，祖先目录的聚合值按父目录合并后更新
+def bulk_create_files(db: Session, files: List[schemas.FileCreate], user_id: int, commit: bool = True):
+    db_files = [models.File(**file.model_dump(), user_id=user_id) for file in files]
+    if not db_files:
+        return db_files
+    db.add_all(db_files)
+    # 先 flush，同一批中新建的目录也能作为其后代的父目录
+    db.flush()
+
+    # 每个不同的父路径只查找一次父目录
+    parent_ids = {}
+    for db_file in db_files:
+        key = (db_file.path, db_file.is_public)
+        if key not in parent_ids:
+            parent_ids[key] = _resolve_parent_id(db, db_file)
+        db_file.parent_id = parent_ids[key]
+
+    search.index_files(db, db_files)
+
+    batch_ids = {db_file.id for db_file in db_files}
+    for db_file in db_files:
+        if db_file.type == "directory":
+            _adopt_children(db, db_file, batch_ids)
+    db.flush()
+
+    deltas = defaultdict(lambda: [0, 0])
+    for db_file in db_files:
+        size_delta, count_delta = _aggregate_of(db_file)
+        deltas[db_file.parent_id][0] += size_delta
+        deltas[db_file.parent_id][1] += count_delta
+    _apply_aggregate_deltas(db, deltas)
+    _finish(db, commit)
+    return db_files
+
+def bulk_update_file_sizes(db: Session, updates: List[Tuple[int, int, Optional[float]]], commit: bool = True):
+    """
+    updates: [(file_id, size, mtime), ...]，mtime 为 None 时不修改
+    """
+    if not updates:
+        return 0
+    update_map = {file_id: (size, mtime) for file_id, size, mtime in updates}
+    db_files = db.query(models.File).filter(models.File.id.in_(list(update_map))).all()
+
+    deltas = defaultdict(lambda: [0, 0])
+    for db_file in db_files:
+        size, mtime = update_map[db_file.id]
+        deltas[_resolve_parent_id(db, db_file)][0] += size - (db_file.size or 0)
+        db_file.size = size
+        if mtime is not None:
+            db_file.mtime = mtime
+    # 内容已经变化，不再引用原来的数据块
+    release_blobs(db, [db_file.content_hash for db_file in db_files])
+    for db_file in db_files:
+        db_file.content_hash = None
+    db.flush()
+    _apply_aggregate_deltas(db, deltas)
+    # 内容已经变化，旧的预览缓存不会再被使用
+    notebook_preview.invalidate(update_map)
+    thumbnails.invalidate(update_map)
+    _finish(db, commit)
+    return len(db_files)
+
+def bulk_delete_files(db: Session, file_ids: List[int], recursive: bool = True, commit: bool = True):
+    if not file_ids:
+        return 0
+    db_files = db.query(models.File).filter(models.File.id.in_(list(file_ids))).all()
+
+    # 同一批中被删除目录的后代已经包含在目录的聚合值中，不能重复扣除
+    deleted_dirs = set()
+    if recursive:
+        deleted_dirs = {
+            (get_scope(f.is_public, f.user_id), get_full_path(f))
+            for f in db_files if f.type == "directory"
+        }
+
+    def covered(db_file):
+        scope = get_scope(db_file.is_public, db_file.user_id)
+        parent = db_file.path.rstrip("/")
+        while parent:
+            if (scope, parent) in deleted_dirs:
+                return True
+            parent = parent.rsplit("/", 1)[0]
+        return False
+
+    deltas = defaultdict(lambda: [0, 0])
+    for db_file in db_files:
+        if covered(db_file):
+            continue
+        size_delta, count_delta = _aggregate_of(db_file)
+        parent_id = _resolve_parent_id(db, db_file)
+        deltas[parent_id][0] -= size_delta
+        deltas[parent_id][1] -= count_delta
+        if recursive and db_file.type == "directory":
+            _delete_subtree(db, db_file)
+
+    # 不递归删除时，子项解除与被删除目录的关联
+    db.query(models.File).filter(models.File.parent_id.in_([f.id for f in db_files])).update(
+        {models.File.parent_id: None}, synchronize_session=False
+    )
+    search.remove_files(db, [f.id for f in db_files])
+    content_index.remove_files(db, [f.id for f in db_files])
+    notebook_preview.invalidate([f.id for f in db_files])
+    thumbnails.invalidate([f.id for f in db_files])
+    release_blobs(db, [f.content_hash for f in db_files])
+    db.query(models.File).filter(models.File.id.in_([f.id for f in db_files])).delete(synchronize_session=False)
+    _apply_aggregate_deltas(db, deltas)
+    _finish(db, commit)
+    return len(db_files)
+
+# Move / copy operations
+def _replace_path_prefix(column, old_prefix: str, new_prefix: str):
+    # "/old/x/y" -> "/new/x/y"，列值等于 old_prefix 时变为 new_prefix
+    return literal(new_prefix, String).concat(func.substr(column, len(old_prefix) + 1))
+
+def move_file(db: Session, db_file: models.File, target_dir: Optional[models.File], target_path: str, new_name: str,
+              commit: bool = True):
+    """
+    移动或重命名文件/目录，只修改元数据，不涉及物理文件
+    目录的所有后代只需要一条 UPDATE 替换 path 前缀，parent_id 保持不变；
+    聚合值从原来的祖先目录扣除，加到新的祖先目录上
+    target_dir: 目标目录记录，根目录为 None；target_path: 目标目录的完整路径
+    """
+    old_full_path = get_full_path(db_file)
+    old_parent_id = _resolve_parent_id(db, db_file)
+    new_parent_id = target_dir.id if target_dir else None
+    if old_parent_id != new_parent_id:
+        size_delta, count_delta = _aggregate_of(db_file)
+        adjust_ancestor_aggregates(db, old_parent_id, -size_delta, -count_delta)
+        adjust_ancestor_aggregates(db, new_parent_id, size_delta, count_delta)
+
+    db_file.path = target_path
+    db_file.name = new_name
+    db_file.parent_id = new_parent_id
+    db.flush()
+
+    if db_file.type == "directory":
+        new_full_path = get_full_path(db_file)
+        scope_filter(db.query(models.File), db_file.is_public, db_file.user_id).filter(
+            subtree_filter(old_full_path)
+        ).update(
+            {models.File.path: _replace_path_prefix(models.File.path, old_full_path, new_full_path)},
+            synchronize_session=False
+        )
+        # 同步指纹随目录一起移动，移动后不需要重新扫描整个子树
+        db.query(models.DirectoryState).filter(
+            models.DirectoryState.scope == get_scope(db_file.is_public, db_file.user_id),
+            or_(
+                models.DirectoryState.path == old_full_path,
+                models.DirectoryState.path.like(_escape_like(old_full_path) + "/%", escape="\\")
+            )
+        ).update(
+            {models.DirectoryState.path: _replace_path_prefix(models.DirectoryState.path, old_full_path, new_full_path)},
+            synchronize_session=False
+        )
+    search.index_files(db, [db_file])
+    _finish(db, commit)
+    return db_file
+
+def get_subtree(db: Session, db_dir: models.File):
+    # 目录的所有后代记录，父目录排在子项之前
+    query = scope_filter(db.query(models.File), db_dir.is_public, db_dir.user_id).filter(
+        subtree_filter(get_full_path(db_dir))
+    )
+    return query.order_by(func.length(models.File.path), models.File.id).all()
+
+def copy_files(db: Session, copies: List[Tuple[schemas.FileCreate, Optional[str]]], user_id: int, commit: bool = True):
+    """
+    为已经复制好的物理文件创建记录
+    copies: [(新记录, 内容存储中的数据块或 None), ...]，父目录排在子项之前
+    """
+    db_files = bulk_create_files(db, [file for file, _ in copies], user_id, commit=False)
+    counts = Counter(digest for _, digest in copies if digest)
+    for digest, count in counts.items():
+        db.query(models.Blob).filter(models.Blob.digest == digest).update(
+            {models.Blob.ref_count: models.Blob.ref_count + count}, synchronize_session=False
+        )
+    for db_file, (_, digest) in zip(db_files, copies):
+        db_file.content_hash = digest
+    _finish(db, commit)
+    return db_files
+
+# Content-addressed blob operations
+def attach_blob(db: Session, db_file: models.File, digest: str, commit: bool = True):
+    """
+    记录文件引用内容存储中的数据块，引用计数加一
+    """
+    if db_file.content_hash == digest:
         return db_file
-    return None
+    release_blobs(db, [db_file.content_hash])
+    # 同一事务中刚被释放的数据块重新被引用（如覆盖上传相同的内容），不再删除
+    db.info.get("orphaned_blobs", set()).discard(digest)
+    # 计数用 UPDATE 累加，多个 worker 同时引用同一数据块时不会丢失更新
+    updated = db.query(models.Blob).filter(models.Blob.digest == digest).update(
+        {models.Blob.ref_count: models.Blob.ref_count + 1}, synchronize_session=False
+    )
+    if not updated:
+        db.add(models.Blob(digest=digest, size=db_file.size or 0, ref_count=1))
+    db_file.content_hash = digest
+    _finish(db, commit)
+    return db_file
+
+def release_blobs(db: Session, digests: List[Optional[str]]):
+    """
+    引用计数减一，归零的数据块删除记录和磁盘上的数据
+    """
+    counts = Counter(digest for digest in digests if digest)
+    if not counts:
+        return
+    for digest, count in counts.items():
+        db.query(models.Blob).filter(models.Blob.digest == digest).update(
+            {models.Blob.ref_count: models.Blob.ref_count - count}, synchronize_session=False
+        )
+    orphaned = [row.digest for row in db.query(models.Blob.digest).filter(
+        models.Blob.digest.in_(list(counts)), models.Blob.ref_count <= 0
+    )]
+    if orphaned:
+        db.query(models.Blob).filter(models.Blob.digest.in_(orphaned)).delete(synchronize_session=False)
+        # 事务提交后才删除磁盘上的数据块，回滚时保留
+        db.info.setdefault("orphaned_blobs", set()).update(orphaned)
+
+@event.listens_for(Session, "after_commit")
+def _remove_orphaned_blobs(session):
+    orphaned = session.info.pop("orphaned_blobs", None)
+    if orphaned:
+        blob_store.remove(orphaned)
+
+@event.listens_for(Session, "after_rollback")
+def _keep_orphaned_blobs(session):
+    session.info.pop("orphaned_blobs", None)
+
+# Directory sync state operations
+def get_directory_state(db: Session, scope: str, path: str):
+    return db.query(models.DirectoryState).filter(
+        models.DirectoryState.scope == scope,
+        models.DirectoryState.path == path
+    ).first()
+
+def save_directory_state(db: Session, scope: str, path: str, mtime_ns: int, inode: int, commit: bool = True):
+    db_state = get_directory_state(db, scope, path)
+    if db_state:
+        db_state.mtime_ns = mtime_ns
+        db_state.inode = inode
+    else:
+        db_state = models.DirectoryState(scope=scope, path=path, mtime_ns=mtime_ns, inode=inode)
+        db.add(db_state)
+    _finish(db, commit)
+    return db_state
+
+def delete_directory_state(db: Session, scope: str, path: str, commit: bool = True):
+    db.query(models.DirectoryState).filter(
+        models.DirectoryState.scope == scope,
+        models.DirectoryState.path == path
+    ).delete(synchronize_session=False)
+    _finish(db, commit)
+
+# Chunked upload operations
+def create_upload_session(db: Session, upload_id: str, upload: schemas.UploadInit, chunk_size: int, user_id: int):
+    db_upload = models.UploadSession(
+        id=upload_id,
+        user_id=user_id,
+        name=upload.name,
+        path=upload.path,
+        is_public=upload.is_public,
+        mime_type=upload.mime_type,
+        size=upload.size,
+        chunk_size=chunk_size
+    )
+    db.add(db_upload)
+    db.commit()
+    db.refresh(db_upload)
+    return db_upload
+
+def get_upload_session(db: Session, upload_id: str):
+    return db.get(models.UploadSession, upload_id)
+
+def get_received_chunks(db: Session, upload_id: str):
+    rows = db.query(models.UploadChunk.index).filter(
+        models.UploadChunk.upload_id == upload_id
+    ).order_by(models.UploadChunk.index).all()
+    return [row[0] for row in rows]
+
+def save_upload_chunk(db: Session, upload_id: str, index: int, size: int, sha256: str):
+    # 重传同一个分片时覆盖之前的记录
+    db_chunk = db.get(models.UploadChunk, (upload_id, index))
+    if db_chunk:
+        db_chunk.size = size
+        db_chunk.sha256 = sha256
+    else:
+        db_chunk = models.UploadChunk(upload_id=upload_id, index=index, size=size, sha256=sha256)
+        db.add(db_chunk)
+    db.query(models.UploadSession).filter(models.UploadSession.id == upload_id).update(
+        {models.UploadSession.updated_at: func.now()}, synchronize_session=False
+    )
+    db.commit()
+    return db_chunk
+
+def delete_upload_session(db: Session, upload_id: str, commit: bool = True):
+    db.query(models.UploadChunk).filter(models.UploadChunk.upload_id == upload_id).delete(synchronize_session=False)
+    db.query(models.UploadSession).filter(models.UploadSession.id == upload_id).delete(synchronize_session=False)
+    _finish(db, commit)
+
+def get_stale_upload_sessions(db: Session, updated_before):
+    return db.query(models.UploadSession).filter(models.UploadSession.updated_at < updated_before).all()
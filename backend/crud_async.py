@@ -0,0 +1,21 @@
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, crud
+
+# crud 的异步版本，供 async def 的接口使用
+# 简单查询直接用 select() 实现；涉及目录聚合、搜索索引等的写操作
+# 通过 AsyncSession.run_sync 复用 crud 中的同步实现，SQL 仍然经由异步驱动执行
+
+async def get_user(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    return await db.get(models.User, user_id)
+
+async def get_user_by_username(db: AsyncSession, username: str) -> Optional[models.User]:
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def get_file(db: AsyncSession, file_id: int) -> Optional[models.File]:
+    return await db.get(models.File, file_id)
+
+async def update_file_size(db: AsyncSession, file_id: int, size: int, mtime: float = None):
+    return await db.run_sync(crud.update_file_size, file_id, size, mtime)
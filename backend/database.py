@@ -1,20 +1,81 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 
 # 默认使用 SQLite，如果环境变量中有 DATABASE_URL 则使用该值
 # 注意：如果是 SQLite，connect_args={"check_same_thread": False} 是必须的
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./neoshare.db")
 
+# 连接池：SQLite 每个连接都很便宜，主要用于限制并发；PostgreSQL 需要按服务端的 max_connections 调整
+# （每个 uvicorn worker 各有一个连接池，总连接数 = worker 数 × (DB_POOL_SIZE + DB_MAX_OVERFLOW)）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# 连接最长使用时间（秒），避免使用被服务端或中间代理关闭的连接
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# SQLite 连接参数，每个新连接建立时设置
+# WAL: 读写互不阻塞，多个 worker 进程同时读写时不再整体串行
+# synchronous=NORMAL: WAL 模式下只在检查点时 fsync，断电最多丢失最近的事务，不会损坏数据库
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+# 数据库被其他连接锁定时的最长等待时间（毫秒）
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+# 每个连接的页缓存大小（KB）
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+# 内存映射读取的最大字节数，0 表示关闭
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+is_sqlite = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
 connect_args = {}
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+engine_options = {}
+if is_sqlite:
+    connect_args = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT / 1000}
+    if ":memory:" not in SQLALCHEMY_DATABASE_URL and "mode=memory" not in SQLALCHEMY_DATABASE_URL:
+        engine_options = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+        }
+else:
+    engine_options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        # 取出连接前检查是否可用，数据库重启后不会报错
+        "pool_pre_ping": True,
+    }
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args
+    SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **engine_options
 )
 
+def sqlite_pragmas():
+    return [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+        f"PRAGMA cache_size={-SQLITE_CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+if is_sqlite:
+    event.listen(engine, "connect", _set_sqlite_pragmas)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -25,3 +86,46 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# 异步引擎：供 async def 的接口使用，查询期间不阻塞事件循环
+# SQLite 使用 aiosqlite，PostgreSQL 使用 asyncpg，可以用 ASYNC_DATABASE_URL 单独指定
+# 同步引擎仍然保留给线程池中的接口、后台线程以及 init_db 等脚本
+def _async_url(url: str):
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    for prefix in ("postgresql://", "postgresql+psycopg2://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(SQLALCHEMY_DATABASE_URL))
+
+# 首次使用时才创建，只使用同步引擎的脚本不需要安装异步驱动
+async_engine = None
+AsyncSessionLocal = None
+
+def get_async_engine():
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        async_connect_args = {}
+        async_options = dict(engine_options)
+        if is_sqlite:
+            async_connect_args = {"timeout": SQLITE_BUSY_TIMEOUT / 1000}
+            if async_options:
+                # 部分 SQLAlchemy 版本中 aiosqlite 默认不使用连接池，显式指定
+                async_options["poolclass"] = AsyncAdaptedQueuePool
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, connect_args=async_connect_args, **async_options)
+        if is_sqlite:
+            event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        # expire_on_commit=False: 提交后仍然可以读取对象的属性，异步会话中不能隐式地懒加载
+        AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
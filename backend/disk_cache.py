@@ -0,0 +1,137 @@
+import os
+import shutil
+import secrets
+import threading
+from typing import Iterable, Optional
+from .storage import UPLOAD_DIR
+
+# 基于磁盘的 LRU 缓存，用于渲染结果等可以重新生成的数据
+# 目录结构: <缓存目录>/<文件 id>/<版本>，版本由文件的 size/mtime 等组成，
+# 文件变化后旧版本不会再被读取，按文件 id 删除整个目录即可失效
+# 命中时更新缓存文件的 mtime，总大小超过上限时按 mtime 从旧到新淘汰，
+# 多个 uvicorn worker 共享同一个缓存目录
+
+CACHE_ROOT = os.path.join(UPLOAD_DIR, ".cache")
+
+class DiskCache:
+    def __init__(self, name: str, max_bytes: int):
+        self.directory = os.path.join(CACHE_ROOT, name)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 本进程估计的缓存总大小，首次写入时扫描目录得到
+        self._total = None
+
+    def _path(self, file_id: int, version: str):
+        return os.path.join(self.directory, str(file_id), version)
+
+    def get(self, file_id: int, version: str) -> Optional[str]:
+        """
+        返回缓存文件的路径，未命中时返回 None
+        """
+        path = self._path(file_id, version)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def read(self, file_id: int, version: str) -> Optional[bytes]:
+        path = self.get(file_id, version)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            # 读取期间被其他 worker 淘汰
+            return None
+
+    def put(self, file_id: int, version: str, data: bytes, keep_prefix: Optional[str] = None):
+        """
+        写入缓存：先写临时文件再重命名，读取方不会看到写了一半的内容
+        同一文件的旧版本会被删除；指定 keep_prefix 时保留名称以其开头的所有条目
+        （一个文件版本对应多个缓存条目，如 Notebook 中的各个图片）
+        """
+        if len(data) > self.max_bytes:
+            return
+        entry_dir = os.path.join(self.directory, str(file_id))
+        self._remove_entries(entry_dir, keep=keep_prefix or version, exact=keep_prefix is None)
+        os.makedirs(entry_dir, exist_ok=True)
+        temp_path = os.path.join(entry_dir, f".{secrets.token_hex(8)}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self._path(file_id, version))
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_total()
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def invalidate(self, file_ids: Iterable[int]):
+        # 只处理已有缓存的文件，批量删除大量记录时不会逐个访问磁盘
+        try:
+            cached = set(os.listdir(self.directory))
+        except OSError:
+            return
+        for file_id in file_ids:
+            if str(file_id) in cached:
+                shutil.rmtree(os.path.join(self.directory, str(file_id)), ignore_errors=True)
+
+    def cached_ids(self):
+        # 有缓存条目的文件 id
+        try:
+            return {int(name) for name in os.listdir(self.directory) if name.isdigit()}
+        except OSError:
+            return set()
+
+    def _remove_entries(self, entry_dir: str, keep: str, exact: bool = True):
+        try:
+            names = os.listdir(entry_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith("."):
+                # 其他写入方的临时文件
+                continue
+            if (name != keep) if exact else not name.startswith(keep):
+                try:
+                    os.remove(os.path.join(entry_dir, name))
+                except OSError:
+                    pass
+
+    def _entries(self):
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _scan_total(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        # 淘汰到上限的 90%，避免每次写入都触发扫描
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total = total
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        with self._lock:
+            self._total = 0
@@ -0,0 +1,70 @@
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from fastapi import Request, Response
+
+# HTTP 缓存校验：ETag / Last-Modified 以及 If-None-Match / If-Modified-Since 条件请求
+
+def file_etag(file_id: int, size: int, mtime: float, variant: str = ""):
+    """
+    强 ETag：文件 id + 大小 + 修改时间（纳秒），任意一项变化都会改变
+    variant: 同一文件的不同表示（如渲染后的预览）使用不同的前缀
+    """
+    prefix = f"{variant}-" if variant else ""
+    return f'"{prefix}{file_id:x}-{size:x}-{int(mtime * 1_000_000_000):x}"'
+
+def _etag_list(header: str):
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+def _opaque(tag: str):
+    # 弱比较：忽略 W/ 前缀
+    return tag[2:] if tag.startswith("W/") else tag
+
+def etag_matches(header: Optional[str], etag: str):
+    """
+    If-None-Match 的弱比较
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return _opaque(etag) in [_opaque(tag) for tag in _etag_list(header)]
+
+def etag_matches_strong(header: Optional[str], etag: str):
+    """
+    If-Match 的强比较，弱 ETag 永远不匹配
+    """
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return not etag.startswith("W/") and etag in _etag_list(header)
+
+def validator_headers(etag: str, mtime: Optional[float] = None, cache_control: str = "no-cache"):
+    # no-cache: 浏览器可以缓存，但每次使用前需要用 ETag 重新验证
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if mtime:
+        headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+    return headers
+
+def is_not_modified(request: Request, etag: str, mtime: Optional[float] = None):
+    """
+    按 RFC 9110 判断条件 GET/HEAD 是否可以返回 304
+    同时存在时 If-None-Match 优先，忽略 If-Modified-Since
+    """
+    if request.method not in ("GET", "HEAD"):
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and mtime:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP 日期只精确到秒
+        return int(mtime) <= since
+    return False
+
+def not_modified(headers: dict):
+    return Response(status_code=304, headers=headers)
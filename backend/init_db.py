@@ -1,9 +1,9 @@
 from .database import engine, Base, SessionLocal
-from . import models, auth
+from . import models, auth, migrations
 
 def init_db():
-    # 创建所有表
-    Base.metadata.create_all(bind=engine)
+    # 创建所有表并执行数据库迁移
+    migrations.upgrade(engine)
     
     db = SessionLocal()
     
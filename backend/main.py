@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from .routers import auth, users, files
+from .routers import auth, users, files, uploads
+from . import migrations, sync, content_index, notebook_preview, thumbnails, database, trash
 
 app = FastAPI(title="NeoShare API", version="1.0.0")
 
@@ -15,6 +16,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 from fastapi.staticfiles import StaticFiles
@@ -22,10 +24,32 @@ from fastapi.staticfiles import StaticFiles
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(files.router)
+app.include_router(uploads.router)
 
 # Mount uploads directory to serve static files (like avatars)
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+@app.on_event("startup")
+def on_startup():
+    migrations.upgrade()
+    if sync.SYNC_MODE == "background":
+        sync.start_reconciler()
+    content_index.start_indexer()
+    trash.start_cleaner()
+    notebook_preview.start_pool()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    sync.stop_reconciler()
+    content_index.stop_indexer()
+    trash.stop_cleaner()
+    notebook_preview.shutdown_pool()
+    thumbnails.shutdown_pool()
+
+@app.on_event("shutdown")
+async def on_async_shutdown():
+    await database.dispose_async_engine()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to NeoShare API"}
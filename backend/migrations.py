@@ -0,0 +1,152 @@
+from sqlalchemy import inspect, text
+from .database import engine, Base
+from . import models, search, content_index
+
+# 简单的版本化迁移：
+# 按顺序执行尚未执行过的迁移步骤，每个步骤都是幂等的，
+# 新建的数据库同样会执行一遍（用于创建 ORM 模型之外的对象，如全文索引）
+
+def _add_column(conn, table: str, column: str, ddl: str):
+    columns = [c["name"] for c in inspect(conn).get_columns(table)]
+    if column not in columns:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+def _migration_1(conn):
+    # 文件修改时间，用于增量同步
+    _add_column(conn, "files", "mtime", "FLOAT DEFAULT 0")
+
+def rebuild_directory_aggregates(conn):
+    """
+    根据文件记录重新计算所有目录的 size 和 file_count
+    """
+    rows = conn.execute(text("SELECT id, path, name, type, size, is_public, user_id FROM files")).fetchall()
+
+    def scope_of(row):
+        return "public" if row.is_public else str(row.user_id)
+
+    # (scope, 完整路径) -> 目录 id
+    directories = {}
+    for row in rows:
+        if row.type == "directory":
+            directories[(scope_of(row), f"{row.path.rstrip('/')}/{row.name}")] = row.id
+
+    totals = {dir_id: [0, 0] for dir_id in directories.values()}
+    for row in rows:
+        if row.type != "file":
+            continue
+        # 累加到所有祖先目录
+        parent = row.path.rstrip("/")
+        while parent:
+            dir_id = directories.get((scope_of(row), parent))
+            if dir_id is not None:
+                totals[dir_id][0] += row.size or 0
+                totals[dir_id][1] += 1
+            parent = parent.rsplit("/", 1)[0]
+
+    for dir_id, (size, count) in totals.items():
+        conn.execute(
+            text("UPDATE files SET size = :size, file_count = :count WHERE id = :id"),
+            {"size": size, "count": count, "id": dir_id}
+        )
+
+def _migration_2(conn):
+    # 目录聚合：大小与文件数在写入时维护，不再每次请求遍历磁盘
+    _add_column(conn, "files", "file_count", "INTEGER DEFAULT 0")
+    rebuild_directory_aggregates(conn)
+
+def _dedupe_files(conn):
+    # 同一作用域内同名的记录只保留 id 最小的一条（后代记录按路径归属，保持不变）
+    rows = conn.execute(text("SELECT id, path, name, is_public, user_id FROM files ORDER BY id")).fetchall()
+    seen = set()
+    duplicates = []
+    for row in rows:
+        key = ("public" if row.is_public else str(row.user_id), row.path, row.name)
+        if key in seen:
+            duplicates.append(row.id)
+        else:
+            seen.add(key)
+    for file_id in duplicates:
+        conn.execute(text("DELETE FROM files WHERE id = :id"), {"id": file_id})
+    return len(duplicates)
+
+def backfill_parent_ids(conn):
+    rows = conn.execute(text("SELECT id, path, name, type, is_public, user_id FROM files")).fetchall()
+
+    def scope_of(row):
+        return "public" if row.is_public else str(row.user_id)
+
+    directories = {
+        (scope_of(row), f"{row.path.rstrip('/')}/{row.name}"): row.id
+        for row in rows if row.type == "directory"
+    }
+    for row in rows:
+        parent_id = directories.get((scope_of(row), row.path.rstrip("/")))
+        conn.execute(text("UPDATE files SET parent_id = :parent_id WHERE id = :id"), {"parent_id": parent_id, "id": row.id})
+
+def _migration_3(conn):
+    # 复合/唯一索引与 parent_id 邻接列
+    _add_column(conn, "files", "parent_id", "INTEGER REFERENCES files(id)")
+    removed = _dedupe_files(conn)
+    if removed:
+        print(f"Removed {removed} duplicate file records")
+
+    # 被复合索引取代的单列索引
+    conn.execute(text("DROP INDEX IF EXISTS ix_files_path"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_files_is_public"))
+    # 只创建本步骤引入的索引：模型中后续迁移才添加的列上的索引由对应的迁移创建
+    indexes = {index.name: index for index in models.File.__table__.indexes}
+    for name in ("ix_files_public_path_name", "ix_files_private_owner_path_name", "ix_files_parent_id"):
+        indexes[name].create(conn, checkfirst=True)
+
+    backfill_parent_ids(conn)
+    rebuild_directory_aggregates(conn)
+
+def _migration_4(conn):
+    # 文件名全文索引 (FTS5 trigram / pg_trgm)
+    search.setup(conn)
+
+def _migration_5(conn):
+    # 文本内容索引
+    content_index.setup(conn)
+
+def _migration_6(conn):
+    # 内容寻址存储的数据块引用
+    _add_column(conn, "files", "content_hash", "VARCHAR")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_content_hash ON files (content_hash)"))
+
+MIGRATIONS = [
+    (1, _migration_1),
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def _get_version(conn):
+    row = conn.execute(text("SELECT version FROM schema_version")).first()
+    return row[0] if row else None
+
+def _set_version(conn, version: int):
+    conn.execute(text("DELETE FROM schema_version"))
+    conn.execute(text("INSERT INTO schema_version (version) VALUES (:v)"), {"v": version})
+
+def upgrade(bind=engine):
+    # 创建缺失的表（新表会直接包含所有列）
+    Base.metadata.create_all(bind=bind)
+
+    with bind.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+        current = _get_version(conn) or 0
+        for version, step in MIGRATIONS:
+            if version > current:
+                print(f"Applying migration {version}...")
+                step(conn)
+                _set_version(conn, version)
+                current = version
+    return current
+
+if __name__ == "__main__":
+    print(f"Schema version: {upgrade()}")
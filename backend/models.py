@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, BigInteger
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, BigInteger, Float, Index, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -23,13 +23,102 @@ class File(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+    parent_id = Column(Integer, ForeignKey("files.id"), nullable=True, index=True) # 父目录记录，根目录下为 NULL
     name = Column(String, nullable=False)
-    path = Column(String, index=True, nullable=False) # 存储在磁盘上的路径或相对路径
+    path = Column(String, nullable=False) # 存储在磁盘上的路径或相对路径
     type = Column(String, nullable=False) # file 或 directory
-    size = Column(BigInteger, default=0)
+    size = Column(BigInteger, default=0) # 目录的 size 为其下所有文件大小之和
+    file_count = Column(Integer, default=0) # 目录下（递归）的文件数量
     mime_type = Column(String, nullable=True)
-    is_public = Column(Boolean, default=False, index=True)
+    is_public = Column(Boolean, default=False)
+    mtime = Column(Float, default=0) # 物理文件的修改时间 (st_mtime)
+    content_hash = Column(String, nullable=True, index=True) # 内容存储中的数据块 (SHA-256)，未去重时为 NULL
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     owner = relationship("User", back_populates="files")
+
+    # 同一作用域内 (path, name) 唯一：公共区不区分上传者，私有区按用户区分
+    # 列表查询 (作用域, path) 和逐级目录查找 (作用域, path, name) 都可以直接命中这两个索引
+    __table_args__ = (
+        Index(
+            "ix_files_public_path_name", "path", "name", unique=True,
+            sqlite_where=is_public == True, postgresql_where=is_public == True
+        ),
+        Index(
+            "ix_files_private_owner_path_name", "user_id", "path", "name", unique=True,
+            sqlite_where=is_public == False, postgresql_where=is_public == False
+        ),
+    )
+
+class DirectoryState(Base):
+    """
+    物理目录的同步指纹，用于增量同步：
+    目录的 mtime/inode 未变化时跳过重新扫描
+    """
+    __tablename__ = "directory_states"
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False) # "public" 或用户 ID
+    path = Column(String, nullable=False) # 目录的相对路径，如 "/" 或 "/docs"
+    mtime_ns = Column(BigInteger, nullable=False)
+    inode = Column(BigInteger, nullable=False)
+    synced_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("ix_directory_states_scope_path", "scope", "path", unique=True),
+    )
+
+class FileContent(Base):
+    """
+    文本内容索引的状态：记录建立索引时文件的 size/mtime，变化时才重新索引
+    SQLite 下正文存放在 FTS5 表 file_contents_fts 中，PostgreSQL 下存放在 content 列
+    """
+    __tablename__ = "file_contents"
+
+    file_id = Column(Integer, ForeignKey("files.id", ondelete="CASCADE"), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    mtime = Column(Float, nullable=False)
+    content = Column(Text, nullable=True)
+    indexed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class UploadSession(Base):
+    """
+    分片上传会话：分片直接写入临时文件的对应偏移处，全部到齐后重命名为目标文件
+    """
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True) # 随机生成的上传 ID
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    name = Column(String, nullable=False)
+    path = Column(String, nullable=False) # 目标目录，如 "/" 或 "/docs"
+    is_public = Column(Boolean, default=False)
+    mime_type = Column(String, nullable=True)
+    size = Column(BigInteger, nullable=False) # 文件总大小
+    chunk_size = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    chunks = relationship("UploadChunk", cascade="all, delete-orphan", passive_deletes=True)
+
+class UploadChunk(Base):
+    """
+    已经写入并校验通过的分片
+    """
+    __tablename__ = "upload_chunks"
+
+    upload_id = Column(String, ForeignKey("upload_sessions.id", ondelete="CASCADE"), primary_key=True)
+    index = Column(Integer, primary_key=True, autoincrement=False)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String, nullable=False)
+
+class Blob(Base):
+    """
+    内容寻址存储中的数据块，ref_count 为引用它的文件记录数
+    """
+    __tablename__ = "blobs"
+
+    digest = Column(String, primary_key=True) # SHA-256 十六进制
+    size = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,179 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable
+from .disk_cache import DiskCache
+
+# Notebook 预览渲染及其磁盘缓存
+# 缓存按文件 id 组织，版本由渲染配置和文件的 size/mtime 组成，
+# 文件内容变化后自动使用新的版本，更新、上传和删除时清理旧的缓存
+# 渲染在独立的进程池中执行：worker 进程启动时预先导入 nbconvert 并创建 HTMLExporter，
+# 每个任务有超时和内存上限，超时的任务所在的进程池会被整体重建
+# 流式预览的页面（见 notebook_stream）也在这个进程池中渲染，与 JSON 预览共用缓存
+
+# 缓存总大小上限，默认 512MB
+NOTEBOOK_CACHE_MAX_BYTES = int(os.getenv("NOTEBOOK_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# 渲染进程数，0 表示在线程池中渲染（不使用子进程）
+NOTEBOOK_RENDER_WORKERS = int(os.getenv("NOTEBOOK_RENDER_WORKERS", "2"))
+# 单个 Notebook 的渲染超时（秒）
+NOTEBOOK_RENDER_TIMEOUT = float(os.getenv("NOTEBOOK_RENDER_TIMEOUT", "60"))
+# 每个渲染进程的地址空间上限（MB），0 表示不限制；仅在支持 resource 模块的平台生效
+NOTEBOOK_RENDER_MEMORY_MB = int(os.getenv("NOTEBOOK_RENDER_MEMORY_MB", "2048"))
+# 修改渲染方式（主题、模板等）时递增，使已有缓存失效
+RENDER_VERSION = 1
+THEME = "dark"
+
+preview_cache = DiskCache("notebooks", NOTEBOOK_CACHE_MAX_BYTES)
+# 流式预览中外置的图片和被截断输出的完整内容
+resource_cache = DiskCache("notebook-resources", NOTEBOOK_CACHE_MAX_BYTES)
+
+class RenderTimeout(Exception):
+    pass
+
+def file_version(file_stat: os.stat_result):
+    return f"v{RENDER_VERSION}-{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}"
+
+def cache_version(file_stat: os.stat_result):
+    return file_version(file_stat) + ".html"
+
+# 渲染进程中的 HTMLExporter，由 _init_worker 创建后复用
+_exporter = None
+
+def _get_exporter():
+    global _exporter
+    if _exporter is None:
+        from nbconvert import HTMLExporter
+        html_exporter = HTMLExporter()
+        html_exporter.theme = THEME # 尝试使用暗色主题
+        _exporter = html_exporter
+    return _exporter
+
+def _init_worker(memory_mb: int):
+    if memory_mb > 0:
+        try:
+            import resource
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+    # 预先导入 nbconvert 并渲染一个空 Notebook，加载模板
+    import nbformat
+    _get_exporter().from_notebook_node(nbformat.v4.new_notebook())
+
+def _ping():
+    return os.getpid()
+
+def render_notebook(file_path: str):
+    import nbformat
+
+    # 读取 notebook
+    with open(file_path, "r", encoding="utf-8") as f:
+        notebook_content = nbformat.read(f, as_version=4)
+
+    # 转换为 HTML
+    (body, resources) = _get_exporter().from_notebook_node(notebook_content)
+    return body
+
+_pool = None
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: 不从已经启动了后台线程的 uvicorn worker 中 fork
+        _pool = ProcessPoolExecutor(
+            max_workers=NOTEBOOK_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(NOTEBOOK_RENDER_MEMORY_MB,)
+        )
+    return _pool
+
+def _reset_pool(pool):
+    # 超时的任务无法取消，只能结束进程池中的所有进程
+    global _pool
+    if _pool is pool:
+        _pool = None
+    # 其他等待中的任务会收到 BrokenProcessPool，由 _render 在新的进程池中重试
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False)
+
+def start_pool():
+    """
+    启动渲染进程并完成预热，由应用启动时调用
+    """
+    if NOTEBOOK_RENDER_WORKERS <= 0:
+        return
+    pool = _get_pool()
+    for _ in range(NOTEBOOK_RENDER_WORKERS):
+        pool.submit(_ping)
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def run_in_pool(fn, *args):
+    """
+    在渲染进程池中执行 fn(*args)，超过 NOTEBOOK_RENDER_TIMEOUT 时抛出 RenderTimeout
+    """
+    loop = asyncio.get_running_loop()
+    if NOTEBOOK_RENDER_WORKERS <= 0:
+        return await asyncio.wait_for(loop.run_in_executor(None, fn, *args), NOTEBOOK_RENDER_TIMEOUT)
+    # 进程池因其他任务超时而被重建时重试一次
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            future = loop.run_in_executor(pool, fn, *args)
+            return await asyncio.wait_for(future, NOTEBOOK_RENDER_TIMEOUT)
+        except asyncio.TimeoutError:
+            _reset_pool(pool)
+            raise RenderTimeout(f"Rendering took longer than {NOTEBOOK_RENDER_TIMEOUT:g}s")
+        except BrokenProcessPool:
+            # 进程被杀死（例如超过内存上限）
+            _reset_pool(pool)
+            if attempt == 1:
+                raise
+
+# 正在渲染的任务，同一个 Notebook 的并发请求共享同一次渲染
+_inflight = {}
+
+def shared(key, factory):
+    """
+    同一个 key 只执行一次 factory()，并发的调用等待同一个任务
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(factory())
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: 某个请求断开时不取消其他请求仍在等待的渲染
+    return asyncio.shield(task)
+
+async def _render_and_store(file_id: int, version: str, file_path: str, file_stat: os.stat_result):
+    body = await run_in_pool(render_notebook, file_path)
+    # 同一文件版本的其他渲染结果（流式预览的各个变体）保留
+    await asyncio.to_thread(preview_cache.put, file_id, version, body.encode("utf-8"),
+                            keep_prefix=file_version(file_stat))
+    return body
+
+async def get_rendered(file_id: int, file_path: str, file_stat: os.stat_result):
+    """
+    返回渲染后的 HTML，优先读取缓存
+    """
+    version = cache_version(file_stat)
+    cached = await asyncio.to_thread(preview_cache.read, file_id, version)
+    if cached is not None:
+        return cached.decode("utf-8")
+    return await shared((file_id, version), lambda: _render_and_store(file_id, version, file_path, file_stat))
+
+def cached_ids():
+    return preview_cache.cached_ids() | resource_cache.cached_ids()
+
+def invalidate(file_ids: Iterable[int]):
+    file_ids = list(file_ids)
+    preview_cache.invalidate(file_ids)
+    resource_cache.invalidate(file_ids)
@@ -0,0 +1,277 @@
+import os
+import re
+import hmac
+import time
+import base64
+import asyncio
+import hashlib
+from html import escape
+from typing import Callable, Iterator, Optional
+from .notebook_preview import preview_cache, resource_cache, file_version, run_in_pool, shared
+
+# Notebook 流式预览：以 text/html 分块发送，不包在 JSON 中
+# 内嵌的 base64 图片可以外置为单独的资源（写入磁盘缓存，浏览器按需加载并长期缓存），
+# 超长的输出会被截断，完整内容同样作为资源按需加载
+# 页面在 notebook_preview 的进程池中渲染（超时和内存上限），资源链接写为占位符，
+# 渲染结果按文件版本和渲染参数缓存，发送时再把占位符替换为带签名和有效期的链接
+
+# 资源链接的有效期（秒），链接带签名，<img> 加载时不需要 Authorization 头
+RESOURCE_URL_TTL = 24 * 3600
+
+IMAGE_TYPES = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif", "image/svg+xml": "svg"}
+RESOURCE_MEDIA_TYPES = {
+    "png": "image/png", "jpg": "image/jpeg", "gif": "image/gif", "svg": "image/svg+xml",
+    "txt": "text/plain; charset=utf-8", "html": "text/html; charset=utf-8",
+}
+# 资源名包含文件版本和截断长度 (m)，资源被缓存淘汰后可以按相同的参数重新渲染得到
+RESOURCE_NAME = re.compile(r"^(v\d+-[0-9a-f]+-[0-9a-f]+)-m([0-9a-f]+)-c(\d+)-o(\d+)\.(png|jpg|gif|svg|txt|html)$")
+# 缓存页面中的资源链接占位符；Notebook 输出中恰好出现同样的文本时也会被替换，
+# 得到的只是这个文件自己的资源链接
+PLACEHOLDER_PREFIX = b"nb-resource:"
+PLACEHOLDER = re.compile(re.escape(PLACEHOLDER_PREFIX) + rb"([0-9a-z.-]+)")
+PLACEHOLDER_MAX_BYTES = 256
+
+STYLE = """
+body { margin: 0; background: #18181b; color: #e4e4e7; font-family: system-ui, sans-serif; }
+.nb-notebook { max-width: 1100px; margin: 0 auto; padding: 16px; }
+.nb-cell { display: flex; gap: 8px; margin: 12px 0; }
+.nb-prompt { flex: 0 0 80px; color: #71717a; font: 12px monospace; text-align: right; padding-top: 6px; }
+.nb-body { flex: 1; min-width: 0; }
+.nb-input .highlight { background: #27272a; border-radius: 4px; padding: 6px 8px; overflow-x: auto; }
+.nb-output { margin: 4px 0; overflow-x: auto; }
+pre.nb-text { margin: 0; white-space: pre-wrap; word-break: break-all; font: 13px monospace; }
+.nb-stderr { background: #3f1d1d; }
+.nb-image { max-width: 100%; background: #fff; }
+.nb-more { display: inline-block; margin-top: 4px; color: #60a5fa; font-size: 12px; }
+"""
+
+def sign_resource(file_id: int, name: str, expires: int):
+    # 渲染进程导入本模块时不加载 auth（及数据库）
+    from . import auth
+
+    message = f"{file_id}:{name}:{expires}".encode()
+    return hmac.new(auth.SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+def verify_resource(file_id: int, name: str, expires: int, signature: str):
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign_resource(file_id, name, expires), signature)
+
+def resource_expiry():
+    return int(time.time()) + RESOURCE_URL_TTL
+
+def load_notebook(file_path: str):
+    import nbformat
+
+    with open(file_path, "r", encoding="utf-8") as f:
+        return nbformat.read(f, as_version=4)
+
+def _join(value):
+    return "".join(value) if isinstance(value, list) else (value or "")
+
+def _image_bytes(mime: str, raw):
+    raw = _join(raw)
+    if mime == "image/svg+xml":
+        return raw.encode("utf-8")
+    return base64.b64decode(raw)
+
+class NotebookStreamRenderer:
+    """
+    images: external 外置图片 / inline 保留 data URI
+    max_output: 单个输出的最大字节数，超过时截断并提供完整内容的链接，0 表示不截断
+    resource_url: 根据资源名生成链接，缓存的页面中为占位符
+    """
+
+    def __init__(self, file_id: int, file_stat: os.stat_result, resource_url: Callable[[str], str],
+                 images: str = "external", max_output: int = 64 * 1024):
+        self.file_id = file_id
+        self.version = file_version(file_stat)
+        self.resource_url = resource_url
+        self.images = images
+        self.max_output = max_output
+
+    def render(self, notebook):
+        from pygments.formatters import HtmlFormatter
+
+        language = notebook.metadata.get("language_info", {}).get("name", "python")
+        yield (
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"/>"
+            "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1.0\"/>"
+            f"<style>{STYLE}{HtmlFormatter(style='monokai').get_style_defs('.nb-input .highlight')}</style>"
+            "</head><body><main class=\"nb-notebook\">\n"
+        )
+        cells = notebook.cells
+        for index in range(len(cells)):
+            cell, cells[index] = cells[index], None
+            try:
+                yield self.render_cell(index, cell, language)
+            except Exception as e:
+                yield f"<div class=\"nb-cell\"><pre class=\"nb-text nb-stderr\">{escape(f'Cell {index}: {e}')}</pre></div>\n"
+        yield "</main></body></html>\n"
+
+    def render_cell(self, index: int, cell, language: str):
+        source = _join(cell.get("source"))
+        if cell.cell_type == "markdown":
+            from nbconvert.filters.markdown_mistune import markdown2html_mistune
+            return f"<div class=\"nb-cell nb-markdown\"><div class=\"nb-prompt\"></div><div class=\"nb-body\">{markdown2html_mistune(source)}</div></div>\n"
+        if cell.cell_type != "code":
+            return f"<div class=\"nb-cell nb-raw\"><div class=\"nb-prompt\"></div><div class=\"nb-body\"><pre class=\"nb-text\">{escape(source)}</pre></div></div>\n"
+
+        count = cell.get("execution_count")
+        parts = [
+            f"<div class=\"nb-cell nb-code\"><div class=\"nb-prompt\">In [{count if count is not None else ' '}]:</div>"
+            f"<div class=\"nb-body\"><div class=\"nb-input\">{self.highlight(source, language)}</div>"
+        ]
+        for output_index, output in enumerate(cell.get("outputs", [])):
+            parts.append(self.render_output(index, output_index, output))
+        parts.append("</div></div>\n")
+        return "".join(parts)
+
+    def highlight(self, source: str, language: str):
+        from pygments import highlight
+        from pygments.formatters import HtmlFormatter
+        from pygments.lexers import get_lexer_by_name
+        from pygments.util import ClassNotFound
+
+        try:
+            lexer = get_lexer_by_name(language)
+        except ClassNotFound:
+            lexer = get_lexer_by_name("text")
+        return highlight(source, lexer, HtmlFormatter())
+
+    def _resource_name(self, cell_index: int, output_index: int, ext: str):
+        return f"{self.version}-m{self.max_output:x}-c{cell_index}-o{output_index}.{ext}"
+
+    def _store(self, cell_index: int, output_index: int, ext: str, data: bytes):
+        name = self._resource_name(cell_index, output_index, ext)
+        resource_cache.put(self.file_id, name, data, keep_prefix=self.version)
+        return self.resource_url(name)
+
+    def _more_link(self, url: str, size: int):
+        return f"<a class=\"nb-more\" href=\"{escape(url)}\" target=\"_blank\" rel=\"noopener\">输出已截断，查看完整内容 ({size // 1024} KB)</a>"
+
+    def text_block(self, cell_index: int, output_index: int, text: str, css: str = "", ansi: bool = False):
+        size = len(text.encode("utf-8"))
+        more = ""
+        if self.max_output and size > self.max_output:
+            url = self._store(cell_index, output_index, "txt", text.encode("utf-8"))
+            text = text.encode("utf-8")[:self.max_output].decode("utf-8", errors="ignore")
+            more = self._more_link(url, size)
+        if ansi:
+            from nbconvert.filters.ansi import ansi2html
+            body = ansi2html(text)
+        else:
+            body = escape(text)
+        return f"<div class=\"nb-output\"><pre class=\"nb-text {css}\">{body}</pre>{more}</div>"
+
+    def render_output(self, cell_index: int, output_index: int, output):
+        output_type = output.get("output_type")
+        if output_type == "stream":
+            name = output.get("name", "stdout")
+            return self.text_block(cell_index, output_index, _join(output.get("text")), f"nb-{name}", ansi=True)
+        if output_type == "error":
+            return self.text_block(cell_index, output_index, "\n".join(output.get("traceback", [])), "nb-stderr", ansi=True)
+
+        data = output.get("data", {})
+        for mime, ext in IMAGE_TYPES.items():
+            if mime in data:
+                return self.render_image(cell_index, output_index, mime, ext, data[mime], output.get("metadata", {}).get(mime, {}))
+        if "text/html" in data:
+            html = _join(data["text/html"])
+            size = len(html.encode("utf-8"))
+            if not self.max_output or size <= self.max_output:
+                return f"<div class=\"nb-output\">{html}</div>"
+            url = self._store(cell_index, output_index, "html", html.encode("utf-8"))
+            return f"<div class=\"nb-output\">{self._more_link(url, size)}</div>"
+        if "text/markdown" in data:
+            from nbconvert.filters.markdown_mistune import markdown2html_mistune
+            return f"<div class=\"nb-output\">{markdown2html_mistune(_join(data['text/markdown']))}</div>"
+        for mime in ("text/latex", "text/plain"):
+            if mime in data:
+                return self.text_block(cell_index, output_index, _join(data[mime]))
+        return ""
+
+    def render_image(self, cell_index: int, output_index: int, mime: str, ext: str, raw, metadata: dict):
+        size = ""
+        for attr in ("width", "height"):
+            if isinstance(metadata, dict) and metadata.get(attr):
+                size += f" {attr}=\"{escape(str(metadata[attr]))}\""
+        if self.images == "inline":
+            if mime == "image/svg+xml":
+                encoded = base64.b64encode(_join(raw).encode("utf-8")).decode("ascii")
+            else:
+                encoded = _join(raw).replace("\n", "")
+            src = f"data:{mime};base64,{encoded}"
+        else:
+            src = self._store(cell_index, output_index, ext, _image_bytes(mime, raw))
+        return f"<div class=\"nb-output\"><img class=\"nb-image\" src=\"{escape(src)}\" loading=\"lazy\"{size}/></div>"
+
+def resource_placeholder(name: str):
+    return PLACEHOLDER_PREFIX.decode("ascii") + name
+
+def page_version(file_stat: os.stat_result, images: str, max_output: int):
+    return f"{file_version(file_stat)}-{images}-m{max_output:x}.html"
+
+def render_page(file_id: int, file_path: str, file_stat: os.stat_result, images: str, max_output: int):
+    """
+    在渲染进程中执行：逐个单元格渲染，外置的资源直接写入磁盘缓存，返回资源链接为占位符的页面
+    """
+    notebook = load_notebook(file_path)
+    renderer = NotebookStreamRenderer(file_id, file_stat, resource_placeholder, images, max_output)
+    return "".join(renderer.render(notebook)).encode("utf-8")
+
+async def _render_and_store(file_id: int, version: str, file_path: str, file_stat: os.stat_result,
+                            images: str, max_output: int):
+    page = await run_in_pool(render_page, file_id, file_path, file_stat, images, max_output)
+    await asyncio.to_thread(preview_cache.put, file_id, version, page, keep_prefix=file_version(file_stat))
+    return page
+
+def _render_shared(file_id: int, file_path: str, file_stat: os.stat_result, images: str, max_output: int):
+    version = page_version(file_stat, images, max_output)
+    return shared((file_id, version), lambda: _render_and_store(file_id, version, file_path, file_stat, images, max_output))
+
+async def get_page(file_id: int, file_path: str, file_stat: os.stat_result, images: str = "external",
+                   max_output: int = 64 * 1024) -> bytes:
+    """
+    返回渲染后的页面，优先读取缓存
+    """
+    version = page_version(file_stat, images, max_output)
+    cached = await asyncio.to_thread(preview_cache.read, file_id, version)
+    if cached is not None:
+        return cached
+    return await _render_shared(file_id, file_path, file_stat, images, max_output)
+
+def stream_page(page: bytes, resource_url: Callable[[str], str], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    生成器：分块发送页面，并把占位符替换为 resource_url 生成的链接，分块时不切开占位符
+    """
+    def replace(match):
+        name = match.group(1).decode("ascii")
+        if not RESOURCE_NAME.match(name):
+            return match.group(0)
+        return escape(resource_url(name)).encode("ascii")
+
+    start = 0
+    while start < len(page):
+        end = start + chunk_size
+        if end < len(page):
+            position = page.rfind(PLACEHOLDER_PREFIX, max(start, end - PLACEHOLDER_MAX_BYTES),
+                                  end + len(PLACEHOLDER_PREFIX) - 1)
+            if position > start:
+                end = position
+        yield PLACEHOLDER.sub(replace, page[start:end])
+        start = end
+
+def get_resource(file_id: int, name: str) -> Optional[bytes]:
+    return resource_cache.read(file_id, name)
+
+async def regenerate_resource(file_id: int, file_path: str, file_stat: os.stat_result, name: str) -> Optional[bytes]:
+    """
+    资源已被缓存淘汰时，按资源名中的参数重新渲染整个页面：一次渲染写回这个页面的所有资源，
+    同时请求的多个资源共享同一次渲染；文件已经变化时返回 None
+    """
+    match = RESOURCE_NAME.match(name)
+    if not match or match.group(1) != file_version(file_stat):
+        return None
+    await _render_shared(file_id, file_path, file_stat, "external", int(match.group(2), 16))
+    return await asyncio.to_thread(get_resource, file_id, name)
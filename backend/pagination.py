@@ -0,0 +1,89 @@
+import json
+import base64
+from typing import Optional
+from sqlalchemy import or_, and_, func
+from . import models
+
+# 文件列表的游标分页（keyset pagination）
+# 游标是对 (排序值, id) 的不透明编码，下一页直接从该位置之后开始查询，
+# 不需要 OFFSET 跳过前面的行，翻到多深都是同样的代价
+
+SORT_COLUMNS = {
+    "name": models.File.name,
+    "size": func.coalesce(models.File.size, 0),
+    "mtime": func.coalesce(models.File.mtime, 0),
+}
+# 游标中排序值允许的类型
+SORT_VALUE_TYPES = {
+    "name": (str,),
+    "size": (int,),
+    "mtime": (int, float),
+}
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(data: dict):
+    raw = json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(data, dict):
+        raise InvalidCursor("Invalid cursor")
+    return data
+
+def _sort_value(db_file: models.File, sort: str):
+    if sort in ("size", "mtime"):
+        return getattr(db_file, sort) or 0
+    return getattr(db_file, sort)
+
+def apply_keyset(query, sort: str, order: str, cursor: Optional[str]):
+    """
+    按 (排序列, id) 排序，并从游标位置之后开始
+    """
+    column = SORT_COLUMNS[sort]
+    descending = order == "desc"
+    if cursor:
+        data = decode_cursor(cursor)
+        if data.get("s") != sort or data.get("o") != order or "i" not in data:
+            raise InvalidCursor("Cursor does not match the requested sort order")
+        value, last_id = data.get("v"), data["i"]
+        # 游标来自客户端，类型不对时会在数据库中出错；bool 是 int 的子类，需要单独排除
+        if not isinstance(last_id, int) or isinstance(last_id, bool):
+            raise InvalidCursor("Invalid cursor")
+        if value is None and sort != "name":
+            # 排序列中的 NULL 按 0 排序
+            value = 0
+        if isinstance(value, bool) or not isinstance(value, SORT_VALUE_TYPES[sort]):
+            raise InvalidCursor("Invalid cursor")
+        if descending:
+            query = query.filter(or_(column < value, and_(column == value, models.File.id < last_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, models.File.id > last_id)))
+    if descending:
+        return query.order_by(column.desc(), models.File.id.desc())
+    return query.order_by(column, models.File.id)
+
+def next_keyset_cursor(last: models.File, sort: str, order: str):
+    return encode_cursor({"s": sort, "o": order, "v": _sort_value(last, sort), "i": last.id})
+
+def apply_offset_cursor(query, cursor: Optional[str]):
+    """
+    相关度排序的搜索结果无法使用 keyset，游标中记录偏移量
+    返回 (query, offset)
+    """
+    offset = 0
+    if cursor:
+        data = decode_cursor(cursor)
+        if "n" not in data or not isinstance(data["n"], int) or data["n"] < 0:
+            raise InvalidCursor("Cursor does not match the requested sort order")
+        offset = data["n"]
+    return query.offset(offset), offset
+
+def next_offset_cursor(offset: int):
+    return encode_cursor({"n": offset})
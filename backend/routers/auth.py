@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from .. import database, crud, auth, schemas
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import database, crud, crud_async, auth, schemas
 
 router = APIRouter(
     prefix="/api/auth",
@@ -9,9 +10,9 @@ router = APIRouter(
 )
 
 @router.post("/login", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = crud.get_user_by_username(db, form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.password_hash):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
+    user = await crud_async.get_user_by_username(db, form_data.username)
+    if not user or not await auth.authenticate_user(db, user, form_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Header, Response, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional
 import shutil
+import stat
 import os
-from .. import database, crud, schemas, auth, models
+import mimetypes
+from urllib.parse import quote
+from .. import database, crud, crud_async, schemas, auth, models, sync, content_index, pagination, upload_stream, http_cache, notebook_preview, notebook_stream, blob_store, trash, archive, thumbnails, text_content
+from ..storage import UPLOAD_DIR, get_storage_path, get_physical_path, atomic_write, clone_file
+from ..sync import sync_directory_to_db
 
 from fastapi.security import OAuth2PasswordBearer
 
@@ -13,13 +21,11 @@ router = APIRouter(
     tags=["files"],
 )
 
-UPLOAD_DIR = "uploads"
-
 oauth2_scheme = auth.oauth2_scheme
 # 定义一个可选的认证方案，允许未登录访问
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
-async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optional), db: Session = Depends(database.get_db)):
+async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optional), db: AsyncSession = Depends(database.get_async_db)):
     if not token:
         return None
     try:
@@ -27,11 +33,31 @@ async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optiona
     except HTTPException:
         return None
 
-def get_storage_path(is_public: bool, user_id: int = None):
-    if is_public:
-        return os.path.join(UPLOAD_DIR, "public")
-    else:
-        return os.path.join(UPLOAD_DIR, str(user_id))
+def get_missing_directories(db: Session, target_dir_path: str, is_public: bool, user_id: int):
+    """
+    返回目标路径上数据库中还不存在的目录记录
+    target_dir_path: 形如 "A/B" 的相对路径
+    """
+    missing = []
+    current_check_path = ""
+    for part in target_dir_path.split("/"):
+        if not part: continue
+        p_path = current_check_path or "/"
+        current_check_path = f"{current_check_path}/{part}"
+        
+        # 检查 DB 是否存在该目录；父目录缺失时其下的目录也必然缺失
+        if not missing and crud.get_directory(db, current_check_path, is_public, user_id):
+            continue
+        
+        missing.append(schemas.FileCreate(
+            name=part,
+            path=p_path,
+            type="directory",
+            size=0,
+            mime_type=None,
+            is_public=is_public
+        ))
+    return missing
 
 @router.post("/upload", response_model=schemas.FileResponse)
 def upload_file(
@@ -66,43 +92,6 @@ def upload_file(
     else:
         full_dir = os.path.join(base_dir, target_dir_path)
     
-    # 递归创建 DB 目录记录
-    parts = target_dir_path.split("/")
-    current_check_path = ""
-    for part in parts:
-        if not part: continue
-        current_check_path = f"{current_check_path}/{part}"
-        
-        # 检查 DB 是否存在该目录
-        query = db.query(models.File).filter(
-            models.File.path == (os.path.dirname(current_check_path).replace("\\", "/") if os.path.dirname(current_check_path) != "/" else "/"),
-            models.File.name == part,
-            models.File.type == "directory",
-            models.File.is_public == is_public_bool
-        )
-        if not is_public_bool:
-            query = query.filter(models.File.user_id == user_id)
-            
-        existing_dir = query.first()
-        
-        if not existing_dir:
-            # 创建 DB 记录
-            # parent_path = os.path.dirname(current_check_path)
-            # if parent_path == "/": path = "/" else path = parent_path
-            p_path = os.path.dirname(current_check_path).replace("\\", "/")
-            if p_path == "/" or p_path == "":
-                p_path = "/"
-                
-            new_dir_data = schemas.FileCreate(
-                name=part,
-                path=p_path,
-                type="directory",
-                size=0,
-                mime_type=None,
-                is_public=is_public_bool
-            )
-            crud.create_file(db, new_dir_data, user_id)
-            
     # 确保物理目录存在
     os.makedirs(full_dir, exist_ok=True)
     
@@ -112,11 +101,23 @@ def upload_file(
     # 我们取消主动检查，直接尝试写入，如果真的空间不足，OS 会抛出异常
     
     file_path = os.path.join(full_dir, file.filename)
+    # 先写入同目录下的临时文件再替换，覆盖上传时不会原地截断已有文件（可能与其他文件共享数据块）
+    temp_path = os.path.join(full_dir, f".{file.filename}.{os.getpid()}.{id(file)}.upload")
+    hasher = blob_store.new_hasher()
     
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        with open(temp_path, "wb") as buffer:
+            while True:
+                block = file.file.read(1024 * 1024)
+                if not block:
+                    break
+                buffer.write(block)
+                if hasher:
+                    hasher.update(block)
+        os.replace(temp_path, file_path)
     except Exception as e:
+         if os.path.exists(temp_path):
+             os.remove(temp_path)
          import traceback
          traceback.print_exc()
          raise HTTPException(status_code=500, detail=f"Error saving file to disk: {str(e)}")
@@ -124,22 +125,12 @@ def upload_file(
         file.file.close()
 
     try:
-        file_size = os.path.getsize(file_path)
-        mime_type = file.content_type
-        
-        db_path = "/" + target_dir_path if target_dir_path else "/"
-        
-        file_data = schemas.FileCreate(
-            name=file.filename,
-            path=db_path,
-            type="file",
-            size=file_size,
-            mime_type=mime_type,
-            is_public=is_public_bool
+        return register_uploaded_file(
+            db, file_path, file.filename, file.content_type, target_dir_path, is_public_bool, user_id,
+            content_hash=hasher.hexdigest() if hasher else None
         )
-        
-        return crud.create_file(db=db, file=file_data, user_id=user_id)
     except Exception as e:
+        db.rollback()
         # 如果 DB 失败，删除已上传的文件
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -147,6 +138,125 @@ def upload_file(
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@router.post("/upload/stream", response_model=List[schemas.FileResponse])
+async def upload_file_stream(
+    request: Request,
+    path: Optional[str] = Query(None, description="Target directory, may also be sent as a form field"),
+    is_public: Optional[str] = Query(None, description="true or false, may also be sent as a form field"),
+    db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_user)
+):
+    """
+    与 /upload 的表单格式相同，但请求体边接收边解析，文件内容直接写入磁盘，
+    不占用线程池，也不会先生成 Starlette 的临时文件
+    """
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Authentication required for upload")
+    user_id = current_user.id
+
+    try:
+        parser = upload_stream.StreamingFormParser(request.headers.get("content-type", ""))
+        parts = await parser.parse(request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 文件先写入 uploads/.partial，表单字段的先后顺序不影响目标目录
+    path = parser.fields.get("path", path) or "/"
+    is_public_bool = (parser.fields.get("is_public", is_public) or "false").lower() == "true"
+    base_dir = get_storage_path(is_public_bool, user_id)
+    target_dir_path = path.strip("/").replace("..", "")
+    full_dir = os.path.join(base_dir, target_dir_path) if target_dir_path else base_dir
+
+    results = []
+    try:
+        for part in parts:
+            if part.filename in ("", ".", ".."):
+                raise HTTPException(status_code=400, detail="Invalid file name")
+        os.makedirs(full_dir, exist_ok=True)
+        while parts:
+            part = parts.pop(0)
+            file_path = os.path.join(full_dir, part.filename)
+            os.replace(part.temp_path, file_path)
+            try:
+                results.append(await run_in_threadpool(
+                    register_uploaded_file, db, file_path, part.filename, part.content_type,
+                    target_dir_path, is_public_bool, user_id, part.digest
+                ))
+            except Exception as e:
+                db.rollback()
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                import traceback
+                traceback.print_exc()
+                raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    finally:
+        for part in parts:
+            part.discard()
+    return results
+
+# 并发上传到同一个新目录时，缺失的目录记录可能被其他请求抢先创建，重试时会读取到它们
+REGISTER_RETRIES = 3
+
+def register_uploaded_file(db: Session, file_path: str, filename: str, mime_type: Optional[str], target_dir_path: str, is_public: bool, user_id: int,
+                           content_hash: Optional[str] = None):
+    """
+    为已经写入磁盘的上传文件创建或更新数据库记录
+    target_dir_path: 形如 "A/B" 的相对路径
+    content_hash: 写入时计算的 SHA-256，启用内容寻址存储时用于去重
+    """
+    # 先纳入内容存储（可能替换为已有数据块的硬链接），再按最终的文件状态登记
+    content_hash = blob_store.ingest(file_path, content_hash) if blob_store.enabled() else None
+    for attempt in range(REGISTER_RETRIES):
+        try:
+            return _register_uploaded_file(db, file_path, filename, mime_type, target_dir_path, is_public, user_id, content_hash)
+        except IntegrityError:
+            db.rollback()
+            if attempt == REGISTER_RETRIES - 1:
+                raise
+
+def _register_uploaded_file(db: Session, file_path: str, filename: str, mime_type: Optional[str], target_dir_path: str, is_public: bool, user_id: int,
+                            content_hash: Optional[str] = None):
+    file_stat = os.stat(file_path)
+    file_size = file_stat.st_size
+    
+    db_path = "/" + target_dir_path if target_dir_path else "/"
+    
+    # 文件写入完成后再修改数据库，缺失的目录记录和文件记录在同一个事务中提交，
+    # 避免在上传期间长时间持有数据库写锁
+    crud.bulk_create_files(db, get_missing_directories(db, target_dir_path, is_public, user_id), user_id, commit=False)
+    
+    # 覆盖上传同名文件时更新已有记录，祖先目录只累加大小差值
+    query = db.query(models.File).filter(
+        models.File.path == db_path,
+        models.File.name == filename,
+        models.File.type == "file"
+    )
+    existing_file = crud.scope_filter(query, is_public, user_id).first()
+    if existing_file:
+        if not content_hash:
+            return crud.update_file_size(db, existing_file.id, file_size, file_stat.st_mtime)
+        db_file = crud.update_file_size(db, existing_file.id, file_size, file_stat.st_mtime, commit=False)
+        crud.attach_blob(db, db_file, content_hash)
+        db.refresh(db_file)
+        return db_file
+    
+    file_data = schemas.FileCreate(
+        name=filename,
+        path=db_path,
+        type="file",
+        size=file_size,
+        mime_type=mime_type,
+        is_public=is_public,
+        mtime=file_stat.st_mtime
+    )
+    
+    if not content_hash:
+        return crud.create_file(db=db, file=file_data, user_id=user_id)
+    db_file = crud.create_file(db=db, file=file_data, user_id=user_id, commit=False)
+    crud.attach_blob(db, db_file, content_hash)
+    db.refresh(db_file)
+    return db_file
+
 class DirectoryCreate(schemas.BaseModel):
     name: str
     path: str
@@ -176,8 +286,16 @@ def create_directory(
     except OSError as e:
         raise HTTPException(status_code=400, detail=f"Failed to create directory: {e}")
         
-    # 检查是否已存在同名记录
-    # 这里简单处理，实际上应该检查 DB
+    # 检查是否已存在同名记录 (作用域内 path + name 唯一)
+    query = db.query(models.File).filter(
+        models.File.path == dir_data.path,
+        models.File.name == dir_data.name
+    )
+    existing = crud.scope_filter(query, dir_data.is_public, current_user.id).first()
+    if existing:
+        if existing.type != "directory":
+            raise HTTPException(status_code=400, detail="A file with the same name already exists")
+        return existing
     
     file_data = schemas.FileCreate(
         name=dir_data.name,
@@ -207,187 +325,226 @@ def list_files(
     # 但是我们怎么在同一个函数里处理？
     pass
 
-# 辅助函数：计算目录大小
-def calculate_directory_size(path: str):
-    total_size = 0
-    try:
-        for dirpath, dirnames, filenames in os.walk(path):
-            # 忽略隐藏目录，阻止 os.walk 进入
-            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
-            
-            for f in filenames:
-                # 忽略隐藏文件
-                if f.startswith('.'):
-                    continue
-                    
-                fp = os.path.join(dirpath, f)
-                if not os.path.islink(fp):
-                    total_size += os.path.getsize(fp)
-    except OSError:
-        pass
-    return total_size
+# 流式返回时每次从数据库游标取出的行数
+STREAM_BATCH_SIZE = 500
 
-# 辅助函数：同步物理目录到数据库
-def sync_directory_to_db(db: Session, base_dir: str, current_path: str, is_public: bool, user_id: int, depth: int = 0):
+class ListParams:
     """
-    递归扫描物理目录并更新数据库
-    base_dir: 物理根目录 (e.g. uploads/public)
-    current_path: 当前相对路径 (e.g. /)
-    depth: 递归深度限制，防止过深
+    文件列表与搜索共用的分页参数
+    limit + cursor: 游标分页，下一页的游标通过 X-Next-Cursor 响应头返回
+    format=ndjson: 按行流式返回，内存占用与结果数量无关
     """
-    # 限制递归深度，防止死循环或性能问题
-    if depth > 5:
-        return
+    def __init__(
+        self,
+        offset: int = Query(0, ge=0, description="Result offset (prefer cursor)"),
+        limit: Optional[int] = Query(None, ge=1, le=1000, description="Page size"),
+        cursor: Optional[str] = Query(None, description="Opaque cursor from X-Next-Cursor"),
+        sort: Optional[str] = Query(None, pattern="^(name|size|mtime)$", description="name, size or mtime"),
+        order: str = Query("asc", pattern="^(asc|desc)$"),
+        format: str = Query("json", pattern="^(json|ndjson)$"),
+    ):
+        self.offset = offset
+        self.limit = limit
+        self.cursor = cursor
+        self.sort = sort
+        self.order = order
+        self.format = format
 
-    physical_path = os.path.join(base_dir, current_path.strip("/").replace("..", ""))
-    if not os.path.exists(physical_path):
-        return
+def _ordered_query(query, params: ListParams, ranked: bool):
+    """
+    ranked: 搜索结果且未指定排序时按相关度排序，游标中记录偏移量
+    其余情况按 (排序列, id) 做 keyset 分页
+    返回 (query, 当前偏移量)，偏移量仅对相关度排序有意义
+    """
+    try:
+        if ranked:
+            if params.cursor:
+                return pagination.apply_offset_cursor(query, params.cursor)
+            return query.offset(params.offset), params.offset
+        query = pagination.apply_keyset(query, params.sort or "name", params.order, params.cursor)
+    except pagination.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if params.offset and not params.cursor:
+        query = query.offset(params.offset)
+    return query, 0
 
-    # 获取物理目录下的所有项
+def _stream_files(build_query, params: ListParams, ranked: bool):
+    # 使用独立的会话：响应体在请求依赖清理之后才开始发送
+    db = database.SessionLocal()
     try:
-        items = os.listdir(physical_path)
-    except OSError:
-        return
+        query, _ = _ordered_query(build_query(db), params, ranked)
+        if params.limit:
+            query = query.limit(params.limit)
+        for db_file in query.yield_per(STREAM_BATCH_SIZE):
+            yield schemas.FileResponse.model_validate(db_file).model_dump_json() + "\n"
+    finally:
+        db.close()
 
-    # 获取 DB 中该路径下的所有项
-    db_files = crud.get_files(db, path=current_path, is_public=is_public, user_id=user_id)
-    
-    # 修复重复文件问题：
-    # 如果 DB 中存在同名文件，保留一个，删除其他的
-    # 我们使用字典来追踪已见过的名字
-    seen_files = {}
-    duplicates_to_delete = []
-    
-    for f in db_files:
-        if f.name in seen_files:
-            duplicates_to_delete.append(f)
-        else:
-            seen_files[f.name] = f
-            
-    # 删除重复的记录
-    for dup in duplicates_to_delete:
-        crud.delete_file(db, dup.id)
-        
-    # 使用去重后的字典
-    db_file_map = seen_files
-    
-    # 遍历物理项
-    for item_name in items:
-        item_path = os.path.join(physical_path, item_name)
-        is_dir = os.path.isdir(item_path)
-        item_type = "directory" if is_dir else "file"
-        
-        # 忽略系统文件
-        if item_name.startswith("."):
-            continue
+def list_files_response(db: Session, build_query, params: ListParams, response: Response, ranked: bool = False):
+    """
+    build_query(db) 返回未排序的文件查询
+    """
+    # 先在当前会话中构造一次，游标无效时在开始响应前返回 400
+    query, offset = _ordered_query(build_query(db), params, ranked)
 
-        if item_name not in db_file_map:
-            # DB 中不存在，创建记录
-            size = 0
-            mime_type = None
-            if not is_dir:
-                size = os.path.getsize(item_path)
-                import mimetypes
-                mime_type, _ = mimetypes.guess_type(item_path)
-            else:
-                # 计算目录大小
-                size = calculate_directory_size(item_path)
-            
-            new_file = schemas.FileCreate(
-                name=item_name,
-                path=current_path,
-                type=item_type,
-                size=size,
-                mime_type=mime_type,
-                is_public=is_public
-            )
-            crud.create_file(db, new_file, user_id)
-            
-            # 如果是目录，递归同步
-            # ... (保持原样)
+    if params.format == "ndjson":
+        return StreamingResponse(_stream_files(build_query, params, ranked), media_type="application/x-ndjson")
+
+    if not params.limit:
+        return query.all()
+
+    # 多取一行用于判断是否还有下一页
+    items = query.limit(params.limit + 1).all()
+    if len(items) > params.limit:
+        items = items[:params.limit]
+        if ranked:
+            next_cursor = pagination.next_offset_cursor(offset + params.limit)
         else:
-            # DB 中存在，检查是否需要更新（例如大小）
-            db_item = db_file_map[item_name]
-            new_size = 0
-            if not is_dir:
-                new_size = os.path.getsize(item_path)
-            else:
-                new_size = calculate_directory_size(item_path)
-                
-            if db_item.size != new_size:
-                crud.update_file_size(db, db_item.id, new_size)
-            
-            # 从 map 中移除，表示已处理
-            del db_file_map[item_name]
-            
-            # 同样，去掉递归调用
-            # if is_dir:
-            #     sync_directory_to_db(db, base_dir, f"{current_path}/{item_name}".replace("//", "/"), is_public, user_id, depth + 1)
-
-    # 处理 DB 中存在但物理上不存在的项 (db_file_map 中剩余的)
-    # 暂时不删除，或者标记为丢失？
-    # 为了保持一致性，应该删除 DB 记录
-    for missing_name, missing_record in db_file_map.items():
-        crud.delete_file(db, missing_record.id)
+            next_cursor = pagination.next_keyset_cursor(items[-1], params.sort or "name", params.order)
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+def normalize_path(path: str):
+    path = path.strip()
+    if path != "/" and path.endswith("/"):
+        path = path.rstrip("/")
+    if path.endswith("/."):
+        path = path[:-2]
+    if path == "": path = "/"
+    return path
 
 @router.get("/list/public", response_model=List[schemas.FileResponse])
 def list_public_files(
+    response: Response,
     path: str = Query("/", description="Directory path"),
     search: Optional[str] = Query(None, description="Search query"),
+    scoped: bool = Query(False, description="Only search under path"),
+    params: ListParams = Depends(),
     db: Session = Depends(database.get_db)
 ):
     # Normalize path
-    path = path.strip()
-    if path != "/" and path.endswith("/"):
-        path = path.rstrip("/")
-    if path.endswith("/."):
-        path = path[:-2]
-    if path == "": path = "/"
+    path = normalize_path(path)
 
     # 如果有 search，则搜索 public 目录下的所有文件
     if search:
         # 搜索时不强制 sync，或者只 sync 根目录？
         # 搜索通常是全库搜索，不依赖于当前 path
-        # 简单的实现：在 DB 中搜索
-        return crud.search_files(db, query=search, is_public=True)
+        # 在 DB 的全文索引中搜索，scoped=true 时只搜索当前目录及其子目录
+        ranked = params.sort is None
+        return list_files_response(db, lambda session: crud.search_files_query(
+            session, query=search, is_public=True,
+            path_prefix=path if scoped else None, ranked=ranked
+        ), params, response, ranked=ranked)
     
     # 正常列表逻辑...
-    base_dir = get_storage_path(True)
-    # ... (原有逻辑)
-    admin_user = crud.get_user_by_username(db, "admin")
-    admin_id = admin_user.id if admin_user else 1 # Fallback
-    
-    sync_directory_to_db(db, base_dir, path, True, admin_id)
+    # background 模式下由后台协调线程同步，这里直接读取数据库
+    if sync.SYNC_MODE != "background":
+        base_dir = get_storage_path(True)
+        admin_id = sync.get_public_owner_id(db)
+        sync_directory_to_db(db, base_dir, path, True, admin_id)
     
-    return crud.get_files(db, path=path, is_public=True)
+    return list_files_response(db, lambda session: crud.get_files_query(session, path=path, is_public=True), params, response)
 
 @router.get("/list/private", response_model=List[schemas.FileResponse])
 def list_private_files(
+    response: Response,
     path: str = Query("/", description="Directory path"),
     search: Optional[str] = Query(None, description="Search query"),
+    scoped: bool = Query(False, description="Only search under path"),
+    params: ListParams = Depends(),
     db: Session = Depends(database.get_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     # Normalize path
-    path = path.strip()
-    if path != "/" and path.endswith("/"):
-        path = path.rstrip("/")
-    if path.endswith("/."):
-        path = path[:-2]
-    if path == "": path = "/"
+    path = normalize_path(path)
+    user_id = current_user.id
 
     if search:
-        return crud.search_files(db, query=search, is_public=False, user_id=current_user.id)
+        ranked = params.sort is None
+        return list_files_response(db, lambda session: crud.search_files_query(
+            session, query=search, is_public=False, user_id=user_id,
+            path_prefix=path if scoped else None, ranked=ranked
+        ), params, response, ranked=ranked)
 
-    base_dir = get_storage_path(False, current_user.id)
-    sync_directory_to_db(db, base_dir, path, False, current_user.id)
+    if sync.SYNC_MODE != "background":
+        base_dir = get_storage_path(False, user_id)
+        sync_directory_to_db(db, base_dir, path, False, user_id)
     
-    return crud.get_files(db, path=path, is_public=False, user_id=current_user.id)
+    return list_files_response(
+        db, lambda session: crud.get_files_query(session, path=path, is_public=False, user_id=user_id),
+        params, response
+    )
 
 
-@router.get("/download/{file_id}")
+@router.get("/search/content", response_model=List[schemas.ContentSearchResult])
+def search_file_contents(
+    q: str = Query(..., min_length=1, description="Search query"),
+    type: str = Query("public", description="public or private"),
+    path: Optional[str] = Query(None, description="Only search under this directory"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_user)
+):
+    """
+    搜索文本文件和 Notebook 的内容，只查询后台建立的内容索引，不读取磁盘
+    """
+    if type == "private":
+        if not current_user:
+            raise HTTPException(status_code=401, detail="Authentication required")
+        results = crud.search_file_contents(
+            db, query=q, is_public=False, user_id=current_user.id,
+            path_prefix=path, limit=limit, offset=offset
+        )
+    else:
+        results = crud.search_file_contents(
+            db, query=q, is_public=True, path_prefix=path, limit=limit, offset=offset
+        )
+    return [{"file": file_record, "snippet": snippet} for file_record, snippet in results]
+
+# 文件下载的发送方式：
+# python: 由 uvicorn worker 读取文件并发送（默认，开发环境无需额外配置）
+# nginx: 鉴权后返回 X-Accel-Redirect，由 Nginx 的 internal location 通过 sendfile 发送
+# sendfile: 返回 X-Sendfile（Apache mod_xsendfile / lighttpd），值为文件的绝对路径
+DOWNLOAD_BACKEND = os.getenv("DOWNLOAD_BACKEND", "python")
+# Nginx 中映射到 uploads 目录的 internal location
+DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX", "/_protected_uploads/")
+
+def content_disposition(disposition_type: str, filename: str):
+    # 与 FileResponse 生成的格式相同，非 ASCII 文件名使用 RFC 5987 编码
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"{disposition_type}; filename*=utf-8''{quoted}"
+    return f'{disposition_type}; filename="{filename}"'
+
+def send_file(file_path: str, filename: str, disposition_type: str, headers: dict, file_stat: os.stat_result):
+    """
+    按 DOWNLOAD_BACKEND 发送文件，调用前需要完成权限检查
+    """
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if DOWNLOAD_BACKEND == "nginx":
+        # Range、条件请求和 Content-Length 都由 Nginx 处理
+        relative_path = os.path.relpath(os.path.abspath(file_path), os.path.abspath(UPLOAD_DIR)).replace(os.sep, "/")
+        headers = dict(headers)
+        headers["X-Accel-Redirect"] = DOWNLOAD_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative_path)
+        headers["Content-Disposition"] = content_disposition(disposition_type, filename)
+        return Response(headers=headers, media_type=media_type)
+    if DOWNLOAD_BACKEND == "sendfile":
+        headers = dict(headers)
+        headers["X-Sendfile"] = os.path.abspath(file_path)
+        headers["Content-Disposition"] = content_disposition(disposition_type, filename)
+        return Response(headers=headers, media_type=media_type)
+    # Range（包括多段 Range）和 If-Range 由 FileResponse 处理，
+    # preview 模式下音视频可以直接拖动进度条
+    return FileResponse(
+        file_path, filename=filename, content_disposition_type=disposition_type,
+        headers=headers, stat_result=file_stat, media_type=media_type
+    )
+
+@router.api_route("/download/{file_id}", methods=["GET", "HEAD"])
 def download_file(
     file_id: int,
+    request: Request,
     preview: bool = False,
     db: Session = Depends(database.get_db),
     current_user: Optional[models.User] = Depends(get_optional_user) # 使用自定义的可选认证
@@ -411,11 +568,115 @@ def download_file(
     # 简单的路径拼接
     file_path = os.path.join(base_dir, file_record.path.strip("/"), file_record.name)
     
-    if not os.path.exists(file_path):
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+         raise HTTPException(status_code=404, detail="File on disk not found")
+    if not stat.S_ISREG(file_stat.st_mode):
          raise HTTPException(status_code=404, detail="File on disk not found")
-         
+
+    # ETag 按磁盘上的实际大小和修改时间计算，文件在数据库同步之前被修改也能识别
+    etag = http_cache.file_etag(file_record.id, file_stat.st_size, file_stat.st_mtime)
+    headers = http_cache.validator_headers(
+        etag, file_stat.st_mtime,
+        cache_control="public, no-cache" if file_record.is_public else "private, no-cache"
+    )
+    if http_cache.is_not_modified(request, etag, file_stat.st_mtime):
+        return http_cache.not_modified(headers)
+
     content_disposition_type = "inline" if preview else "attachment"
-    return FileResponse(file_path, filename=file_record.name, content_disposition_type=content_disposition_type)
+    return send_file(file_path, file_record.name, content_disposition_type, headers, file_stat)
+
+# 打包下载的文件数上限
+ARCHIVE_MAX_FILES = int(os.getenv("ARCHIVE_MAX_FILES", "100000"))
+ARCHIVE_FORMATS = {"zip": "application/zip", "tar.gz": "application/gzip"}
+
+def unique_name(name: str, used: set):
+    # 选中的多个项目同名时（来自不同目录），在扩展名前添加序号
+    candidate = name
+    stem, ext = os.path.splitext(name)
+    index = 1
+    while candidate in used:
+        candidate = f"{stem} ({index}){ext}"
+        index += 1
+    used.add(candidate)
+    return candidate
+
+def archive_entry(db_file: models.File, arcname: str):
+    # 按磁盘上的实际大小打包；磁盘上已不存在的文件跳过
+    file_path = get_physical_path(db_file)
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        return None
+    if db_file.type == "directory":
+        return archive.ArchiveEntry(arcname, None, 0, file_stat.st_mtime, is_dir=True)
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
+    return archive.ArchiveEntry(arcname, file_path, file_stat.st_size, file_stat.st_mtime)
+
+def collect_archive_entries(db: Session, db_files: List[models.File]):
+    entries = []
+    used_names = set()
+    for db_file in db_files:
+        arcname = unique_name(db_file.name, used_names)
+        entry = archive_entry(db_file, arcname)
+        if entry is None:
+            continue
+        entries.append(entry)
+        if db_file.type != "directory":
+            continue
+        # 后代记录的包内路径由相对于所选目录的路径得到
+        prefix_length = len(crud.get_full_path(db_file))
+        for child in crud.get_subtree(db, db_file):
+            relative_dir = child.path[prefix_length:].strip("/")
+            child_entry = archive_entry(child, "/".join(filter(None, [arcname, relative_dir, child.name])))
+            if child_entry is not None:
+                entries.append(child_entry)
+        if len(entries) > ARCHIVE_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Too many files (max {ARCHIVE_MAX_FILES})")
+    return entries
+
+@router.get("/archive")
+def download_archive(
+    ids: List[int] = Query(...),
+    format: str = "zip",
+    compression: str = "store",
+    db: Session = Depends(database.get_db),
+    current_user: Optional[models.User] = Depends(get_optional_user)
+):
+    """
+    把目录或多个文件打包下载，边读取边发送，不生成临时文件
+    ids 可以重复传入，目录会包含其所有内容；format: zip / tar.gz；compression (zip): store / deflate
+    """
+    if format not in ARCHIVE_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be zip or tar.gz")
+    if compression not in ("store", "deflate"):
+        raise HTTPException(status_code=400, detail="compression must be store or deflate")
+    file_ids = list(dict.fromkeys(ids))
+    records = {db_file.id: db_file for db_file in crud.get_files_by_ids(db, file_ids)}
+    if len(records) != len(file_ids):
+        raise HTTPException(status_code=404, detail="File not found")
+    # 权限只需检查所选项目本身：目录的后代与目录位于同一存储空间
+    for db_file in records.values():
+        if not db_file.is_public:
+            if not current_user or (current_user.id != db_file.user_id and current_user.role != "admin"):
+                raise HTTPException(status_code=403, detail="Not authorized")
+
+    selected = [records[file_id] for file_id in file_ids]
+    entries = collect_archive_entries(db, selected)
+    db.close()
+
+    base_name = selected[0].name if len(selected) == 1 and selected[0].type == "directory" else "download"
+    headers = {"Content-Disposition": content_disposition("attachment", f"{base_name}.{format}")}
+    if format == "tar.gz":
+        body = archive.stream_tar_gz(entries)
+    else:
+        body = archive.stream_zip(entries, compression)
+        if compression == "store":
+            # 不压缩时大小由文件大小和文件名长度决定，客户端可以显示下载进度
+            headers["Content-Length"] = str(archive.zip_size(entries))
+    return StreamingResponse(body, media_type=ARCHIVE_FORMATS[format], headers=headers)
 
 @router.delete("/{file_id}")
 def delete_file(
@@ -430,26 +691,214 @@ def delete_file(
     if current_user.role != "admin" and current_user.id != file_record.user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    # 删除物理文件
-    if file_record.is_public:
-        base_dir = get_storage_path(True)
-    else:
-        base_dir = get_storage_path(False, file_record.user_id)
-    
-    file_path = os.path.join(base_dir, file_record.path.strip("/"), file_record.name)
-    
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        
-    crud.delete_file(db, file_id)
+    file_path = get_physical_path(file_record)
+
+    # 目录连同所有后代记录一起删除：后代记录是一条按路径前缀的批量 DELETE，祖先目录的聚合值只更新一次
+    # 物理文件先整体重命名到回收区再提交，提交成功后才交给后台线程删除，接口的耗时与目录大小无关
+    crud.delete_file(db, file_id, commit=False)
+    trash_path = None
+    if os.path.lexists(file_path):
+        try:
+            trash_path = trash.move_to_trash(file_path)
+        except OSError as e:
+            db.rollback()
+            raise HTTPException(status_code=500, detail=f"Failed to delete file: {e}")
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        if trash_path:
+            trash.restore(trash_path, file_path)
+        raise
+    if trash_path:
+        trash.wake(trash_path)
     return {"message": "File deleted"}
 
-@router.get("/content/{file_id}")
-async def get_file_content(
+def check_name(name: str):
+    # 以 . 开头的名称会被同步忽略
+    if not name or name.startswith(".") or "/" in name or "\\" in name:
+        raise HTTPException(status_code=400, detail="Invalid file name")
+    return name
+
+def resolve_target_dir(db: Session, target_path: str, is_public: bool, user_id: int):
+    """
+    返回 (目标目录记录, 规范化后的路径)，根目录的记录为 None
+    """
+    parts = [part for part in target_path.replace("\\", "/").split("/") if part and part != "."]
+    if ".." in parts:
+        raise HTTPException(status_code=400, detail="Invalid target path")
+    target_path = "/" + "/".join(parts)
+    if target_path == "/":
+        return None, target_path
+    target_dir = crud.get_directory(db, target_path, is_public, user_id)
+    if not target_dir:
+        raise HTTPException(status_code=404, detail="Target directory not found")
+    return target_dir, target_path
+
+def check_not_inside(db_file: models.File, target_path: str):
+    # 目录不能移动或复制到自身或其后代中
+    full_path = crud.get_full_path(db_file)
+    if db_file.type == "directory" and (target_path == full_path or target_path.startswith(full_path + "/")):
+        raise HTTPException(status_code=400, detail="Cannot move or copy a directory into itself")
+
+def check_target_free(db: Session, target_path: str, name: str, is_public: bool, user_id: int, physical_path: str):
+    query = db.query(models.File.id).filter(models.File.path == target_path, models.File.name == name)
+    if crud.scope_filter(query, is_public, user_id).first() or os.path.lexists(physical_path):
+        raise HTTPException(status_code=409, detail="A file with the same name already exists in the target directory")
+
+@router.post("/{file_id}/move", response_model=schemas.FileResponse)
+def move_file(
     file_id: int,
+    move: schemas.FileMove,
     db: Session = Depends(database.get_db),
-    token: Optional[str] = Depends(oauth2_scheme_optional)
+    current_user: models.User = Depends(auth.get_current_active_user)
 ):
+    """
+    移动或重命名文件/目录（同一存储空间内）
+    物理上是一次 os.rename，数据库中目录的整个子树只需要一条批量 UPDATE
+    """
+    file_record = crud.get_file(db, file_id)
+    if not file_record:
+        raise HTTPException(status_code=404, detail="File not found")
+    if current_user.role != "admin" and current_user.id != file_record.user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    name = check_name(move.name if move.name is not None else file_record.name)
+    target_dir, target_path = resolve_target_dir(
+        db, move.target_path if move.target_path is not None else file_record.path,
+        file_record.is_public, file_record.user_id
+    )
+    if target_path == file_record.path and name == file_record.name:
+        return file_record
+    check_not_inside(file_record, target_path)
+
+    source_path = get_physical_path(file_record)
+    base_dir = get_storage_path(file_record.is_public, file_record.user_id)
+    destination_path = os.path.join(base_dir, target_path.strip("/"), name)
+    check_target_free(db, target_path, name, file_record.is_public, file_record.user_id, destination_path)
+    if not os.path.lexists(source_path):
+        raise HTTPException(status_code=404, detail="File on disk not found")
+
+    # 先修改数据库（不提交），重命名成功后再提交；提交失败时把文件移回原处
+    try:
+        crud.move_file(db, file_record, target_dir, target_path, name, commit=False)
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="A file with the same name already exists in the target directory")
+    try:
+        os.rename(source_path, destination_path)
+    except OSError as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to move file: {e}")
+    try:
+        db.commit()
+    except Exception:
+        db.rollback()
+        os.rename(destination_path, source_path)
+        raise
+    db.refresh(file_record)
+    return file_record
+
+def copy_physical(source_path: str, destination_path: str, content_hash: Optional[str]):
+    """
+    复制单个文件，返回新文件引用的数据块
+    启用内容寻址存储且原文件已去重时只创建硬链接，否则使用 reflink 或复制数据
+    """
+    if content_hash and blob_store.enabled() and blob_store.link_copy(content_hash, destination_path):
+        return content_hash
+    clone_file(source_path, destination_path)
+    return None
+
+@router.post("/{file_id}/copy", response_model=schemas.FileResponse)
+def copy_file(
+    file_id: int,
+    copy: schemas.FileCopy,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """
+    在服务端复制文件或目录，可以复制到公共区或自己的私有区
+    """
+    file_record = crud.get_file(db, file_id)
+    if not file_record:
+        raise HTTPException(status_code=404, detail="File not found")
+    if not file_record.is_public and current_user.role != "admin" and current_user.id != file_record.user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    is_public = file_record.is_public if copy.is_public is None else copy.is_public
+    name = check_name(copy.name if copy.name is not None else file_record.name)
+    target_dir, target_path = resolve_target_dir(
+        db, copy.target_path if copy.target_path is not None else file_record.path, is_public, current_user.id
+    )
+    same_scope = is_public == file_record.is_public and (is_public or file_record.user_id == current_user.id)
+    if same_scope:
+        check_not_inside(file_record, target_path)
+
+    source_root = get_physical_path(file_record)
+    base_dir = get_storage_path(is_public, current_user.id)
+    destination_root = os.path.join(base_dir, target_path.strip("/"), name)
+    check_target_free(db, target_path, name, is_public, current_user.id, destination_root)
+    if not os.path.lexists(source_root):
+        raise HTTPException(status_code=404, detail="File on disk not found")
+
+    def new_record(db_file: models.File, path: str, item_name: str, physical_path: str):
+        item_stat = os.stat(physical_path)
+        return schemas.FileCreate(
+            name=item_name,
+            path=path,
+            type=db_file.type,
+            size=0 if db_file.type == "directory" else item_stat.st_size,
+            mime_type=db_file.mime_type,
+            is_public=is_public,
+            mtime=item_stat.st_mtime
+        )
+
+    copies = []
+    try:
+        os.makedirs(os.path.dirname(destination_root), exist_ok=True)
+        if file_record.type == "directory":
+            os.mkdir(destination_root)
+            copies.append((new_record(file_record, target_path, name, destination_root), None))
+            # 以数据库中的记录为准复制子树，父目录排在子项之前
+            source_full_path = crud.get_full_path(file_record)
+            destination_full_path = f"{target_path.rstrip('/')}/{name}"
+            for item in crud.get_subtree(db, file_record):
+                relative = (item.path[len(source_full_path):].strip("/") + "/" + item.name).strip("/")
+                item_source = os.path.join(source_root, relative)
+                item_destination = os.path.join(destination_root, relative)
+                item_path = destination_full_path + item.path[len(source_full_path):]
+                if item.type == "directory":
+                    os.makedirs(item_destination, exist_ok=True)
+                    digest = None
+                else:
+                    try:
+                        digest = copy_physical(item_source, item_destination, item.content_hash)
+                    except FileNotFoundError:
+                        # 磁盘上已经不存在，下次同步时会删除原记录
+                        continue
+                copies.append((new_record(item, item_path, item.name, item_destination), digest))
+        else:
+            digest = copy_physical(source_root, destination_root, file_record.content_hash)
+            copies.append((new_record(file_record, target_path, name, destination_root), digest))
+        db_files = crud.copy_files(db, copies, current_user.id)
+    except Exception as e:
+        db.rollback()
+        if os.path.isdir(destination_root) and not os.path.islink(destination_root):
+            shutil.rmtree(destination_root, ignore_errors=True)
+        elif os.path.lexists(destination_root):
+            os.remove(destination_root)
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, (IntegrityError, FileExistsError)):
+            raise HTTPException(status_code=409, detail="A file with the same name already exists in the target directory")
+        raise HTTPException(status_code=500, detail=f"Failed to copy file: {e}")
+    db.refresh(db_files[0])
+    return db_files[0]
+
+async def get_text_file(db: AsyncSession, file_id: int, token: Optional[str], edit: bool = False):
+    """
+    文本内容接口共用的查找和权限检查，返回 (文件记录, 物理路径)
+    """
     current_user = None
     if token:
         try:
@@ -457,36 +906,91 @@ async def get_file_content(
         except Exception:
             pass
 
-    file_record = crud.get_file(db, file_id)
+    file_record = await crud_async.get_file(db, file_id)
     if not file_record:
         raise HTTPException(status_code=404, detail="File not found")
-        
+
+    # 私有文件：必须登录且是拥有者或管理员；公共文件允许未登录用户读取和编辑（根据需求开放）
     if not file_record.is_public:
         if not current_user or (current_user.id != file_record.user_id and current_user.role != "admin"):
-             raise HTTPException(status_code=403, detail="Not authorized")
-    
-    # 物理路径
-    if file_record.is_public:
-        base_dir = get_storage_path(True)
-    else:
-        base_dir = get_storage_path(False, file_record.user_id)
-        
-    file_path = os.path.join(base_dir, file_record.path.strip("/"), file_record.name)
-    
-    if not os.path.exists(file_path):
+            raise HTTPException(status_code=403, detail="Not authorized to edit this file" if edit else "Not authorized")
+    return file_record, get_physical_path(file_record)
+
+def content_etag(file_id: int, file_stat: Optional[os.stat_result]):
+    # 文本内容的版本号，与下载接口的 ETag 相同；编辑器保存时通过 If-Match 带回
+    if file_stat is None:
+        return None
+    return http_cache.file_etag(file_id, file_stat.st_size, file_stat.st_mtime)
+
+def stat_or_none(file_path: str):
+    try:
+        return os.stat(file_path)
+    except OSError:
+        return None
+
+def version_check(file_id: int, file_path: str, if_match: Optional[str]):
+    """
+    If-Match 与文件当前版本不一致时返回 412；不带 If-Match 时不检查（无条件覆盖）
+    返回的函数在替换文件前于锁内再检查一次，并发保存时只有一个能成功
+    """
+    if if_match is None:
+        return None
+
+    def check():
+        etag = content_etag(file_id, stat_or_none(file_path))
+        if etag is None or not http_cache.etag_matches_strong(if_match, etag):
+            raise HTTPException(
+                status_code=412, detail="File has been modified since it was loaded",
+                headers={"ETag": etag} if etag else None
+            )
+
+    check()
+    return check
+
+@router.get("/content/{file_id}")
+async def get_file_content(
+    file_id: int,
+    response: Response,
+    offset: Optional[int] = Query(None, ge=0, description="Read by byte range starting at this offset"),
+    length: int = Query(text_content.TEXT_RANGE_MAX_BYTES, ge=0, description="Byte range length"),
+    line: Optional[int] = Query(None, ge=0, description="Read by line range starting at this line (0-based)"),
+    lines: int = Query(1000, ge=1, description="Number of lines to read"),
+    db: AsyncSession = Depends(database.get_async_db),
+    token: Optional[str] = Depends(oauth2_scheme_optional)
+):
+    """
+    读取文本内容：不指定范围时返回整个文件（不超过 TEXT_CONTENT_MAX_BYTES），
+    大文件用 offset/length 按字节或 line/lines 按行分段读取，返回的 end 是下一段的 offset
+    ETag（同时在 etag 字段中返回）是文件的版本号，修改时通过 If-Match 带回
+    """
+    file_record, file_path = await get_text_file(db, file_id, token)
+    await db.close()
+
+    # 先取版本号再读取：读取期间文件被替换时，保存会得到 412 而不是覆盖新的内容
+    file_stat = stat_or_none(file_path)
+    if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
          raise HTTPException(status_code=404, detail="File on disk not found")
-         
-    # 仅允许读取文本类文件
-    allowed_mimes = ["text/plain", "text/markdown", "application/json", "application/javascript", "text/x-python", "text/html", "text/css"]
-    # 或者尝试读取，如果不是文本则报错
-    # 为了简单，我们只返回文本内容。前端根据 mime_type 决定是否调用此接口。
-    
+    etag = content_etag(file_record.id, file_stat)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-store"
+
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
-        return {"content": content, "mime_type": file_record.mime_type}
+        if offset is not None:
+            result = await run_in_threadpool(text_content.read_range, file_path, offset, length)
+        elif line is not None:
+            result = await run_in_threadpool(text_content.read_lines, file_path, line, lines)
+        else:
+            if file_stat.st_size > text_content.TEXT_CONTENT_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="File is too large, read it in ranges with offset/length or line/lines")
+            content = await run_in_threadpool(text_content.read_text, file_path)
+            return {"content": content, "mime_type": file_record.mime_type, "etag": etag}
+        result["mime_type"] = file_record.mime_type
+        result["etag"] = etag
+        return result
     except UnicodeDecodeError:
          raise HTTPException(status_code=400, detail="Binary file cannot be edited as text")
+    except HTTPException:
+        raise
     except Exception as e:
          raise HTTPException(status_code=500, detail=str(e))
 
@@ -497,52 +1001,73 @@ class FileUpdate(schemas.BaseModel):
 async def update_file_content(
     file_id: int,
     update: FileUpdate,
-    db: Session = Depends(database.get_db),
+    response: Response,
+    if_match: Optional[str] = Header(None, description="ETag returned when the content was loaded"),
+    db: AsyncSession = Depends(database.get_async_db),
     token: Optional[str] = Depends(oauth2_scheme_optional)
 ):
-    current_user = None
-    if token:
-        try:
-            current_user = await auth.get_current_user(token, db)
-        except Exception:
-            pass
-
-    file_record = crud.get_file(db, file_id)
-    if not file_record:
-        raise HTTPException(status_code=404, detail="File not found")
-        
-    # 权限检查
-    if not file_record.is_public:
-        # 私有文件：必须登录且是拥有者或管理员
-        if not current_user or (current_user.role != "admin" and current_user.id != file_record.user_id):
-            raise HTTPException(status_code=403, detail="Not authorized to edit this file")
-    else:
-        # 公共文件：允许未登录用户编辑（根据需求开放）
-        pass
-    
-    if file_record.is_public:
-        base_dir = get_storage_path(True)
-    else:
-        base_dir = get_storage_path(False, file_record.user_id)
-        
-    file_path = os.path.join(base_dir, file_record.path.strip("/"), file_record.name)
+    """
+    整体保存：写入临时文件后替换，读取方不会看到写了一半的内容
+    带 If-Match 时，文件在加载之后被修改过则返回 412
+    """
+    file_record, file_path = await get_text_file(db, file_id, token, edit=True)
+    check = version_check(file_record.id, file_path, if_match)
     
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(update.content)
-            
-        # 更新文件大小
-        new_size = os.path.getsize(file_path)
-        crud.update_file_size(db, file_id, new_size)
-        
-        return {"message": "File updated"}
+        # 不原地写入：文件可能与其他文件共享内容存储中的数据块
+        file_stat = await run_in_threadpool(atomic_write, file_path, update.content.encode("utf-8"), check)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    # 更新文件大小
+    await crud_async.update_file_size(db, file_id, file_stat.st_size, file_stat.st_mtime)
+    etag = content_etag(file_record.id, file_stat)
+    response.headers["ETag"] = etag
+    return {"message": "File updated", "etag": etag}
+
+@router.patch("/content/{file_id}")
+async def patch_file_content(
+    file_id: int,
+    patch: schemas.FilePatch,
+    response: Response,
+    if_match: Optional[str] = Header(None, description="ETag of the version the offsets refer to"),
+    db: AsyncSession = Depends(database.get_async_db),
+    token: Optional[str] = Depends(oauth2_scheme_optional)
+):
+    """
+    按字节偏移替换部分内容，只需要提交修改的部分；保存方式与整体更新相同（临时文件 + 替换）
+    偏移依赖于文件的版本，应当总是带上 If-Match
+    """
+    file_record, file_path = await get_text_file(db, file_id, token, edit=True)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="File on disk not found")
+    check = version_check(file_record.id, file_path, if_match)
+
+    edits = [(edit.offset, edit.length, edit.text.encode("utf-8")) for edit in patch.edits]
+    try:
+        file_stat = await run_in_threadpool(text_content.apply_edits, file_path, edits, check)
+    except text_content.TextRangeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    await crud_async.update_file_size(db, file_id, file_stat.st_size, file_stat.st_mtime)
+    etag = content_etag(file_record.id, file_stat)
+    response.headers["ETag"] = etag
+    return {"message": "File updated", "size": file_stat.st_size, "etag": etag}
+
 @router.get("/preview/{file_id}")
 async def preview_ipynb(
     file_id: int,
-    db: Session = Depends(database.get_db),
+    request: Request,
+    format: str = Query("json", pattern="^(json|html)$", description="json: full render in {html}; html: streamed text/html"),
+    images: str = Query("external", pattern="^(external|inline)$", description="html format: externalize embedded images"),
+    max_output: int = Query(64 * 1024, ge=0, description="html format: truncate outputs larger than this (bytes), 0 = never"),
+    db: AsyncSession = Depends(database.get_async_db),
     token: Optional[str] = Depends(oauth2_scheme_optional)
 ):
     """
@@ -555,7 +1080,7 @@ async def preview_ipynb(
         except Exception:
             pass
 
-    file_record = crud.get_file(db, file_id)
+    file_record = await crud_async.get_file(db, file_id)
     if not file_record:
         raise HTTPException(status_code=404, detail="File not found")
         
@@ -566,30 +1091,151 @@ async def preview_ipynb(
     if not file_record.name.endswith(".ipynb"):
          raise HTTPException(status_code=400, detail="Not a notebook file")
 
-    if file_record.is_public:
-        base_dir = get_storage_path(True)
-    else:
-        base_dir = get_storage_path(False, file_record.user_id)
-        
-    file_path = os.path.join(base_dir, file_record.path.strip("/"), file_record.name)
+    file_path = get_physical_path(file_record)
+    # 渲染和流式发送可能持续较长时间，提前归还数据库连接
+    await db.close()
     
-    if not os.path.exists(file_path):
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
          raise HTTPException(status_code=404, detail="File on disk not found")
-         
+
+    # 渲染结果只取决于文件内容和渲染配置，未变化时浏览器直接使用本地缓存
+    if format == "html":
+        variant = f"nbs{notebook_preview.RENDER_VERSION}-{images}-{max_output:x}"
+    else:
+        variant = f"nb{notebook_preview.RENDER_VERSION}"
+    etag = http_cache.file_etag(file_record.id, file_stat.st_size, file_stat.st_mtime, variant=variant)
+    headers = http_cache.validator_headers(
+        etag, file_stat.st_mtime,
+        cache_control="public, no-cache" if file_record.is_public else "private, no-cache"
+    )
+    if http_cache.is_not_modified(request, etag, file_stat.st_mtime):
+        return http_cache.not_modified(headers)
+
+    if format == "html":
+        try:
+            page = await notebook_stream.get_page(file_record.id, file_path, file_stat, images, max_output)
+        except notebook_preview.RenderTimeout as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
+        expires = notebook_stream.resource_expiry()
+
+        def resource_url(name: str):
+            url = request.url_for("get_preview_resource", file_id=file_record.id, name=name)
+            signature = notebook_stream.sign_resource(file_record.id, name, expires)
+            return f"{url}?expires={expires}&signature={signature}"
+
+        # Notebook 中的 text/html、text/markdown 输出原样发送，以独立页面打开时不能在本站点下执行脚本
+        headers["Content-Security-Policy"] = "sandbox"
+        headers["X-Content-Type-Options"] = "nosniff"
+        # 同步生成器由 StreamingResponse 在线程池中迭代，分块替换资源链接并发送
+        return StreamingResponse(
+            notebook_stream.stream_page(page, resource_url),
+            media_type="text/html; charset=utf-8", headers=headers
+        )
+
     try:
-        from nbconvert import HTMLExporter
-        import nbformat
-        
-        # 读取 notebook
-        with open(file_path, "r", encoding="utf-8") as f:
-            notebook_content = nbformat.read(f, as_version=4)
-            
-        # 转换为 HTML
-        html_exporter = HTMLExporter()
-        html_exporter.theme = "dark" # 尝试使用暗色主题
-        (body, resources) = html_exporter.from_notebook_node(notebook_content)
-        
-        return {"html": body}
+        body = await notebook_preview.get_rendered(file_record.id, file_path, file_stat)
+        return JSONResponse({"html": body}, headers=headers)
+    except notebook_preview.RenderTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         print(f"Conversion error: {e}")
         raise HTTPException(status_code=500, detail=f"Conversion failed: {str(e)}")
+
+@router.get("/preview/{file_id}/resource/{name}", name="get_preview_resource")
+async def get_preview_resource(
+    file_id: int,
+    name: str,
+    expires: int,
+    signature: str,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """
+    流式预览中外置的图片和完整输出，链接由预览接口签名生成，不需要登录
+    """
+    match = notebook_stream.RESOURCE_NAME.match(name)
+    if not match or not notebook_stream.verify_resource(file_id, name, expires, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired resource link")
+
+    data = await run_in_threadpool(notebook_stream.get_resource, file_id, name)
+    if data is None:
+        # 已被缓存淘汰，重新渲染，一次写回这个页面的所有资源
+        file_record = await crud_async.get_file(db, file_id)
+        if not file_record:
+            raise HTTPException(status_code=404, detail="File not found")
+        file_path = get_physical_path(file_record)
+        await db.close()
+        file_stat = stat_or_none(file_path)
+        if file_stat is None:
+            raise HTTPException(status_code=404, detail="File on disk not found")
+        try:
+            data = await notebook_stream.regenerate_resource(file_id, file_path, file_stat, name)
+        except notebook_preview.RenderTimeout as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        except Exception:
+            data = None
+        if data is None:
+            raise HTTPException(status_code=404, detail="Resource not found")
+
+    # 资源名中包含文件版本，内容不会变化，可以长期缓存
+    # sandbox: Notebook 输出中的 HTML/SVG 不能在本站点下执行脚本
+    return Response(content=data, media_type=notebook_stream.RESOURCE_MEDIA_TYPES[match.group(5)], headers={
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "ETag": f'"{name}"',
+        "Content-Security-Policy": "sandbox",
+        "X-Content-Type-Options": "nosniff",
+    })
+
+@router.get("/thumbnail/{file_id}")
+async def get_thumbnail(
+    file_id: int,
+    request: Request,
+    variant: str = Query("thumb", pattern="^(thumb|preview)$", description="thumb: small icon; preview: web-sized image"),
+    db: AsyncSession = Depends(database.get_async_db),
+    current_user: Optional[models.User] = Depends(get_optional_user)
+):
+    """
+    图片的缩略图 (thumb) 或网页预览图 (preview)，首次请求时生成并缓存
+    """
+    file_record = await crud_async.get_file(db, file_id)
+    if not file_record:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if not file_record.is_public:
+        if not current_user or (current_user.id != file_record.user_id and current_user.role != "admin"):
+             raise HTTPException(status_code=403, detail="Not authorized")
+
+    if file_record.type != "file" or not thumbnails.is_image(file_record.name):
+        raise HTTPException(status_code=400, detail="Not an image file")
+    if not thumbnails.available():
+        raise HTTPException(status_code=501, detail="Thumbnails are not available (Pillow is not installed)")
+
+    file_path = get_physical_path(file_record)
+    content_hash = file_record.content_hash
+    await db.close()
+
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+         raise HTTPException(status_code=404, detail="File on disk not found")
+
+    etag = http_cache.file_etag(
+        file_record.id, file_stat.st_size, file_stat.st_mtime, variant=f"t{thumbnails.DERIVATIVE_VERSION}-{variant}"
+    )
+    headers = http_cache.validator_headers(
+        etag, file_stat.st_mtime,
+        cache_control="public, no-cache" if file_record.is_public else "private, no-cache"
+    )
+    if http_cache.is_not_modified(request, etag, file_stat.st_mtime):
+        return http_cache.not_modified(headers)
+
+    try:
+        data = await thumbnails.get_derivative(file_record.id, file_path, variant, file_stat, content_hash)
+    except thumbnails.ThumbnailTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except thumbnails.ThumbnailError as e:
+        raise HTTPException(status_code=415, detail=f"Cannot read image: {e}")
+    return Response(content=data, media_type=thumbnails.OUTPUT_MEDIA_TYPE, headers=headers)
@@ -0,0 +1,267 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import hashlib
+import secrets
+import math
+import mimetypes
+import os
+from .. import database, crud, schemas, auth, models, blob_store
+from ..storage import PARTIAL_DIR, get_storage_path, get_partial_path
+from .files import register_uploaded_file
+
+# 分片上传（可断点续传）
+# 1. POST   /api/files/uploads                      创建上传会话，返回 upload_id 和分片大小
+# 2. PUT    /api/files/uploads/{upload_id}/{index}  上传第 index 个分片（请求体为原始字节），
+#                                                   可通过 X-Chunk-Sha256 头校验分片内容
+# 3. GET    /api/files/uploads/{upload_id}          查询已收到的分片，断线后只需补传缺失的分片
+# 4. POST   /api/files/uploads/{upload_id}/complete 所有分片到齐后将临时文件重命名为目标文件
+# 分片直接写入临时文件的对应偏移处，不经过额外的临时文件，完成时也只是重命名，不再复制
+
+# 默认分片大小 8MB，客户端可以在此范围内自行指定
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_MIN_CHUNK_SIZE = 256 * 1024
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE", str(64 * 1024 * 1024)))
+# 超过该时间（秒）没有新分片的上传会话会被清理
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+router = APIRouter(
+    prefix="/api/files/uploads",
+    tags=["uploads"],
+)
+
+def total_chunks(db_upload: models.UploadSession):
+    return math.ceil(db_upload.size / db_upload.chunk_size)
+
+def expected_chunk_size(db_upload: models.UploadSession, index: int):
+    return min(db_upload.chunk_size, db_upload.size - index * db_upload.chunk_size)
+
+def upload_status(db: Session, db_upload: models.UploadSession):
+    return schemas.UploadStatus(
+        upload_id=db_upload.id,
+        name=db_upload.name,
+        path=db_upload.path,
+        is_public=db_upload.is_public,
+        size=db_upload.size,
+        chunk_size=db_upload.chunk_size,
+        total_chunks=total_chunks(db_upload),
+        received=crud.get_received_chunks(db, db_upload.id)
+    )
+
+def get_own_upload(db: Session, upload_id: str, current_user: models.User):
+    db_upload = crud.get_upload_session(db, upload_id)
+    if db_upload is None or db_upload.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return db_upload
+
+def write_at(file_path: str, offset: int, data: bytes):
+    """
+    将数据写入文件的指定偏移处并落盘，多个分片可以并发写入同一个文件
+    """
+    fd = os.open(file_path, os.O_WRONLY | getattr(os, "O_BINARY", 0))
+    try:
+        view = memoryview(data)
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(fd, view, offset)
+            else:
+                # Windows 没有 pwrite
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+            view = view[written:]
+            offset += written
+        # 分片记录写入数据库之前先落盘，保证断点续传时已记录的分片都是完整的
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def remove_partial(upload_id: str):
+    try:
+        os.remove(get_partial_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+def cleanup_stale_uploads(db: Session):
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=UPLOAD_SESSION_TTL)
+    for db_upload in crud.get_stale_upload_sessions(db, cutoff):
+        remove_partial(db_upload.id)
+        crud.delete_upload_session(db, db_upload.id, commit=False)
+    db.commit()
+
+@router.post("", response_model=schemas.UploadStatus)
+def init_upload(
+    upload: schemas.UploadInit,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    name = os.path.basename(upload.name.replace("\\", "/"))
+    if name in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail="Invalid file name")
+    if upload.size < 0:
+        raise HTTPException(status_code=400, detail="Invalid file size")
+    chunk_size = upload.chunk_size or UPLOAD_CHUNK_SIZE
+    if not UPLOAD_MIN_CHUNK_SIZE <= chunk_size <= UPLOAD_MAX_CHUNK_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"chunk_size must be between {UPLOAD_MIN_CHUNK_SIZE} and {UPLOAD_MAX_CHUNK_SIZE}"
+        )
+    upload.name = name
+    upload.mime_type = upload.mime_type or mimetypes.guess_type(name)[0]
+    upload.path = "/" + upload.path.strip("/").replace("..", "")
+
+    cleanup_stale_uploads(db)
+
+    # 预先创建完整大小的稀疏文件，分片可以按任意顺序写入
+    upload_id = secrets.token_urlsafe(16)
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    with open(get_partial_path(upload_id), "wb") as f:
+        f.truncate(upload.size)
+
+    db_upload = crud.create_upload_session(db, upload_id, upload, chunk_size, current_user.id)
+    return upload_status(db, db_upload)
+
+@router.get("/{upload_id}", response_model=schemas.UploadStatus)
+def get_upload(
+    upload_id: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    return upload_status(db, get_own_upload(db, upload_id, current_user))
+
+def check_chunk(db: Session, upload_id: str, index: int, current_user: models.User):
+    """
+    查询上传会话并返回分片的预期大小，之后不再占用数据库连接
+    """
+    db_upload = get_own_upload(db, upload_id, current_user)
+    if not 0 <= index < total_chunks(db_upload):
+        raise HTTPException(status_code=400, detail="Chunk index out of range")
+    expected = expected_chunk_size(db_upload, index)
+    # 接收分片期间不占用数据库连接
+    db.expunge(db_upload)
+    db.close()
+    return db_upload, expected
+
+def store_chunk(db: Session, db_upload: models.UploadSession, index: int, data: bytes, checksum: Optional[str]):
+    sha256 = hashlib.sha256(data).hexdigest()
+    if checksum and checksum.lower() != sha256:
+        raise HTTPException(status_code=400, detail="Chunk checksum mismatch")
+    write_at(get_partial_path(db_upload.id), index * db_upload.chunk_size, data)
+    try:
+        crud.save_upload_chunk(db, db_upload.id, index, len(data), sha256)
+    except IntegrityError:
+        # 同一个分片被并发上传，内容已经写入，以先提交的记录为准
+        db.rollback()
+    return schemas.UploadChunkResult(index=index, size=len(data), sha256=sha256)
+
+@router.put("/{upload_id}/{index}", response_model=schemas.UploadChunkResult)
+async def upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: Optional[str] = Header(None),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    # 同步查询在线程池中执行，不阻塞事件循环
+    db_upload, expected = await run_in_threadpool(check_chunk, db, upload_id, index, current_user)
+
+    # 分片大小有上限，直接读入内存，不生成临时文件
+    data = bytearray()
+    async for part in request.stream():
+        data.extend(part)
+        if len(data) > expected:
+            raise HTTPException(status_code=400, detail=f"Chunk {index} must be {expected} bytes")
+    if len(data) != expected:
+        raise HTTPException(status_code=400, detail=f"Chunk {index} must be {expected} bytes")
+
+    # 校验、写盘和 fsync 都在线程池中执行，不阻塞事件循环
+    return await run_in_threadpool(store_chunk, db, db_upload, index, bytes(data), x_chunk_sha256)
+
+@router.post("/{upload_id}/complete", response_model=schemas.FileResponse)
+def complete_upload(
+    upload_id: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    db_upload = get_own_upload(db, upload_id, current_user)
+    received = crud.get_received_chunks(db, upload_id)
+    missing = sorted(set(range(total_chunks(db_upload))) - set(received))
+    if missing:
+        raise HTTPException(status_code=409, detail={"message": "Upload is incomplete", "missing": missing[:100]})
+
+    base_dir = get_storage_path(db_upload.is_public, current_user.id)
+    target_dir_path = db_upload.path.strip("/")
+    full_dir = os.path.join(base_dir, target_dir_path) if target_dir_path else base_dir
+    os.makedirs(full_dir, exist_ok=True)
+    file_path = os.path.join(full_dir, db_upload.name)
+
+    # 临时文件与目标目录在同一文件系统，重命名不复制数据
+    # 分片乱序写入，启用内容寻址存储时在完成后计算一次摘要
+    # 覆盖已有文件时先保留一个指向原内容的备份，登记失败时恢复
+    backup_path = None
+    try:
+        content_hash = None
+        if blob_store.eligible(db_upload.name, db_upload.size):
+            content_hash = blob_store.hash_file(get_partial_path(upload_id))
+        backup_path = backup_existing(file_path)
+        os.replace(get_partial_path(upload_id), file_path)
+    except OSError as e:
+        if backup_path:
+            restore_backup(backup_path, file_path)
+        raise HTTPException(status_code=500, detail=f"Error saving file to disk: {str(e)}")
+
+    try:
+        db_file = register_uploaded_file(
+            db, file_path, db_upload.name, db_upload.mime_type, target_dir_path, db_upload.is_public, current_user.id,
+            content_hash=content_hash
+        )
+    except Exception as e:
+        db.rollback()
+        if backup_path:
+            restore_backup(backup_path, file_path)
+        elif os.path.exists(file_path):
+            # 只删除本次上传创建的文件
+            os.remove(file_path)
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+    if backup_path:
+        os.remove(backup_path)
+    # 登记成功后再删除会话：登记中的重试会回滚事务，不能让会话的删除一起被回滚
+    crud.delete_upload_session(db, upload_id)
+    return db_file
+
+def backup_existing(file_path: str):
+    """
+    目标文件已存在时创建指向原内容的硬链接备份，返回备份路径；不存在时返回 None
+    不支持硬链接时把原文件重命名为备份
+    """
+    if not os.path.lexists(file_path):
+        return None
+    directory, name = os.path.split(file_path)
+    backup_path = os.path.join(directory, f".{name}.{secrets.token_hex(6)}.bak")
+    try:
+        os.link(file_path, backup_path)
+    except OSError:
+        os.rename(file_path, backup_path)
+    return backup_path
+
+def restore_backup(backup_path: str, file_path: str):
+    try:
+        os.replace(backup_path, file_path)
+    except OSError as e:
+        print(f"Failed to restore {file_path}: {e}")
+
+@router.delete("/{upload_id}")
+def abort_upload(
+    upload_id: str,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    get_own_upload(db, upload_id, current_user)
+    crud.delete_upload_session(db, upload_id)
+    remove_partial(upload_id)
+    return {"message": "Upload aborted"}
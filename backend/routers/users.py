@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
-from .. import database, crud, schemas, auth, models
+from .. import database, crud, schemas, auth, models, thumbnails
 
 router = APIRouter(
     prefix="/api/users",
@@ -24,6 +24,11 @@ def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(database.g
     users = crud.get_users(db, skip=skip, limit=limit)
     return users
 
+@router.get("/cache/stats")
+def read_user_cache_stats(current_user: models.User = Depends(auth.get_current_admin_user)):
+    # 鉴权缓存的命中率等统计，只反映当前 worker 进程
+    return auth.user_cache.stats()
+
 @router.get("/{user_id}", response_model=schemas.UserResponse)
 def read_user(user_id: int, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_active_user)):
     db_user = crud.get_user(db, user_id=user_id)
@@ -59,6 +64,7 @@ from fastapi import File, UploadFile
 import os
 import shutil
 import uuid
+from ..storage import atomic_write
 
 UPLOAD_DIR = "uploads"
 AVATAR_DIR = os.path.join(UPLOAD_DIR, "avatars")
@@ -74,20 +80,6 @@ def upload_avatar(
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # 尝试删除旧头像
-    if current_user.avatar_url:
-        try:
-            # avatar_url: /uploads/avatars/filename
-            # AVATAR_DIR: uploads/avatars
-            old_filename = os.path.basename(current_user.avatar_url)
-            # 安全检查：确保文件名不包含路径遍历字符
-            if ".." not in old_filename and "/" not in old_filename and "\\" not in old_filename:
-                old_file_path = os.path.join(AVATAR_DIR, old_filename)
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
-        except Exception as e:
-            print(f"Failed to delete old avatar: {e}")
-
     # 生成文件名: user_{id}_{uuid}{ext}，防止缓存问题
     file_extension = os.path.splitext(file.filename)[1]
     if not file_extension:
@@ -102,7 +94,32 @@ def upload_avatar(
             shutil.copyfileobj(file.file, buffer)
     finally:
         file.file.close()
+
+    # 上传时缩放一次，之后通过 /uploads 直接发送小图；未安装 Pillow 时保存原图
+    try:
+        resized = thumbnails.resize_avatar(file_path)
+    except (thumbnails.ThumbnailError, thumbnails.ThumbnailTimeout) as e:
+        os.remove(file_path)
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+    if resized is not None:
+        os.remove(file_path)
+        new_filename = os.path.splitext(new_filename)[0] + ".webp"
+        atomic_write(os.path.join(AVATAR_DIR, new_filename), resized)
         
+    # 新头像保存成功后再删除旧头像
+    if current_user.avatar_url:
+        try:
+            # avatar_url: /uploads/avatars/filename
+            # AVATAR_DIR: uploads/avatars
+            old_filename = os.path.basename(current_user.avatar_url)
+            # 安全检查：确保文件名不包含路径遍历字符
+            if ".." not in old_filename and "/" not in old_filename and "\\" not in old_filename:
+                old_file_path = os.path.join(AVATAR_DIR, old_filename)
+                if os.path.exists(old_file_path):
+                    os.remove(old_file_path)
+        except Exception as e:
+            print(f"Failed to delete old avatar: {e}")
+
     # 构建 URL (使用相对路径)
     # 前端访问时会基于当前域名访问，Nginx 负责转发 /uploads 请求
     avatar_url = f"/uploads/avatars/{new_filename}"
@@ -43,8 +43,10 @@ class FileBase(BaseModel):
     path: str
     type: str # file or directory
     size: int
+    file_count: int = 0
     mime_type: Optional[str] = None
     is_public: bool = False
+    mtime: Optional[float] = None
 
 class FileCreate(FileBase):
     pass
@@ -58,5 +60,48 @@ class FileResponse(FileBase):
     class Config:
         from_attributes = True
 
+class FileMove(BaseModel):
+    target_path: Optional[str] = None # 目标目录，如 "/" 或 "/docs"；不指定时留在原目录（重命名）
+    name: Optional[str] = None # 新名称；不指定时保持原名
+
+class FileCopy(FileMove):
+    is_public: Optional[bool] = None # 复制到公共区或自己的私有区；不指定时与原文件相同
+
+class TextEdit(BaseModel):
+    offset: int # 替换的起始位置（原文件中的字节偏移）
+    length: int = 0 # 被替换的字节数，0 表示插入
+    text: str = "" # 新内容，空字符串表示删除
+
+class FilePatch(BaseModel):
+    edits: List[TextEdit] # 偏移都相对于修改前的文件，各段不能重叠
+
+class ContentSearchResult(BaseModel):
+    file: FileResponse
+    snippet: Optional[str] = None
+
+# Chunked Upload Schemas
+class UploadInit(BaseModel):
+    name: str
+    path: str = "/"
+    is_public: bool = False
+    size: int
+    mime_type: Optional[str] = None
+    chunk_size: Optional[int] = None
+
+class UploadStatus(BaseModel):
+    upload_id: str
+    name: str
+    path: str
+    is_public: bool
+    size: int
+    chunk_size: int
+    total_chunks: int
+    received: List[int]
+
+class UploadChunkResult(BaseModel):
+    index: int
+    size: int
+    sha256: str
+
 # Update forward refs
 Token.model_rebuild()
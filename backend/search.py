@@ -0,0 +1,106 @@
+from typing import Iterable
+from sqlalchemy import text, func, Integer, Float, delete, table, column
+from sqlalchemy.orm import Session
+from . import models
+
+# 文件名搜索索引
+# SQLite: FTS5 虚拟表 + trigram 分词器，支持任意子串匹配
+# PostgreSQL: pg_trgm GIN 索引，ILIKE '%q%' 可以直接使用索引
+# 两者都不可用时退化为 ILIKE 全表扫描
+
+FTS_TABLE = "files_fts"
+# trigram 分词器至少需要 3 个字符才能使用索引
+MIN_TRIGRAM_LENGTH = 3
+
+_fts_tables = {}
+
+def setup(conn):
+    """
+    创建搜索索引并填充已有数据，由数据库迁移调用
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        try:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(name, tokenize='trigram')"
+            ))
+        except Exception as e:
+            # SQLite 版本过低 (< 3.34) 或未编译 FTS5
+            print(f"FTS5 trigram index unavailable, falling back to LIKE search: {e}")
+            return
+        conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+        conn.execute(text(f"INSERT INTO {FTS_TABLE} (rowid, name) SELECT id, name FROM files"))
+    elif dialect == "postgresql":
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_name_trgm ON files USING gin (name gin_trgm_ops)"))
+
+def has_fts(db: Session, table: str = FTS_TABLE):
+    # 检查 FTS5 虚拟表是否存在（结果按进程缓存）
+    if table not in _fts_tables:
+        if db.get_bind().dialect.name != "sqlite":
+            _fts_tables[table] = False
+        else:
+            _fts_tables[table] = db.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": table}
+            ).first() is not None
+    return _fts_tables[table]
+
+def index_files(db: Session, db_files: Iterable[models.File]):
+    """
+    新增或更新文件名索引，由文件 CRUD 在同一个事务中调用
+    PostgreSQL 的 GIN 索引由数据库自动维护
+    """
+    if not has_fts(db):
+        return
+    rows = [{"id": f.id, "name": f.name} for f in db_files]
+    if not rows:
+        return
+    db.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), rows)
+    db.execute(text(f"INSERT INTO {FTS_TABLE} (rowid, name) VALUES (:id, :name)"), rows)
+
+def remove_files(db: Session, file_ids: Iterable[int]):
+    if not has_fts(db):
+        return
+    rows = [{"id": file_id} for file_id in file_ids]
+    if rows:
+        db.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), rows)
+
+def remove_selected(db: Session, id_select):
+    """
+    与 remove_files 相同，但按子查询删除，删除大量记录时不需要先把 id 读到内存中
+    """
+    if not has_fts(db):
+        return
+    fts = table(FTS_TABLE, column("rowid"))
+    db.execute(delete(fts).where(fts.c.rowid.in_(id_select)))
+
+def escape_like(value: str):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def fts_phrase(query: str):
+    # 短语查询：trigram 分词下等价于不区分大小写的子串匹配
+    return '"' + query.replace('"', '""') + '"'
+
+def apply_name_search(db: Session, sql_query, query: str, ranked: bool = True):
+    """
+    在已经按作用域过滤的查询上增加文件名子串匹配
+    ranked: 按相关度排序；为 False 时不排序，由调用方指定排序方式
+    """
+    if has_fts(db) and len(query) >= MIN_TRIGRAM_LENGTH:
+        match = fts_phrase(query)
+        matches = text(
+            f"SELECT rowid AS id, bm25({FTS_TABLE}) AS rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+        ).bindparams(match=match).columns(id=Integer, rank=Float).subquery()
+        sql_query = sql_query.join(matches, matches.c.id == models.File.id)
+        if ranked:
+            sql_query = sql_query.order_by(matches.c.rank, func.length(models.File.name), models.File.id)
+        return sql_query
+
+    sql_query = sql_query.filter(models.File.name.ilike(f"%{escape_like(query)}%", escape="\\"))
+    if not ranked:
+        return sql_query
+    if db.get_bind().dialect.name == "postgresql":
+        # pg_trgm 的 GIN 索引支持 ILIKE，相似度用于排序
+        return sql_query.order_by(func.similarity(models.File.name, query).desc(), models.File.id)
+    return sql_query.order_by(func.length(models.File.name), models.File.id)
@@ -0,0 +1,138 @@
+import os
+import shutil
+import secrets
+import contextlib
+import threading
+import zlib
+from typing import Callable, Optional
+
+UPLOAD_DIR = "uploads"
+
+def get_storage_path(is_public: bool, user_id: int = None):
+    if is_public:
+        return os.path.join(UPLOAD_DIR, "public")
+    else:
+        return os.path.join(UPLOAD_DIR, str(user_id))
+
+def get_scope(is_public: bool, user_id: int = None):
+    # 存储空间标识：公共区为 "public"，私有区为用户 ID
+    return "public" if is_public else str(user_id)
+
+def try_worker_lock(name: str):
+    """
+    尝试获取一个进程间文件锁，用于保证多个 uvicorn worker 中只有一个运行后台任务
+    成功时返回需要一直持有的文件对象，失败时返回 None；不支持 fcntl 的平台直接视为成功
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    lock_file = open(os.path.join(UPLOAD_DIR, f".{name}.lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+def get_physical_path(file_record):
+    # 文件记录对应的磁盘路径: <存储根目录>/<path>/<name>
+    base_dir = get_storage_path(file_record.is_public, file_record.user_id)
+    return os.path.join(base_dir, file_record.path.strip("/"), file_record.name)
+
+# 分片上传的临时文件目录，与存储目录位于同一文件系统，完成时直接重命名
+PARTIAL_DIR = os.path.join(UPLOAD_DIR, ".partial")
+
+def get_partial_path(upload_id: str):
+    return os.path.join(PARTIAL_DIR, f"{upload_id}.part")
+
+# 条件写入时，比较当前版本和替换文件需要在锁内完成；锁按路径哈希分散到固定数量的锁文件上
+REPLACE_LOCK_STRIPES = 64
+_replace_thread_locks = [threading.Lock() for _ in range(REPLACE_LOCK_STRIPES)]
+
+@contextlib.contextmanager
+def replace_lock(file_path: str):
+    """
+    同一路径的“检查版本 + 替换”在多个线程和 uvicorn worker 之间串行执行，只在替换的瞬间持有
+    """
+    stripe = zlib.crc32(os.path.abspath(file_path).encode("utf-8", "surrogateescape")) % REPLACE_LOCK_STRIPES
+    lock = _replace_thread_locks[stripe]
+    with lock:
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        lock_dir = os.path.join(UPLOAD_DIR, ".locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"replace-{stripe}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+@contextlib.contextmanager
+def atomic_writer(file_path: str, check: Optional[Callable[[], None]] = None):
+    """
+    先写入同目录下的临时文件再替换目标文件：读取方只会看到旧内容或新内容，
+    与其他文件共享数据块（硬链接）时也不会修改到其他文件
+    with 块正常结束时替换目标文件，出现异常时删除临时文件
+    check: 替换前在锁内调用，抛出异常时放弃写入（用于检查目标文件的版本没有变化）
+    """
+    directory, name = os.path.split(file_path)
+    temp_path = os.path.join(directory, f".{name}.{secrets.token_hex(6)}.tmp")
+    try:
+        with open(temp_path, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if check is None:
+            os.replace(temp_path, file_path)
+        else:
+            with replace_lock(file_path):
+                check()
+                os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def atomic_write(file_path: str, data: bytes, check: Optional[Callable[[], None]] = None):
+    """
+    返回新文件的 stat：替换不改变大小和修改时间，在锁外另行 stat 可能读到之后其他请求写入的版本
+    """
+    with atomic_writer(file_path, check) as f:
+        f.write(data)
+        f.flush()
+        file_stat = os.fstat(f.fileno())
+    return file_stat
+
+# ioctl FICLONE: 在支持的文件系统 (btrfs、XFS 等) 上创建共享数据块的写时复制副本
+FICLONE = 0x40049409
+
+def clone_file(src_path: str, dst_path: str):
+    """
+    服务端复制文件，目标已存在时抛出 FileExistsError
+    依次尝试 reflink（不复制数据）、copy_file_range（在内核中复制，部分文件系统会在服务端完成）、按块复制
+    返回实际使用的方式
+    """
+    with open(src_path, "rb") as src, open(dst_path, "xb") as dst:
+        try:
+            import fcntl
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except (ImportError, OSError):
+            pass
+        if hasattr(os, "copy_file_range"):
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                    pass
+                return "copy_file_range"
+            except OSError:
+                # 不支持时从头按块复制
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+        return "copy"
@@ -0,0 +1,239 @@
+import os
+import sys
+import time
+import mimetypes
+import threading
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from . import crud, schemas, models
+from .database import SessionLocal
+from .storage import get_storage_path, get_scope, try_worker_lock
+
+# 同步模式：
+# request    - 列表请求时检查目录指纹 (mtime/inode)，只有目录发生变化才重新扫描
+# background - 列表请求直接读取数据库，由后台协调线程负责同步磁盘变化
+SYNC_MODE = os.getenv("SYNC_MODE", "request")
+# 后台协调线程的扫描间隔（秒）
+SYNC_INTERVAL = int(os.getenv("SYNC_INTERVAL", "60"))
+# 每隔多少轮做一次全量扫描，用于发现原地修改（不会改变目录 mtime）的文件
+SYNC_FULL_RESCAN_EVERY = int(os.getenv("SYNC_FULL_RESCAN_EVERY", "10"))
+# 递归深度限制，防止过深
+SYNC_MAX_DEPTH = 5
+# 目录 mtime 距今不足该秒数时不记录指纹，
+# 避免同一时间粒度内的后续修改被误判为“未变化”
+RACY_MTIME_WINDOW = 2
+
+def get_public_owner_id(db: Session):
+    # 公共区文件默认归属于管理员
+    admin_user = crud.get_user_by_username(db, "admin")
+    return admin_user.id if admin_user else 1 # Fallback
+
+def join_path(parent: str, name: str):
+    return f"{parent.rstrip('/')}/{name}"
+
+# 同步物理目录到数据库
+def sync_directory_to_db(db: Session, base_dir: str, current_path: str, is_public: bool, user_id: int, depth: int = 0, force: bool = False):
+    """
+    扫描物理目录并更新数据库，所有修改在同一个事务中提交
+    base_dir: 物理根目录 (e.g. uploads/public)
+    current_path: 当前相对路径 (e.g. /)
+    depth: 递归深度限制，防止过深
+    force: 忽略目录指纹，强制重新扫描
+    返回值: 是否真正扫描了该目录
+    """
+    try:
+        scanned = _sync_directory(db, base_dir, current_path, is_public, user_id, depth, force)
+        if scanned:
+            db.commit()
+        return scanned
+    except IntegrityError:
+        # 其他请求或 worker 同时同步了同一目录，以先提交的结果为准
+        db.rollback()
+        return False
+    except Exception:
+        db.rollback()
+        raise
+
+def _sync_directory(db: Session, base_dir: str, current_path: str, is_public: bool, user_id: int, depth: int, force: bool):
+    # 只 flush 不提交，由 sync_directory_to_db 统一提交
+    if depth > SYNC_MAX_DEPTH:
+        return False
+
+    physical_path = os.path.join(base_dir, current_path.strip("/").replace("..", ""))
+
+    # 先取目录指纹再扫描，扫描期间发生的修改会在下一次请求时被发现
+    try:
+        dir_stat = os.stat(physical_path)
+    except OSError:
+        return False
+
+    scope = get_scope(is_public, user_id)
+    state = crud.get_directory_state(db, scope, current_path)
+    if (not force and state
+            and state.mtime_ns == dir_stat.st_mtime_ns
+            and state.inode == dir_stat.st_ino):
+        # 目录内容未变化，直接使用数据库中的记录
+        return False
+
+    # 获取物理目录下的所有项 (scandir 可以复用目录项中的类型信息，减少 stat 调用)
+    try:
+        with os.scandir(physical_path) as it:
+            entries = [entry for entry in it if not entry.name.startswith(".")]
+    except OSError:
+        return False
+
+    # 获取 DB 中该路径下的所有项
+    db_files = crud.get_files(db, path=current_path, is_public=is_public, user_id=user_id)
+
+    # (作用域, path, name) 有唯一索引，不会出现同名记录
+    db_file_map = {f.name: f for f in db_files}
+
+    to_create = []
+    to_update = []
+    to_delete = []
+    new_dirs = []
+
+    # 遍历物理项
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+            entry_stat = entry.stat()
+        except OSError:
+            continue
+        item_type = "directory" if is_dir else "file"
+
+        db_item = db_file_map.pop(entry.name, None)
+        if db_item is not None and db_item.type != item_type:
+            # 同名项的类型发生变化（文件 <-> 目录），按删除后重建处理
+            to_delete.append(db_item.id)
+            db_item = None
+
+        if db_item is None:
+            # DB 中不存在，创建记录
+            # 目录的大小和文件数从 0 开始，由其子项创建时逐级累加
+            mime_type = None
+            if not is_dir:
+                mime_type, _ = mimetypes.guess_type(entry.path)
+
+            to_create.append(schemas.FileCreate(
+                name=entry.name,
+                path=current_path,
+                type=item_type,
+                size=0 if is_dir else entry_stat.st_size,
+                mime_type=mime_type,
+                is_public=is_public,
+                mtime=entry_stat.st_mtime
+            ))
+            if is_dir:
+                new_dirs.append(entry.name)
+        elif not is_dir:
+            # DB 中存在，检查是否需要更新
+            # 目录的大小由聚合维护，这里只更新文件的大小和修改时间
+            if db_item.size != entry_stat.st_size or db_item.mtime != entry_stat.st_mtime:
+                to_update.append((db_item.id, entry_stat.st_size, entry_stat.st_mtime))
+
+    # 处理 DB 中存在但物理上不存在的项 (db_file_map 中剩余的)
+    # 为了保持一致性，应该删除 DB 记录
+    to_delete.extend(record.id for record in db_file_map.values())
+
+    crud.bulk_delete_files(db, to_delete, commit=False)
+    crud.bulk_create_files(db, to_create, user_id, commit=False)
+    crud.bulk_update_file_sizes(db, to_update, commit=False)
+
+    # 新出现的目录需要递归同步，才能得到正确的聚合大小
+    for name in new_dirs:
+        _sync_directory(db, base_dir, join_path(current_path, name), is_public, user_id, depth + 1, force)
+
+    # 记录目录指纹；mtime 过新时不记录，下次请求会再次扫描
+    if time.time() - dir_stat.st_mtime > RACY_MTIME_WINDOW:
+        crud.save_directory_state(db, scope, current_path, dir_stat.st_mtime_ns, dir_stat.st_ino, commit=False)
+    elif state:
+        crud.delete_directory_state(db, scope, current_path, commit=False)
+    return True
+
+def reconcile_scope(db: Session, is_public: bool, user_id: int, force: bool = False):
+    """
+    从根目录开始同步整个存储空间，跳过指纹未变化的目录
+    返回值: 实际扫描的目录数量
+    """
+    base_dir = get_storage_path(is_public, user_id)
+    if not os.path.isdir(base_dir):
+        return 0
+
+    scanned = 0
+    pending = ["/"]
+    while pending:
+        current_path = pending.pop()
+        if sync_directory_to_db(db, base_dir, current_path, is_public, user_id, force=force):
+            scanned += 1
+        # 子目录从数据库中读取，未变化的目录不需要 listdir
+        for item in crud.get_files(db, path=current_path, is_public=is_public, user_id=user_id):
+            if item.type == "directory":
+                pending.append(join_path(current_path, item.name))
+    return scanned
+
+def reconcile_all(db: Session, force: bool = False):
+    scanned = reconcile_scope(db, True, get_public_owner_id(db), force=force)
+    for user in db.query(models.User).all():
+        scanned += reconcile_scope(db, False, user.id, force=force)
+    return scanned
+
+class DirectoryReconciler(threading.Thread):
+    """
+    后台协调线程：定期把磁盘变化同步到数据库，
+    使列表接口可以直接从数据库返回结果
+    """
+
+    def __init__(self, interval: int = SYNC_INTERVAL, full_rescan_every: int = SYNC_FULL_RESCAN_EVERY):
+        super().__init__(name="neoshare-reconciler", daemon=True)
+        self.interval = interval
+        self.full_rescan_every = full_rescan_every
+        self._stop_event = threading.Event()
+
+    def run(self):
+        rounds = 0
+        while not self._stop_event.is_set():
+            force = self.full_rescan_every > 0 and rounds % self.full_rescan_every == 0
+            db = SessionLocal()
+            try:
+                reconcile_all(db, force=force)
+            except Exception as e:
+                db.rollback()
+                print(f"Reconcile error: {e}")
+            finally:
+                db.close()
+            rounds += 1
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+_reconciler = None
+_reconciler_lock = None
+
+def start_reconciler():
+    # 多个 uvicorn worker 中只允许一个运行协调线程
+    global _reconciler, _reconciler_lock
+    if _reconciler is not None:
+        return None
+    _reconciler_lock = try_worker_lock("reconciler")
+    if not _reconciler_lock:
+        return None
+    _reconciler = DirectoryReconciler()
+    _reconciler.start()
+    return _reconciler
+
+def stop_reconciler():
+    global _reconciler
+    if _reconciler is not None:
+        _reconciler.stop()
+        _reconciler = None
+
+if __name__ == "__main__":
+    # 手动执行一次同步: python -m backend.sync [--full]
+    db = SessionLocal()
+    try:
+        count = reconcile_all(db, force="--full" in sys.argv)
+        print(f"Scanned {count} directories")
+    finally:
+        db.close()
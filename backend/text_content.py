@@ -0,0 +1,198 @@
+import os
+import mmap
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+from .storage import atomic_writer
+
+# 大文本文件的分段读取和按偏移修改
+# 读取时通过 mmap 只访问请求的范围；按行读取使用行偏移索引：
+# 文件按固定大小分块，记录每块之前的换行数（500MB 的文件约 8000 项），
+# 定位某一行时二分查找所在的块，再在块内查找，索引按文件的 size/mtime 缓存在进程内
+# 修改时按偏移替换若干段内容，未修改的部分从原文件分块复制到临时文件，再替换原文件
+
+# 单次分段读取的最大字节数
+TEXT_RANGE_MAX_BYTES = int(os.getenv("TEXT_RANGE_MAX_BYTES", str(4 * 1024 * 1024)))
+# 不指定范围时一次返回整个文件的大小上限，更大的文件需要分段读取
+TEXT_CONTENT_MAX_BYTES = int(os.getenv("TEXT_CONTENT_MAX_BYTES", str(20 * 1024 * 1024)))
+# 进程内缓存的行偏移索引个数
+LINE_INDEX_CACHE_ENTRIES = int(os.getenv("LINE_INDEX_CACHE_ENTRIES", "64"))
+LINE_INDEX_BLOCK_SIZE = 64 * 1024
+COPY_BLOCK_SIZE = 1024 * 1024
+
+class TextRangeError(ValueError):
+    pass
+
+def _is_continuation(byte: int):
+    # UTF-8 多字节字符的后续字节 10xxxxxx
+    return byte & 0xC0 == 0x80
+
+def _align_forward(mm, position: int, size: int):
+    while position < size and _is_continuation(mm[position]):
+        position += 1
+    return position
+
+def _align_backward(mm, position: int, size: int):
+    while 0 < position < size and _is_continuation(mm[position]):
+        position -= 1
+    return position
+
+class LineIndex:
+    """
+    block_newlines[i]: 第 i 块（从 i * LINE_INDEX_BLOCK_SIZE 开始）之前的换行数
+    """
+
+    def __init__(self, mm, size: int):
+        self.size = size
+        self.block_newlines = array("Q")
+        newlines = 0
+        for start in range(0, size, LINE_INDEX_BLOCK_SIZE):
+            self.block_newlines.append(newlines)
+            newlines += mm[start:start + LINE_INDEX_BLOCK_SIZE].count(b"\n")
+        self.newlines = newlines
+        # 最后一行没有换行符时也算一行
+        self.total_lines = newlines + (1 if size and mm[size - 1] != 0x0A else 0)
+
+    def line_start(self, mm, line: int):
+        """
+        第 line 行（从 0 开始）的起始偏移，超出时返回文件大小
+        """
+        if line <= 0:
+            return 0
+        if line > self.newlines:
+            return self.size
+        # 第 line 个换行符所在的块
+        block = bisect.bisect_left(self.block_newlines, line) - 1
+        position = block * LINE_INDEX_BLOCK_SIZE
+        for _ in range(line - self.block_newlines[block]):
+            position = mm.find(b"\n", position) + 1
+        return position
+
+    def line_of(self, mm, offset: int):
+        # offset 所在的行号
+        block = offset // LINE_INDEX_BLOCK_SIZE
+        if block >= len(self.block_newlines):
+            return self.newlines
+        start = block * LINE_INDEX_BLOCK_SIZE
+        return self.block_newlines[block] + mm[start:offset].count(b"\n")
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+def _get_index(file_path: str, file_stat: os.stat_result, mm):
+    key = (os.path.abspath(file_path), file_stat.st_size, file_stat.st_mtime_ns)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = LineIndex(mm, file_stat.st_size)
+    with _index_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > LINE_INDEX_CACHE_ENTRIES:
+            _index_cache.popitem(last=False)
+    return index
+
+def _result(mm, index: LineIndex, start: int, end: int, size: int):
+    data = mm[start:end]
+    return {
+        "content": data.decode("utf-8"),
+        "offset": start,
+        "end": end,
+        "size": size,
+        "line": index.line_of(mm, start),
+        "lines": data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0),
+        "total_lines": index.total_lines,
+    }
+
+def _map(f):
+    # 只读映射，不能用于空文件
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _empty_result():
+    return {"content": "", "offset": 0, "end": 0, "size": 0, "line": 0, "lines": 0, "total_lines": 0}
+
+def read_text(file_path: str):
+    """
+    读取整个文件，调用方需先检查大小不超过 TEXT_CONTENT_MAX_BYTES
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+def read_range(file_path: str, offset: int, length: int):
+    """
+    按字节范围读取，范围两端调整到 UTF-8 字符边界，至少包含一个字符（文件末尾除外）
+    返回内容及其实际的起止偏移、起始行号，客户端从 end 继续读取下一段
+    """
+    length = min(length, TEXT_RANGE_MAX_BYTES)
+    with open(file_path, "rb") as f:
+        file_stat = os.fstat(f.fileno())
+        size = file_stat.st_size
+        if size == 0:
+            return _empty_result()
+        with _map(f) as mm:
+            index = _get_index(file_path, file_stat, mm)
+            start = _align_forward(mm, min(offset, size), size)
+            end = _align_backward(mm, min(start + length, size), size)
+            if end <= start < size:
+                # 范围短于一个字符时至少返回一个完整字符，按 end 继续读取时总能前进
+                end = _align_forward(mm, start + 1, size)
+            return _result(mm, index, start, end, size)
+
+def read_lines(file_path: str, line: int, count: int):
+    """
+    读取从第 line 行（从 0 开始）起的 count 行
+    超过 TEXT_RANGE_MAX_BYTES 时在最后一个完整行处截断（单行过长时在字符边界处截断）
+    """
+    with open(file_path, "rb") as f:
+        file_stat = os.fstat(f.fileno())
+        size = file_stat.st_size
+        if size == 0:
+            return _empty_result()
+        with _map(f) as mm:
+            index = _get_index(file_path, file_stat, mm)
+            start = index.line_start(mm, line)
+            end = index.line_start(mm, line + count)
+            if end - start > TEXT_RANGE_MAX_BYTES:
+                limit = start + TEXT_RANGE_MAX_BYTES
+                last_newline = mm.rfind(b"\n", start, limit)
+                end = last_newline + 1 if last_newline >= 0 else _align_backward(mm, limit, size)
+            return _result(mm, index, start, end, size)
+
+def apply_edits(file_path: str, edits: List[Tuple[int, int, bytes]], check: Optional[Callable[[], None]] = None):
+    """
+    按偏移替换若干段内容并原子地保存，返回新文件的 stat
+    edits: [(offset, length, data), ...]，偏移相对于修改前的文件，各段不能重叠，
+    边界必须位于 UTF-8 字符边界上
+    check: 替换前在锁内调用，见 storage.atomic_writer
+    """
+    edits = sorted(edits, key=lambda edit: (edit[0], edit[1]))
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        mm = _map(f) if size else None
+        try:
+            previous_end = 0
+            for offset, length, _ in edits:
+                if length < 0 or offset < previous_end or offset + length > size:
+                    raise TextRangeError("Edits overlap or are out of range")
+                for boundary in (offset, offset + length):
+                    if boundary < size and _is_continuation(mm[boundary]):
+                        raise TextRangeError("Edit boundary splits a UTF-8 character")
+                previous_end = offset + length
+
+            with atomic_writer(file_path, check) as out:
+                position = 0
+                for offset, length, data in edits + [(size, 0, b"")]:
+                    # 未修改的部分分块复制，内存占用与文件大小无关
+                    for start in range(position, offset, COPY_BLOCK_SIZE):
+                        out.write(mm[start:min(start + COPY_BLOCK_SIZE, offset)])
+                    out.write(data)
+                    position = offset + length
+                out.flush()
+                file_stat = os.fstat(out.fileno())
+            return file_stat
+        finally:
+            if mm is not None:
+                mm.close()
@@ -0,0 +1,192 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Optional
+from .disk_cache import DiskCache
+
+# 图片缩略图和预览图，首次请求时生成并写入磁盘缓存
+# 缓存版本由文件内容决定（已去重的文件使用 SHA-256，其他文件使用 size/mtime），
+# 同一文件的各个规格共用一个版本前缀，内容变化后旧的派生图随之删除
+# 图片解码和缩放在独立的进程池中执行，大图不会占用 uvicorn worker 的 CPU 和内存
+
+# 缓存总大小上限，默认 256MB
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# 生成进程数，0 表示在线程池中生成（不使用子进程）
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# 单张图片的生成超时（秒）
+THUMBNAIL_TIMEOUT = float(os.getenv("THUMBNAIL_TIMEOUT", "30"))
+# 超过该像素数的图片不处理，防止解压炸弹
+THUMBNAIL_MAX_PIXELS = int(os.getenv("THUMBNAIL_MAX_PIXELS", str(80 * 1000 * 1000)))
+# 头像的最大边长
+AVATAR_SIZE = int(os.getenv("AVATAR_SIZE", "256"))
+# 修改输出格式或参数时递增，使已有缓存失效
+DERIVATIVE_VERSION = 1
+
+# 规格名 -> 最大边长，等比缩放，小图不放大
+VARIANTS = {
+    "thumb": 256,
+    "preview": 1600,
+}
+OUTPUT_FORMAT = "WEBP"
+OUTPUT_MEDIA_TYPE = "image/webp"
+OUTPUT_QUALITY = 80
+
+# Pillow 能够解码的常见格式
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff", ".ico"}
+
+derivative_cache = DiskCache("thumbnails", THUMBNAIL_CACHE_MAX_BYTES)
+
+class ThumbnailError(Exception):
+    """
+    文件不是可以处理的图片
+    """
+    pass
+
+class ThumbnailTimeout(Exception):
+    pass
+
+def available():
+    try:
+        import PIL # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def is_image(filename: str):
+    return os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+
+def content_version(file_stat: os.stat_result, content_hash: Optional[str] = None):
+    if content_hash:
+        return f"d{DERIVATIVE_VERSION}-{content_hash}"
+    return f"d{DERIVATIVE_VERSION}-{file_stat.st_size:x}-{file_stat.st_mtime_ns:x}"
+
+def _init_worker(max_pixels: int):
+    from PIL import Image
+    Image.MAX_IMAGE_PIXELS = max_pixels
+
+def render_derivative(file_path: str, max_size: int, output_format: str = OUTPUT_FORMAT):
+    """
+    等比缩放到最大边长 max_size，按 EXIF 方向旋转，返回编码后的图片
+    """
+    import io
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(file_path) as image:
+            # JPEG 解码时直接按比例缩小，大图不需要完整解码
+            image.draft("RGB", (max_size, max_size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+            if output_format == "JPEG" and image.mode == "RGBA":
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, output_format, quality=OUTPUT_QUALITY)
+            return buffer.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        # 子进程中的异常需要能够序列化，统一转换为 ThumbnailError
+        raise ThumbnailError(str(e))
+
+_pool = None
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: 不从已经启动了后台线程的 uvicorn worker 中 fork
+        _pool = ProcessPoolExecutor(
+            max_workers=THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(THUMBNAIL_MAX_PIXELS,)
+        )
+    return _pool
+
+def _reset_pool(pool):
+    global _pool
+    if _pool is pool:
+        _pool = None
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False)
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def _render(file_path: str, max_size: int):
+    loop = asyncio.get_running_loop()
+    if THUMBNAIL_WORKERS <= 0:
+        _init_worker(THUMBNAIL_MAX_PIXELS)
+        return await asyncio.wait_for(
+            loop.run_in_executor(None, render_derivative, file_path, max_size), THUMBNAIL_TIMEOUT
+        )
+    # 进程池因其他任务超时而被重建时重试一次
+    for attempt in range(2):
+        pool = _get_pool()
+        try:
+            future = loop.run_in_executor(pool, render_derivative, file_path, max_size)
+            return await asyncio.wait_for(future, THUMBNAIL_TIMEOUT)
+        except asyncio.TimeoutError:
+            _reset_pool(pool)
+            raise ThumbnailTimeout(f"Resizing took longer than {THUMBNAIL_TIMEOUT:g}s")
+        except BrokenProcessPool:
+            _reset_pool(pool)
+            if attempt == 1:
+                raise
+
+# 正在生成的任务，同一张图片的并发请求共享同一次生成
+_inflight = {}
+
+async def _render_and_store(file_id: int, prefix: str, version: str, file_path: str, max_size: int):
+    data = await _render(file_path, max_size)
+    await asyncio.to_thread(derivative_cache.put, file_id, version, data, keep_prefix=prefix)
+    return data
+
+async def get_derivative(file_id: int, file_path: str, variant: str, file_stat: os.stat_result,
+                         content_hash: Optional[str] = None):
+    """
+    返回指定规格的派生图，优先读取缓存
+    """
+    prefix = content_version(file_stat, content_hash)
+    version = f"{prefix}-{variant}"
+    cached = await asyncio.to_thread(derivative_cache.read, file_id, version)
+    if cached is not None:
+        return cached
+
+    key = (file_id, version)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_render_and_store(file_id, prefix, version, file_path, VARIANTS[variant]))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # shield: 某个请求断开时不取消其他请求仍在等待的生成
+    return await asyncio.shield(task)
+
+def resize_avatar(file_path: str):
+    """
+    上传头像时缩放到 AVATAR_SIZE，由同步接口在线程池中调用
+    返回缩放后的图片（WebP）；未安装 Pillow 时返回 None，保存原图
+    """
+    if not available():
+        return None
+    if THUMBNAIL_WORKERS <= 0:
+        _init_worker(THUMBNAIL_MAX_PIXELS)
+        return render_derivative(file_path, AVATAR_SIZE)
+    pool = _get_pool()
+    future = pool.submit(render_derivative, file_path, AVATAR_SIZE)
+    try:
+        return future.result(timeout=THUMBNAIL_TIMEOUT)
+    except TimeoutError:
+        _reset_pool(pool)
+        raise ThumbnailTimeout(f"Resizing took longer than {THUMBNAIL_TIMEOUT:g}s")
+
+def cached_ids():
+    return derivative_cache.cached_ids()
+
+def invalidate(file_ids: Iterable[int]):
+    derivative_cache.invalidate(file_ids)
@@ -0,0 +1,149 @@
+import os
+import time
+import secrets
+import threading
+from .storage import UPLOAD_DIR, try_worker_lock
+
+# 删除文件和目录时先重命名到回收区（同一文件系统，耗时与目录大小无关），接口立即返回，
+# 由后台线程分批删除回收区中的内容，删除大目录不会长时间阻塞请求或占满磁盘 I/O
+
+TRASH_DIR = os.path.join(UPLOAD_DIR, ".trash")
+# 后台清理间隔（秒）；本进程中有新的删除时立即开始
+TRASH_CLEANUP_INTERVAL = int(os.getenv("TRASH_CLEANUP_INTERVAL", "30"))
+# 每删除多少个文件暂停一次，暂停时长（秒）
+TRASH_BATCH_SIZE = int(os.getenv("TRASH_BATCH_SIZE", "1000"))
+TRASH_BATCH_PAUSE = float(os.getenv("TRASH_BATCH_PAUSE", "0.05"))
+
+# 事务提交之前回收区中的内容带有该前缀，清理线程不会删除，提交失败时还可以完整地移回原处
+PENDING_PREFIX = ".pending-"
+# 超过该时长（秒）仍未确认的内容视为进程异常退出的遗留，同样清理
+TRASH_PENDING_TIMEOUT = 3600
+
+_wake_event = threading.Event()
+
+def move_to_trash(path: str):
+    """
+    把文件或目录移入回收区，返回回收区中的路径
+    数据库事务提交后调用 wake(trash_path) 交给清理线程删除，提交失败时调用 restore
+    """
+    os.makedirs(TRASH_DIR, exist_ok=True)
+    trash_path = os.path.join(TRASH_DIR, f"{PENDING_PREFIX}{int(time.time())}-{secrets.token_hex(6)}")
+    os.rename(path, trash_path)
+    return trash_path
+
+def restore(trash_path: str, path: str):
+    # 数据库操作失败时移回原处
+    os.rename(trash_path, path)
+
+def wake(trash_path: str = None):
+    """
+    确认删除：去掉 trash_path 的待定前缀并唤醒清理线程
+    """
+    if trash_path:
+        directory, name = os.path.split(trash_path)
+        if name.startswith(PENDING_PREFIX):
+            try:
+                os.rename(trash_path, os.path.join(directory, name[len(PENDING_PREFIX):]))
+            except OSError as e:
+                # 留在回收区中，超时后清理
+                print(f"Trash confirm error: {e}")
+    _wake_event.set()
+
+def _is_pending(name: str):
+    if not name.startswith(PENDING_PREFIX):
+        return False
+    try:
+        created = int(name[len(PENDING_PREFIX):].split("-", 1)[0])
+    except ValueError:
+        return False
+    return time.time() - created < TRASH_PENDING_TIMEOUT
+
+def _remove_tree(path: str, stop_event: threading.Event = None):
+    removed = 0
+    if not os.path.isdir(path) or os.path.islink(path):
+        os.remove(path)
+        return 1
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            try:
+                os.remove(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+            removed += 1
+            if removed % TRASH_BATCH_SIZE == 0:
+                if stop_event is not None and stop_event.is_set():
+                    return removed
+                time.sleep(TRASH_BATCH_PAUSE)
+        for name in dirs:
+            dir_path = os.path.join(root, name)
+            if os.path.islink(dir_path):
+                os.remove(dir_path)
+            else:
+                os.rmdir(dir_path)
+    os.rmdir(path)
+    return removed
+
+def empty_trash(stop_event: threading.Event = None):
+    """
+    删除回收区中的所有内容，返回删除的文件数
+    """
+    try:
+        names = os.listdir(TRASH_DIR)
+    except OSError:
+        return 0
+    removed = 0
+    for name in names:
+        if stop_event is not None and stop_event.is_set():
+            break
+        if _is_pending(name):
+            continue
+        try:
+            removed += _remove_tree(os.path.join(TRASH_DIR, name), stop_event)
+        except OSError as e:
+            print(f"Trash cleanup error: {e}")
+    return removed
+
+class TrashCleaner(threading.Thread):
+    """
+    后台清理线程，启动时也会清理上次退出前未删除完的内容
+    """
+
+    def __init__(self, interval: int = TRASH_CLEANUP_INTERVAL):
+        super().__init__(name="neoshare-trash-cleaner", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            _wake_event.clear()
+            empty_trash(self._stop_event)
+            _wake_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        _wake_event.set()
+
+_cleaner = None
+_cleaner_lock = None
+
+def start_cleaner():
+    # 多个 uvicorn worker 中只允许一个运行清理线程，其他 worker 的删除在下一个清理周期处理
+    global _cleaner, _cleaner_lock
+    if _cleaner is not None:
+        return None
+    _cleaner_lock = try_worker_lock("trash-cleaner")
+    if not _cleaner_lock:
+        return None
+    _cleaner = TrashCleaner()
+    _cleaner.start()
+    return _cleaner
+
+def stop_cleaner():
+    global _cleaner
+    if _cleaner is not None:
+        _cleaner.stop()
+        _cleaner = None
+
+if __name__ == "__main__":
+    # 手动清空回收区: python -m backend.trash
+    print(f"Removed {empty_trash()} files")
@@ -0,0 +1,187 @@
+import os
+import asyncio
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from .storage import PARTIAL_DIR
+from . import blob_store
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# 流式上传：边接收请求体边解析 multipart，文件内容直接写入磁盘，
+# 不经过 Starlette 的 SpooledTemporaryFile，数据只落盘一次
+# 磁盘写入在独立的有界线程池中执行，大量并发上传不会占满 FastAPI 的默认线程池，
+# 每个上传同一时刻最多只有一个写入任务，内存占用与文件大小无关
+
+# 写入线程数
+UPLOAD_WRITER_THREADS = int(os.getenv("UPLOAD_WRITER_THREADS", "8"))
+# 缓冲达到该大小后写入一次磁盘
+UPLOAD_WRITE_BUFFER = 1024 * 1024
+# 普通表单字段的最大长度
+MAX_FIELD_SIZE = 64 * 1024
+
+_writer_pool = ThreadPoolExecutor(max_workers=UPLOAD_WRITER_THREADS, thread_name_prefix="neoshare-upload-writer")
+
+class UploadedPart:
+    """
+    已经写入临时文件的一个文件字段
+    """
+
+    def __init__(self, field_name: str, filename: str, content_type: Optional[str]):
+        self.field_name = field_name
+        self.filename = filename
+        self.content_type = content_type
+        self.temp_path = os.path.join(PARTIAL_DIR, f"{secrets.token_urlsafe(16)}.part")
+        self.size = 0
+        self.buffer = bytearray()
+        self.fd = None
+        # 启用内容寻址存储时边写入边计算摘要，不需要再读一遍文件
+        self.hasher = blob_store.new_hasher()
+
+    @property
+    def digest(self):
+        return self.hasher.hexdigest() if self.hasher else None
+
+    def open(self):
+        os.makedirs(PARTIAL_DIR, exist_ok=True)
+        self.fd = os.open(self.temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+
+    def write(self, data: bytes):
+        if self.hasher:
+            self.hasher.update(data)
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def discard(self):
+        self.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+class StreamingFormParser:
+    """
+    增量解析 multipart/form-data 请求体
+    解析器的回调是同步的，只记录待执行的操作 (打开/写入/关闭)，由 parse() 在两次读取之间异步执行
+    """
+
+    def __init__(self, content_type: str):
+        _, params = parse_options_header(content_type)
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise ValueError("Missing multipart boundary")
+        self.fields = {}
+        self.files: List[UploadedPart] = []
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._field_name = None
+        self._field_data = bytearray()
+        self._current: Optional[UploadedPart] = None
+        self._ops = []
+        self._parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+        self._field_name = None
+        self._field_data = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        self._field_name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = options.get(b"filename")
+        if filename is None:
+            return
+        content_type = self._headers.get(b"content-type")
+        self._current = UploadedPart(
+            self._field_name,
+            os.path.basename(filename.decode("utf-8", errors="replace").replace("\\", "/")),
+            content_type.decode("latin-1") if content_type else None
+        )
+        self.files.append(self._current)
+        self._ops.append(("open", self._current, None))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._current is not None:
+            self._ops.append(("data", self._current, data[start:end]))
+        else:
+            self._field_data += data[start:end]
+            if len(self._field_data) > MAX_FIELD_SIZE:
+                raise ValueError(f"Form field '{self._field_name}' is too large")
+
+    def _on_part_end(self):
+        if self._current is not None:
+            self._ops.append(("close", self._current, None))
+            self._current = None
+        else:
+            self.fields[self._field_name] = self._field_data.decode("utf-8", errors="replace")
+
+    async def _flush(self, part: UploadedPart, loop):
+        if part.buffer:
+            data, part.buffer = bytes(part.buffer), bytearray()
+            await loop.run_in_executor(_writer_pool, part.write, data)
+            part.size += len(data)
+
+    async def _run_ops(self, loop):
+        ops, self._ops = self._ops, []
+        for op, part, data in ops:
+            if op == "open":
+                await loop.run_in_executor(_writer_pool, part.open)
+            elif op == "data":
+                part.buffer += data
+                if len(part.buffer) >= UPLOAD_WRITE_BUFFER:
+                    await self._flush(part, loop)
+            else:
+                await self._flush(part, loop)
+                await loop.run_in_executor(_writer_pool, part.close)
+
+    async def parse(self, stream):
+        """
+        读取整个请求体，返回写入完成的文件列表
+        出错（包括客户端断开）时删除已经写入的临时文件
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            async for chunk in stream:
+                self._parser.write(chunk)
+                # 等待本次写入完成后再读取下一块，磁盘慢时对客户端形成背压
+                await self._run_ops(loop)
+            self._parser.finalize()
+            await self._run_ops(loop)
+            if self._current is not None:
+                raise ValueError("Incomplete multipart body")
+        except BaseException:
+            for part in self.files:
+                await loop.run_in_executor(_writer_pool, part.discard)
+            raise
+        return self.files
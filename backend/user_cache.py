@@ -0,0 +1,88 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+from . import models
+
+# 已认证用户的进程内缓存：JWT 校验通过后按 token 的 sub（用户名）缓存用户信息，
+# 常见情况下鉴权不需要查询数据库
+# crud.update_user / crud.delete_user 会使本进程内的缓存失效，
+# 其他 uvicorn worker 中的缓存最多在 USER_CACHE_TTL 秒后过期
+
+# 缓存有效期（秒），0 表示不缓存
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+# 最多缓存的用户数，超过时淘汰最久未使用的
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+
+USER_COLUMNS = [column.key for column in models.User.__table__.columns]
+
+def _snapshot(user: models.User):
+    return {key: getattr(user, key) for key in USER_COLUMNS}
+
+class UserCache:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, username: str) -> Optional[models.User]:
+        """
+        返回一个不属于任何 Session 的 User 对象，每次都是新的副本，
+        调用方修改它不会影响缓存
+        """
+        if self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            values = entry[1]
+        return models.User(**values)
+
+    def put(self, user: models.User):
+        if self.ttl <= 0:
+            return
+        entry = (time.monotonic() + self.ttl, _snapshot(user))
+        with self._lock:
+            self._entries[user.username] = entry
+            self._entries.move_to_end(user.username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, username: str):
+        with self._lock:
+            if self._entries.pop(username, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+user_cache = UserCache(USER_CACHE_TTL, USER_CACHE_MAX_ENTRIES)
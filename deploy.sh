@@ -44,6 +44,8 @@ WorkingDirectory=$PROJECT_DIR
 ExecStart=$CONDA_PATH/envs/$CONDA_ENV/bin/python -m uvicorn backend.main:app --host 127.0.0.1 --port $BACKEND_PORT --workers 4
 Restart=always
 Environment="PATH=$CONDA_PATH/envs/$CONDA_ENV/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin"
+# 文件下载鉴权后交给 Nginx 发送 (见下方 /_protected_uploads/)
+Environment="DOWNLOAD_BACKEND=nginx"
 
 [Install]
 WantedBy=multi-user.target
@@ -91,6 +93,15 @@ server {
         proxy_set_header X-Forwarded-Proto \$scheme;
     }
 
+    # 下载文件：后端完成鉴权后返回 X-Accel-Redirect，由 Nginx 直接发送文件
+    # internal 表示只能通过 X-Accel-Redirect 访问，外部请求返回 404
+    location /_protected_uploads/ {
+        internal;
+        alias $PROJECT_DIR/uploads/;
+        sendfile on;
+        tcp_nopush on;
+    }
+
     # 上传文件存储目录
     location /uploads {
         alias $PROJECT_DIR/uploads;
@@ -0,0 +1,126 @@
+"""
+并发上传压测：对比 /api/files/upload 与 /api/files/upload/stream 的总吞吐量，
+以及上传期间列表接口的响应时间
+
+用法: python scripts/bench_concurrent_uploads.py [--size-mb 64] [--concurrency 1,4,16,32] [--endpoints upload,stream]
+                                                [--url http://127.0.0.1:8000]
+不指定 --url 时在临时目录中启动一个独立的 uvicorn（数据库和上传目录都在临时目录中），
+指定 --url 时压测已经运行的服务（需要 admin/admin123 账号）
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOUNDARY = "neoshare-bench-boundary"
+BLOCK = os.urandom(256 * 1024)
+ENDPOINTS = {"upload": "/api/files/upload", "stream": "/api/files/upload/stream"}
+
+def start_server(port: int):
+    work_dir = tempfile.mkdtemp(prefix="neoshare-bench-")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(work_dir, 'bench.db')}", PYTHONPATH=ROOT_DIR)
+    os.makedirs(os.path.join(work_dir, "uploads"), exist_ok=True)
+    subprocess.run([sys.executable, "-m", "backend.init_db"], cwd=work_dir, env=env, check=True, stdout=subprocess.DEVNULL)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=work_dir, env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited, is port {port} already in use?")
+        try:
+            httpx.get(url + "/", timeout=1)
+            return server, url, work_dir
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Server did not start")
+
+async def multipart_body(name: str, size: int):
+    # 边生成边发送，客户端不需要在内存中保存完整的请求体
+    yield (
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"path\"\r\n\r\n/bench\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"is_public\"\r\n\r\ntrue\r\n"
+        f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{name}\"\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    sent = 0
+    while sent < size:
+        block = BLOCK[:size - sent]
+        sent += len(block)
+        yield block
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+async def upload(client: httpx.AsyncClient, endpoint: str, name: str, size: int):
+    r = await client.post(
+        endpoint, content=multipart_body(name, size),
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+    )
+    r.raise_for_status()
+
+async def probe_listing(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list):
+    # 上传期间持续请求列表接口，观察线程池是否被上传占满
+    while not stop.is_set():
+        start = time.perf_counter()
+        r = await client.get("/api/files/list/public", params={"path": "/", "limit": 50})
+        r.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.05)
+
+async def run_round(url: str, token: str, endpoint: str, concurrency: int, size: int):
+    limits = httpx.Limits(max_connections=concurrency + 2)
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(base_url=url, headers=headers, timeout=None, limits=limits) as client:
+        stop = asyncio.Event()
+        latencies = []
+        probe = asyncio.create_task(probe_listing(client, stop, latencies))
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            upload(client, endpoint, f"bench_{concurrency}_{i}.bin", size) for i in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+    throughput = concurrency * size / elapsed / 1024 / 1024
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    worst = latencies[-1] * 1000 if latencies else 0
+    print(f"{endpoint:<24} concurrency={concurrency:<4} {throughput:8.1f} MB/s  time={elapsed:6.2f}s  "
+          f"list p50={p50:6.1f}ms max={worst:7.1f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--concurrency", default="1,4,16,32")
+    parser.add_argument("--endpoints", default="upload,stream")
+    parser.add_argument("--url")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        server, url, work_dir = start_server(args.port)
+        print(f"Started server at {url} ({work_dir})")
+    try:
+        r = httpx.post(url + "/api/auth/login", data={"username": "admin", "password": "admin123"})
+        r.raise_for_status()
+        token = r.json()["access_token"]
+        size = args.size_mb * 1024 * 1024
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            for endpoint in args.endpoints.split(","):
+                asyncio.run(run_round(url, token, ENDPOINTS[endpoint], concurrency, size))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+数据库并发压测：多个进程（模拟多个 uvicorn worker）同时执行读写混合的负载，
+统计吞吐量、读写延迟以及 "database is locked" 错误数
+
+用法: python scripts/bench_database.py [--processes 4] [--threads 4] [--duration 10] [--write-ratio 0.2]
+                                       [--files 10000] [--database-url sqlite:///...]
+不指定 --database-url 时在临时目录中创建 SQLite 数据库
+对比修改前的行为: SQLITE_JOURNAL_MODE=DELETE SQLITE_SYNCHRONOUS=FULL python scripts/bench_database.py
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def seed(database_url: str, count: int):
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, ROOT_DIR)
+    from backend import database, models, migrations
+
+    migrations.upgrade(database.engine)
+    db = database.SessionLocal()
+    try:
+        if db.query(models.File).count() >= count:
+            return
+        db.bulk_save_objects([
+            models.File(
+                name=f"bench_{i}.txt", path=f"/bench/{i % 100}", type="file", size=i,
+                is_public=True, user_id=None, mtime=time.time()
+            )
+            for i in range(count)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+def worker(database_url: str, threads: int, duration: float, write_ratio: float, count: int, queue):
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, ROOT_DIR)
+    from sqlalchemy.exc import OperationalError
+    from backend import database, models
+
+    results = {"reads": [], "writes": [], "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def run():
+        reads, writes, errors = [], [], 0
+        rng = random.Random()
+        while time.monotonic() < deadline:
+            db = database.SessionLocal()
+            start = time.perf_counter()
+            try:
+                if rng.random() < write_ratio:
+                    # 与同步、上传登记类似的单行更新 + 提交
+                    file_id = rng.randint(1, count)
+                    db.query(models.File).filter(models.File.id == file_id).update(
+                        {models.File.mtime: time.time(), models.File.size: rng.randint(0, 1 << 20)}
+                    )
+                    db.commit()
+                    writes.append(time.perf_counter() - start)
+                else:
+                    # 与目录列表类似的读取
+                    db.query(models.File).filter(
+                        models.File.path == f"/bench/{rng.randint(0, 99)}", models.File.is_public == True
+                    ).order_by(models.File.name).limit(50).all()
+                    reads.append(time.perf_counter() - start)
+            except OperationalError:
+                db.rollback()
+                errors += 1
+            finally:
+                db.close()
+        with lock:
+            results["reads"] += reads
+            results["writes"] += writes
+            results["errors"] += errors
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    queue.put(results)
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if not database_url:
+        work_dir = tempfile.mkdtemp(prefix="neoshare-dbbench-")
+        database_url = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    ctx = multiprocessing.get_context("spawn")
+    seeder = ctx.Process(target=seed, args=(database_url, args.files))
+    seeder.start()
+    seeder.join()
+
+    queue = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker, args=(database_url, args.threads, args.duration, args.write_ratio, args.files, queue))
+        for _ in range(args.processes)
+    ]
+    for p in processes:
+        p.start()
+    reads, writes, errors = [], [], 0
+    for _ in processes:
+        result = queue.get()
+        reads += result["reads"]
+        writes += result["writes"]
+        errors += result["errors"]
+    for p in processes:
+        p.join()
+
+    print(f"{database_url}  journal={os.getenv('SQLITE_JOURNAL_MODE', 'WAL')} synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    print(f"processes={args.processes} threads={args.threads} write_ratio={args.write_ratio}")
+    print(f"reads : {len(reads) / args.duration:9.1f}/s  p50={percentile(reads, 0.5):7.2f}ms  p99={percentile(reads, 0.99):8.2f}ms")
+    print(f"writes: {len(writes) / args.duration:9.1f}/s  p50={percentile(writes, 0.5):7.2f}ms  p99={percentile(writes, 0.99):8.2f}ms")
+    print(f"errors: {errors}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+登录压测：并发登录的吞吐量，以及登录期间其他请求（列表接口）的响应时间
+bcrypt 在事件循环中同步执行时，登录高峰会让同一 worker 上的所有请求排队
+
+用法: python scripts/bench_login.py [--concurrency 1,8,32] [--duration 10] [--rounds 12]
+                                    [--url http://127.0.0.1:8000]
+不指定 --url 时在临时目录中启动一个独立的 uvicorn（单 worker），--rounds 设置其 BCRYPT_ROUNDS，
+指定 --url 时压测已经运行的服务（需要 admin/admin123 账号），可以用来对比修改前后的版本
+"""
+import os
+import time
+import asyncio
+import argparse
+
+import httpx
+
+from bench_concurrent_uploads import start_server
+
+async def login_loop(client: httpx.AsyncClient, stop: asyncio.Event, counts: list):
+    while not stop.is_set():
+        r = await client.post("/api/auth/login", data={"username": "admin", "password": "admin123"})
+        r.raise_for_status()
+        counts.append(1)
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        r = await client.get("/api/files/list/public", params={"path": "/", "limit": 50})
+        r.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.02)
+
+async def run_round(url: str, concurrency: int, duration: float):
+    limits = httpx.Limits(max_connections=concurrency + 2)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        stop = asyncio.Event()
+        counts = []
+        latencies = []
+        tasks = [asyncio.create_task(login_loop(client, stop, counts)) for _ in range(concurrency)]
+        tasks.append(asyncio.create_task(probe(client, stop, latencies)))
+        start = time.perf_counter()
+        await asyncio.sleep(duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+    print(f"concurrency={concurrency:<4} logins={len(counts) / elapsed:7.1f}/s  "
+          f"list p50={p50:7.1f}ms p99={p99:7.1f}ms requests={len(latencies)}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--url")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+        server, url, work_dir = start_server(args.port)
+        print(f"Started server at {url} ({work_dir}), BCRYPT_ROUNDS={args.rounds}")
+    try:
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            asyncio.run(run_round(url, concurrency, args.duration))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
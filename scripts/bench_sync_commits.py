@@ -0,0 +1,78 @@
+"""
+对比目录同步时逐条提交与批量提交的事务数和耗时
+
+用法: python scripts/bench_sync_commits.py [文件数量]
+在临时目录中创建独立的数据库和上传目录，不会影响项目中的 neoshare.db
+"""
+import os
+import sys
+import time
+import tempfile
+import mimetypes
+
+WORK_DIR = tempfile.mkdtemp(prefix="neoshare-bench-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORK_DIR)
+
+from sqlalchemy import event
+from backend.database import SessionLocal, engine
+from backend import crud, migrations, schemas, sync
+
+commits = 0
+
+@event.listens_for(engine, "commit")
+def count_commit(conn):
+    global commits
+    commits += 1
+
+def prepare(count: int):
+    base_dir = os.path.join("uploads", "public")
+    os.makedirs(base_dir, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(base_dir, f"file_{i:05d}.txt"), "w") as f:
+            f.write("x" * (i % 100))
+    return base_dir
+
+def reset_files(db):
+    db.query(crud.models.File).delete()
+    db.query(crud.models.DirectoryState).delete()
+    db.commit()
+
+def per_entry_sync(db, base_dir: str):
+    # 优化前的写法：每个目录项调用一次 crud.create_file，各自提交
+    for entry in os.scandir(base_dir):
+        mime_type, _ = mimetypes.guess_type(entry.path)
+        crud.create_file(db, schemas.FileCreate(
+            name=entry.name,
+            path="/",
+            type="file",
+            size=entry.stat().st_size,
+            mime_type=mime_type,
+            is_public=True
+        ), 1)
+
+def run(label: str, func, db, base_dir: str):
+    global commits
+    reset_files(db)
+    commits = 0
+    start = time.perf_counter()
+    func(db, base_dir)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} commits={commits:<6} time={elapsed:.3f}s")
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    migrations.upgrade(engine)
+    base_dir = prepare(count)
+    print(f"Syncing {count} new files ({WORK_DIR})")
+
+    db = SessionLocal()
+    try:
+        run("per-entry", per_entry_sync, db, base_dir)
+        run("batched", lambda db, base_dir: sync.sync_directory_to_db(db, base_dir, "/", True, 1, force=True), db, base_dir)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
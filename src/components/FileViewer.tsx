@@ -43,6 +43,8 @@ interface FileViewerProps {
 export const FileViewer: React.FC<FileViewerProps> = ({ file, onClose }) => {
   const { isAuthenticated, user } = useAuthStore();
   const [content, setContent] = useState('');
+  // 加载时文件的版本号，保存时通过 If-Match 带回，文件已被他人修改时服务端返回 412
+  const [version, setVersion] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
   const [saving, setSaving] = useState(false);
   const [saveSuccess, setSaveSuccess] = useState(false);
@@ -129,6 +131,7 @@ export const FileViewer: React.FC<FileViewerProps> = ({ file, onClose }) => {
       } else {
         const res = await client.get(`/files/content/${file.id}`);
         setContent(res.data.content);
+        setVersion(res.data.etag ?? null);
       }
     } catch (err) {
       setError('无法加载文件内容');
@@ -140,10 +143,19 @@ export const FileViewer: React.FC<FileViewerProps> = ({ file, onClose }) => {
   const handleSave = async () => {
     setSaving(true);
     try {
-      await client.put(`/files/content/${file.id}`, { content });
+      const res = await client.put(
+        `/files/content/${file.id}`,
+        { content },
+        version ? { headers: { 'If-Match': version } } : undefined
+      );
+      setVersion(res.data.etag ?? null);
       setSaveSuccess(true);
-    } catch (err) {
-      alert('保存失败');
+    } catch (err: any) {
+      if (err?.response?.status === 412) {
+        alert('文件已被其他人修改，请复制当前内容后重新打开文件再保存');
+      } else {
+        alert('保存失败');
+      }
     } finally {
       setSaving(false);
     }
@@ -151,6 +163,8 @@ export const FileViewer: React.FC<FileViewerProps> = ({ file, onClose }) => {
 
   const downloadUrl = `${client.defaults.baseURL}/files/download/${file.id}`;
   const previewUrl = `${downloadUrl}?preview=true`;
+  // 图片先显示服务端生成的预览图，无法生成时（如 SVG）回退到原图
+  const imagePreviewUrl = `${client.defaults.baseURL}/files/thumbnail/${file.id}?variant=preview`;
 
   return (
     <div className="fixed inset-0 z-50 bg-black/80 flex items-center justify-center p-4 backdrop-blur-sm">
@@ -261,7 +275,12 @@ export const FileViewer: React.FC<FileViewerProps> = ({ file, onClose }) => {
              </div>
           ) : isImage ? (
             <div className="w-full h-full flex items-center justify-center p-4">
-               <img src={previewUrl} alt={file.name} className="max-w-full max-h-full object-contain" />
+               <img
+                 src={imagePreviewUrl}
+                 alt={file.name}
+                 className="max-w-full max-h-full object-contain"
+                 onError={(e) => { if (e.currentTarget.src !== previewUrl) e.currentTarget.src = previewUrl; }}
+               />
             </div>
           ) : isPdf ? (
             <iframe src={previewUrl} className="w-full h-full border-none" title="PDF Preview" />
@@ -0,0 +1,60 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+import pytest
+
+# 以仓库根目录为工作目录运行时才能导入 backend 包
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 接口测试使用临时目录中的数据库和上传目录，不修改仓库中的 neoshare.db
+# 必须在导入 backend 之前设置，数据库引擎在导入时创建
+TEST_ROOT = tempfile.mkdtemp(prefix="neoshare-test-")
+atexit.register(shutil.rmtree, TEST_ROOT, True)
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(TEST_ROOT, "neoshare.db")
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["NOTEBOOK_RENDER_WORKERS"] = "0"
+os.environ["THUMBNAIL_WORKERS"] = "0"
+
+@pytest.fixture(scope="session")
+def client():
+    # 上传目录 uploads 相对于工作目录
+    cwd = os.getcwd()
+    os.makedirs(os.path.join(TEST_ROOT, "uploads"), exist_ok=True)
+    os.chdir(TEST_ROOT)
+    try:
+        from fastapi.testclient import TestClient
+        from backend.main import app
+        from backend.init_db import init_db
+
+        init_db()
+        with TestClient(app) as test_client:
+            yield test_client
+    finally:
+        os.chdir(cwd)
+
+@pytest.fixture(scope="session")
+def headers(client):
+    response = client.post("/api/auth/login", data={"username": "admin", "password": "admin123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+@pytest.fixture
+def db(client):
+    from backend.database import SessionLocal
+
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def root(request, client, headers):
+    """
+    每个测试使用公共区中单独的目录，返回其路径
+    """
+    name = request.node.name.replace("[", "-").replace("]", "")
+    response = client.post("/api/files/directory", headers=headers, json={"name": name, "path": "/", "is_public": True})
+    assert response.status_code == 200, response.text
+    return "/" + name
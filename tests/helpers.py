@@ -0,0 +1,21 @@
+# 接口测试的公共操作，都在公共区中进行
+
+def upload(client, headers, path: str, name: str, data: bytes):
+    response = client.post(
+        "/api/files/upload", headers=headers,
+        data={"path": path, "is_public": "true"}, files={"file": (name, data, "application/octet-stream")}
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def mkdir(client, headers, path: str, name: str):
+    response = client.post("/api/files/directory", headers=headers, json={"name": name, "path": path, "is_public": True})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def directory(db, full_path: str):
+    # 读取目录的当前记录（大小和文件数）
+    from backend import crud
+
+    db.expire_all()
+    return crud.get_directory(db, full_path, True)
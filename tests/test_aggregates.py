@@ -0,0 +1,39 @@
+from helpers import upload, mkdir, directory
+
+def aggregates(db, full_path):
+    db_dir = directory(db, full_path)
+    return db_dir.size, db_dir.file_count
+
+def test_upload_updates_all_ancestors(client, headers, db, root):
+    mkdir(client, headers, root, "a")
+    mkdir(client, headers, f"{root}/a", "b")
+    upload(client, headers, f"{root}/a/b", "x.bin", b"x" * 100)
+    upload(client, headers, f"{root}/a", "y.bin", b"y" * 50)
+    assert aggregates(db, f"{root}/a/b") == (100, 1)
+    assert aggregates(db, f"{root}/a") == (150, 2)
+    assert aggregates(db, root) == (150, 2)
+
+    # 覆盖同名文件时只计入大小的变化
+    upload(client, headers, f"{root}/a/b", "x.bin", b"x" * 30)
+    assert aggregates(db, f"{root}/a/b") == (30, 1)
+    assert aggregates(db, root) == (80, 2)
+
+def test_move_and_delete_update_ancestors(client, headers, db, root):
+    mkdir(client, headers, root, "a")
+    mkdir(client, headers, f"{root}/a", "b")
+    db_file = upload(client, headers, f"{root}/a/b", "x.bin", b"x" * 100)
+    upload(client, headers, f"{root}/a", "y.bin", b"y" * 50)
+
+    response = client.post(f"/api/files/{db_file['id']}/move", headers=headers, json={"target_path": root})
+    assert response.status_code == 200, response.text
+    assert aggregates(db, f"{root}/a/b") == (0, 0)
+    assert aggregates(db, f"{root}/a") == (50, 1)
+    assert aggregates(db, root) == (150, 2)
+
+    response = client.delete(f"/api/files/{directory(db, f'{root}/a').id}", headers=headers)
+    assert response.status_code == 200, response.text
+    assert aggregates(db, root) == (100, 1)
+
+    response = client.delete(f"/api/files/{db_file['id']}", headers=headers)
+    assert response.status_code == 200, response.text
+    assert aggregates(db, root) == (0, 0)
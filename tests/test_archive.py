@@ -0,0 +1,55 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from backend import archive
+from helpers import upload, mkdir, directory
+
+FILES = {
+    "dir/a.txt": b"hello",
+    "dir/空.bin": b"",
+    "dir/sub/big.bin": os.urandom(archive.READ_BLOCK_SIZE + 123),
+}
+
+@pytest.fixture
+def entries(tmp_path):
+    result = [archive.ArchiveEntry("dir", None, 0, 0, is_dir=True)]
+    for arcname, data in FILES.items():
+        path = tmp_path / arcname.replace("/", "_")
+        path.write_bytes(data)
+        result.append(archive.ArchiveEntry(arcname, str(path), len(data), 1700000000))
+    return result
+
+def test_zip_size_matches_stream(entries):
+    data = b"".join(archive.stream_zip(entries))
+    assert len(data) == archive.zip_size(entries)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert {name: zf.read(name) for name in FILES} == FILES
+        assert "dir/" in zf.namelist()
+
+def test_zip_size_when_file_changes(entries):
+    # 打包期间文件变长或变短时仍然按预先计算的大小输出
+    with open(entries[1].path, "ab") as f:
+        f.write(b"appended")
+    with open(entries[3].path, "r+b") as f:
+        f.truncate(10)
+    assert len(b"".join(archive.stream_zip(entries))) == archive.zip_size(entries)
+
+def test_deflate_and_tar_gz_round_trip(entries):
+    with zipfile.ZipFile(io.BytesIO(b"".join(archive.stream_zip(entries, "deflate")))) as zf:
+        assert {name: zf.read(name) for name in FILES} == FILES
+    with tarfile.open(fileobj=io.BytesIO(b"".join(archive.stream_tar_gz(entries))), mode="r:gz") as tf:
+        assert {name: tf.extractfile(name).read() for name in FILES} == FILES
+
+def test_archive_endpoint_content_length(client, headers, db, root):
+    mkdir(client, headers, root, "docs")
+    upload(client, headers, f"{root}/docs", "a.txt", b"a" * 1000)
+    response = client.get("/api/files/archive", headers=headers, params={"ids": directory(db, f"{root}/docs").id})
+    assert response.status_code == 200, response.text
+    assert int(response.headers["content-length"]) == len(response.content)
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert zf.read("docs/a.txt") == b"a" * 1000
@@ -0,0 +1,54 @@
+import os
+import hashlib
+
+from backend.routers import uploads
+from backend.storage import get_partial_path
+
+CHUNK_SIZE = uploads.UPLOAD_MIN_CHUNK_SIZE
+DATA = os.urandom(CHUNK_SIZE * 2 + 1000)
+
+def chunk(index):
+    return DATA[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+
+def init(client, headers, root, name):
+    response = client.post("/api/files/uploads", headers=headers, json={
+        "name": name, "path": root, "is_public": True, "size": len(DATA), "chunk_size": CHUNK_SIZE
+    })
+    assert response.status_code == 200, response.text
+    assert response.json()["total_chunks"] == 3
+    return response.json()["upload_id"]
+
+def put(client, headers, upload_id, index, data, checksum=None):
+    extra = {"X-Chunk-Sha256": checksum} if checksum else {}
+    return client.put(f"/api/files/uploads/{upload_id}/{index}", headers={**headers, **extra}, content=data)
+
+def test_complete_requires_all_chunks(client, headers, root):
+    upload_id = init(client, headers, root, "big.bin")
+    # 乱序上传，缺少第 1 片
+    for index in (2, 0):
+        response = put(client, headers, upload_id, index, chunk(index), hashlib.sha256(chunk(index)).hexdigest())
+        assert response.status_code == 200, response.text
+    assert client.get(f"/api/files/uploads/{upload_id}", headers=headers).json()["received"] == [0, 2]
+
+    response = client.post(f"/api/files/uploads/{upload_id}/complete", headers=headers)
+    assert response.status_code == 409
+    assert response.json()["detail"]["missing"] == [1]
+
+    assert put(client, headers, upload_id, 1, chunk(1)).status_code == 200
+    response = client.post(f"/api/files/uploads/{upload_id}/complete", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["size"] == len(DATA)
+
+    with open(os.path.join("uploads", "public", root.strip("/"), "big.bin"), "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(get_partial_path(upload_id))
+    # 完成后会话被删除
+    assert client.get(f"/api/files/uploads/{upload_id}", headers=headers).status_code == 404
+
+def test_rejects_bad_chunks(client, headers, root):
+    upload_id = init(client, headers, root, "bad.bin")
+    assert put(client, headers, upload_id, 0, chunk(0), "0" * 64).status_code == 400
+    assert put(client, headers, upload_id, 0, chunk(0)[:-1]).status_code == 400
+    assert put(client, headers, upload_id, 2, chunk(2) + b"x").status_code == 400
+    assert put(client, headers, upload_id, 3, b"x").status_code == 400
+    assert client.get(f"/api/files/uploads/{upload_id}", headers=headers).json()["received"] == []
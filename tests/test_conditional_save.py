@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from backend import storage
+from helpers import upload
+
+def load(client, headers, file_id):
+    return client.get(f"/api/files/content/{file_id}", headers=headers).json()
+
+def test_stale_if_match_is_rejected(client, headers, root):
+    file_id = upload(client, headers, root, "a.txt", b"v1")["id"]
+    etag = load(client, headers, file_id)["etag"]
+
+    # 两个编辑器加载了同一个版本，先保存的成功，后保存的得到 412
+    response = client.put(f"/api/files/content/{file_id}", headers={**headers, "If-Match": etag}, json={"content": "v2"})
+    assert response.status_code == 200, response.text
+    current = response.headers["etag"]
+    assert current != etag
+
+    response = client.put(f"/api/files/content/{file_id}", headers={**headers, "If-Match": etag}, json={"content": "v3"})
+    assert response.status_code == 412
+    assert response.headers["etag"] == current
+    response = client.patch(f"/api/files/content/{file_id}", headers={**headers, "If-Match": etag},
+                            json={"edits": [{"offset": 0, "length": 2, "text": "v4"}]})
+    assert response.status_code == 412
+    assert load(client, headers, file_id)["content"] == "v2"
+
+    # 带上当前版本后可以保存；不带 If-Match 时无条件覆盖
+    response = client.put(f"/api/files/content/{file_id}", headers={**headers, "If-Match": current}, json={"content": "v5"})
+    assert response.status_code == 200, response.text
+    assert client.put(f"/api/files/content/{file_id}", headers=headers, json={"content": "v6"}).status_code == 200
+    assert load(client, headers, file_id)["content"] == "v6"
+
+def test_check_runs_before_replacing(tmp_path):
+    # 替换前在锁内再检查一次，检查失败时原文件不变，临时文件被删除
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"old")
+
+    def check():
+        raise RuntimeError("modified")
+
+    with pytest.raises(RuntimeError):
+        storage.atomic_write(str(path), b"new", check)
+    assert path.read_bytes() == b"old"
+    assert os.listdir(tmp_path) == ["a.txt"]
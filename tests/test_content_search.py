@@ -0,0 +1,21 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from backend import models, content_index, search
+
+def test_sqlite_fallback_without_fts(monkeypatch):
+    # 未创建 FTS5 表时不能使用只有 PostgreSQL 才有的函数
+    # FTS 表是否存在按进程缓存，不能沿用其他测试中应用数据库的结果
+    monkeypatch.setattr(search, "_fts_tables", {})
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        for file_id, content in [(1, "x" * 100 + "Hello World"), (2, "hello there"), (3, "nope")]:
+            db.add(models.File(id=file_id, name=f"{file_id}.txt", path="/", type="file", is_public=True))
+            db.flush()
+            db.add(models.FileContent(file_id=file_id, content=content, size=len(content), mtime=0))
+        db.commit()
+        results = content_index.apply_content_search(db, db.query(models.File), "HELLO").all()
+    assert [db_file.id for db_file, _ in results] == [1, 2]
+    assert results[0][1] == "x" * 40 + "Hello World"
+    assert results[1][1] == "hello there"
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+from sqlalchemy.orm import Session
+
+from backend import models, trash
+from backend.database import SessionLocal
+from helpers import upload, mkdir, directory
+
+def physical(full_path):
+    return os.path.join("uploads", "public", full_path.strip("/"))
+
+def subtree_count(full_path):
+    with SessionLocal() as session:
+        return session.query(models.File).filter(
+            models.File.is_public.is_(True),
+            (models.File.path == full_path) | models.File.path.like(full_path + "/%")
+        ).count()
+
+def make_tree(client, headers, root):
+    mkdir(client, headers, root, "tree")
+    mkdir(client, headers, f"{root}/tree", "sub")
+    upload(client, headers, f"{root}/tree", "a.txt", b"a")
+    upload(client, headers, f"{root}/tree/sub", "b.txt", b"bb")
+
+def test_recursive_delete_wakes_cleaner_after_commit(client, headers, db, root, monkeypatch):
+    make_tree(client, headers, root)
+    tree_id = directory(db, f"{root}/tree").id
+    woken = []
+
+    def wake(trash_path=None):
+        # 唤醒清理线程时删除已经提交，回收区中的内容仍是待定状态
+        with SessionLocal() as session:
+            committed = session.get(models.File, tree_id) is None
+        woken.append((committed, os.path.basename(trash_path).startswith(trash.PENDING_PREFIX)))
+
+    monkeypatch.setattr(trash, "wake", wake)
+    response = client.delete(f"/api/files/{tree_id}", headers=headers)
+    assert response.status_code == 200, response.text
+    assert woken == [(True, True)]
+    assert subtree_count(f"{root}/tree") == 0
+    assert not os.path.exists(physical(f"{root}/tree"))
+    assert (directory(db, root).size, directory(db, root).file_count) == (0, 0)
+
+def test_failed_commit_restores_tree(client, headers, db, root, monkeypatch):
+    make_tree(client, headers, root)
+    tree_id = directory(db, f"{root}/tree").id
+    woken = []
+    monkeypatch.setattr(trash, "wake", lambda trash_path=None: woken.append(trash_path))
+
+    def fail(self):
+        raise RuntimeError("commit failed")
+
+    monkeypatch.setattr(Session, "commit", fail)
+    with pytest.raises(RuntimeError):
+        client.delete(f"/api/files/{tree_id}", headers=headers)
+    monkeypatch.undo()
+
+    assert woken == []
+    assert os.path.exists(physical(f"{root}/tree/sub/b.txt"))
+    assert subtree_count(f"{root}/tree") == 3
+    with SessionLocal() as session:
+        assert session.get(models.File, tree_id) is not None
+
+def test_cleaner_skips_pending_entries(client, root):
+    # client: 工作目录为测试用的上传目录所在的目录
+    target = physical(f"{root}/doomed")
+    os.makedirs(target)
+    with open(os.path.join(target, "f.txt"), "wb") as f:
+        f.write(b"x")
+    trash_path = trash.move_to_trash(target)
+
+    trash.empty_trash()
+    assert os.path.exists(trash_path)
+
+    trash.wake(trash_path)
+    trash.empty_trash()
+    assert not os.path.exists(trash_path)
+    assert not os.path.exists(os.path.join(trash.TRASH_DIR, os.path.basename(trash_path)[len(trash.PENDING_PREFIX):]))
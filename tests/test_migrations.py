@@ -0,0 +1,100 @@
+import os
+import shutil
+import sqlite3
+
+from sqlalchemy import create_engine, inspect
+
+from backend import migrations
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 引入版本化迁移之前的表结构（与仓库中的 neoshare.db 相同）
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL,
+    username VARCHAR NOT NULL,
+    password_hash VARCHAR NOT NULL,
+    role VARCHAR,
+    avatar_url VARCHAR,
+    nickname VARCHAR,
+    signature VARCHAR,
+    created_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    updated_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    PRIMARY KEY (id)
+);
+CREATE UNIQUE INDEX ix_users_username ON users (username);
+CREATE INDEX ix_users_id ON users (id);
+CREATE TABLE files (
+    id INTEGER NOT NULL,
+    user_id INTEGER,
+    name VARCHAR NOT NULL,
+    path VARCHAR NOT NULL,
+    type VARCHAR NOT NULL,
+    size BIGINT,
+    mime_type VARCHAR,
+    is_public BOOLEAN,
+    created_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    updated_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES users (id)
+);
+CREATE INDEX ix_files_path ON files (path);
+CREATE INDEX ix_files_is_public ON files (is_public);
+CREATE INDEX ix_files_id ON files (id);
+INSERT INTO users (id, username, password_hash, role) VALUES (1, 'admin', 'x', 'admin');
+INSERT INTO files (id, user_id, name, path, type, size, is_public) VALUES
+    (1, 1, 'docs', '/', 'directory', 0, 1),
+    (2, 1, 'a.txt', '/docs', 'file', 5, 1),
+    (3, 1, 'a.txt', '/docs', 'file', 5, 1),
+    (4, 1, 'b.txt', '/', 'file', 7, 0);
+"""
+
+def _upgrade(db_path):
+    engine = create_engine(f"sqlite:///{db_path}")
+    try:
+        version = migrations.upgrade(bind=engine)
+        indexes = {index["name"] for index in inspect(engine).get_indexes("files")}
+        columns = {column["name"] for column in inspect(engine).get_columns("files")}
+    finally:
+        engine.dispose()
+    return version, indexes, columns
+
+def test_upgrade_baseline_schema(tmp_path):
+    db_path = tmp_path / "baseline.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+    version, indexes, columns = _upgrade(db_path)
+
+    assert version == migrations.LATEST_VERSION
+    assert {"mtime", "file_count", "parent_id", "content_hash"} <= columns
+    assert {
+        "ix_files_public_path_name", "ix_files_private_owner_path_name",
+        "ix_files_parent_id", "ix_files_content_hash",
+    } <= indexes
+    assert not {"ix_files_path", "ix_files_is_public"} & indexes
+
+    conn = sqlite3.connect(db_path)
+    try:
+        # 重复记录被去除，目录聚合和 parent_id 已经回填
+        assert conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 3
+        assert conn.execute("SELECT size, file_count FROM files WHERE id = 1").fetchone() == (5, 1)
+        assert conn.execute("SELECT parent_id FROM files WHERE id = 2").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+def test_upgrade_checked_in_database(tmp_path):
+    db_path = tmp_path / "neoshare.db"
+    shutil.copy(os.path.join(REPO_ROOT, "neoshare.db"), db_path)
+
+    version, indexes, columns = _upgrade(db_path)
+
+    assert version == migrations.LATEST_VERSION
+    assert "content_hash" in columns
+    assert "ix_files_content_hash" in indexes
+
+def test_upgrade_is_idempotent(tmp_path):
+    db_path = tmp_path / "fresh.db"
+    assert _upgrade(db_path)[0] == migrations.LATEST_VERSION
+    assert _upgrade(db_path)[0] == migrations.LATEST_VERSION
@@ -0,0 +1,61 @@
+import os
+
+from backend import models
+from helpers import upload, mkdir, directory
+
+def paths_under(db, full_path):
+    db.expire_all()
+    rows = db.query(models.File).filter(models.File.is_public.is_(True), models.File.path.like(full_path + "%"))
+    return sorted(f"{row.path}/{row.name}".replace("//", "/") for row in rows)
+
+def physical(full_path):
+    return os.path.join("uploads", "public", full_path.strip("/"))
+
+def test_move_rewrites_subtree_paths(client, headers, db, root):
+    mkdir(client, headers, root, "src")
+    mkdir(client, headers, f"{root}/src", "inner")
+    upload(client, headers, f"{root}/src/inner", "f.txt", b"f")
+    # 名称以 src 开头的兄弟目录不属于被移动的子树
+    mkdir(client, headers, root, "srcx")
+    upload(client, headers, f"{root}/srcx", "g.txt", b"g")
+    mkdir(client, headers, root, "dst")
+
+    response = client.post(f"/api/files/{directory(db, f'{root}/src').id}/move", headers=headers,
+                           json={"target_path": f"{root}/dst", "name": "moved"})
+    assert response.status_code == 200, response.text
+
+    assert paths_under(db, f"{root}/dst") == [f"{root}/dst/moved", f"{root}/dst/moved/inner", f"{root}/dst/moved/inner/f.txt"]
+    assert paths_under(db, f"{root}/src") == [f"{root}/srcx/g.txt"]
+    assert directory(db, f"{root}/dst/moved/inner").parent_id == directory(db, f"{root}/dst/moved").id
+    with open(physical(f"{root}/dst/moved/inner/f.txt"), "rb") as f:
+        assert f.read() == b"f"
+    assert not os.path.exists(physical(f"{root}/src"))
+    assert (directory(db, f"{root}/dst").size, directory(db, f"{root}/dst").file_count) == (1, 1)
+
+def test_move_into_itself_is_rejected(client, headers, db, root):
+    mkdir(client, headers, root, "a")
+    mkdir(client, headers, f"{root}/a", "b")
+    response = client.post(f"/api/files/{directory(db, f'{root}/a').id}/move", headers=headers,
+                           json={"target_path": f"{root}/a/b"})
+    assert response.status_code == 400
+
+def test_copy_updates_aggregates(client, headers, db, root):
+    mkdir(client, headers, root, "src")
+    mkdir(client, headers, f"{root}/src", "inner")
+    upload(client, headers, f"{root}/src", "a.bin", b"a" * 100)
+    upload(client, headers, f"{root}/src/inner", "b.bin", b"b" * 50)
+    mkdir(client, headers, root, "dst")
+
+    response = client.post(f"/api/files/{directory(db, f'{root}/src').id}/copy", headers=headers,
+                           json={"target_path": f"{root}/dst"})
+    assert response.status_code == 200, response.text
+
+    copied = directory(db, f"{root}/dst/src")
+    assert (copied.size, copied.file_count) == (150, 2)
+    assert (directory(db, f"{root}/dst/src/inner").size, directory(db, f"{root}/dst/src/inner").file_count) == (50, 1)
+    assert (directory(db, f"{root}/dst").size, directory(db, f"{root}/dst").file_count) == (150, 2)
+    assert (directory(db, root).size, directory(db, root).file_count) == (300, 4)
+    # 原目录不变
+    assert (directory(db, f"{root}/src").size, directory(db, f"{root}/src").file_count) == (150, 2)
+    with open(physical(f"{root}/dst/src/inner/b.bin"), "rb") as f:
+        assert f.read() == b"b" * 50
@@ -0,0 +1,19 @@
+from backend import notebook_stream
+
+NAME = "v1-10-20-m400-c{}-o0.png"
+
+def test_stream_page_replaces_placeholders_across_chunks():
+    page = "".join(
+        f"<p>{'x' * i}</p><img src=\"{notebook_stream.resource_placeholder(NAME.format(i))}\"/>" for i in range(40)
+    ).encode("utf-8")
+    resource_url = lambda name: f"/r/{name}?expires=1&signature=s"
+    for chunk_size in (257, 300, 1024):
+        chunks = list(notebook_stream.stream_page(page, resource_url, chunk_size))
+        result = b"".join(chunks).decode("utf-8")
+        assert "nb-resource:" not in result
+        for i in range(40):
+            assert f"src=\"/r/{NAME.format(i)}?expires=1&amp;signature=s\"" in result
+
+def test_stream_page_keeps_unknown_names():
+    page = b"<p>nb-resource:not-a-resource</p>"
+    assert b"".join(notebook_stream.stream_page(page, lambda name: "/x")) == page
@@ -0,0 +1,33 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from backend import models, pagination
+
+def _apply(sort, cursor_data):
+    query = Session().query(models.File)
+    return pagination.apply_keyset(query, sort, "asc", pagination.encode_cursor(cursor_data))
+
+@pytest.mark.parametrize("sort, value, last_id", [
+    ("size", [1], "x"),
+    ("size", 1, "x"),
+    ("size", "a", 1),
+    ("size", True, 1),
+    ("size", 1, True),
+    ("name", 1, 1),
+    ("name", None, 1),
+    ("mtime", {"a": 1}, 1),
+])
+def test_rejects_malformed_cursor_values(sort, value, last_id):
+    with pytest.raises(pagination.InvalidCursor):
+        _apply(sort, {"s": sort, "o": "asc", "v": value, "i": last_id})
+
+@pytest.mark.parametrize("sort, value", [("name", "a.txt"), ("size", 10), ("size", None), ("mtime", 1.5), ("mtime", 2)])
+def test_accepts_valid_cursor_values(sort, value):
+    _apply(sort, {"s": sort, "o": "asc", "v": value, "i": 3})
+
+def test_round_trip_cursor():
+    db_file = models.File(id=7, name="a", size=None, mtime=None)
+    for sort in pagination.SORT_COLUMNS:
+        cursor = pagination.next_keyset_cursor(db_file, sort, "desc")
+        query = Session().query(models.File)
+        pagination.apply_keyset(query, sort, "desc", cursor)
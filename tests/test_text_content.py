@@ -0,0 +1,65 @@
+import pytest
+
+from backend import text_content
+
+TEXT = "first line\n第二行\nthird 😀\nlast"
+
+@pytest.fixture
+def text_file(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_bytes(TEXT.encode("utf-8"))
+    return str(path)
+
+def test_read_lines(text_file):
+    result = text_content.read_lines(text_file, 1, 2)
+    assert result["content"] == "第二行\nthird 😀\n"
+    assert result["line"] == 1
+    assert result["lines"] == 2
+    assert result["total_lines"] == 4
+    assert text_content.read_lines(text_file, 3, 10)["content"] == "last"
+    assert text_content.read_lines(text_file, 9, 1)["content"] == ""
+
+def test_read_range_aligns_to_characters(text_file):
+    data = TEXT.encode("utf-8")
+    # 从 "第" 的第二个字节开始，到 "二" 的中间结束
+    start = data.index("第".encode("utf-8"))
+    result = text_content.read_range(text_file, start + 1, 4)
+    assert result["content"] == "二"
+    assert result["offset"] == start + 3
+    assert result["line"] == 1
+
+@pytest.mark.parametrize("length", [0, 1, 2, 3])
+def test_read_range_always_advances(text_file, length):
+    # 长度小于一个字符时也至少返回一个字符，按 end 分页能读完整个文件
+    offset, parts = 0, []
+    while True:
+        result = text_content.read_range(text_file, offset, length)
+        if result["end"] == offset:
+            break
+        parts.append(result["content"])
+        offset = result["end"]
+    assert "".join(parts) == TEXT
+    assert offset == len(TEXT.encode("utf-8"))
+
+def test_apply_edits(text_file):
+    data = TEXT.encode("utf-8")
+    start = data.index("第".encode("utf-8"))
+    file_stat = text_content.apply_edits(text_file, [
+        (start, len("第二行".encode("utf-8")), "second".encode("utf-8")),
+        (0, 5, b"1st"),
+    ])
+    expected = TEXT.replace("第二行", "second").replace("first", "1st")
+    with open(text_file, encoding="utf-8") as f:
+        assert f.read() == expected
+    assert file_stat.st_size == len(expected.encode("utf-8"))
+
+@pytest.mark.parametrize("edits", [
+    [(0, 5, b"x"), (3, 2, b"y")],
+    [(len(TEXT.encode("utf-8")), 1, b"x")],
+    [(len("first line\n") + 1, 1, b"x")],
+])
+def test_apply_edits_rejects_invalid_ranges(text_file, edits):
+    with pytest.raises(text_content.TextRangeError):
+        text_content.apply_edits(text_file, edits)
+    with open(text_file, encoding="utf-8") as f:
+        assert f.read() == TEXT
@@ -0,0 +1,50 @@
+from helpers import upload
+
+TEXT = "line 0\n第 1 行\nline 2\n"
+
+def test_ranged_reads(client, headers, root):
+    file_id = upload(client, headers, root, "a.txt", TEXT.encode("utf-8"))["id"]
+
+    result = client.get(f"/api/files/content/{file_id}", headers=headers, params={"line": 1, "lines": 2}).json()
+    assert result["content"] == "第 1 行\nline 2\n"
+    assert (result["line"], result["total_lines"]) == (1, 3)
+
+    # 分段读取时从返回的 end 继续，每段都在字符边界上
+    offset, parts = 0, []
+    while True:
+        result = client.get(f"/api/files/content/{file_id}", headers=headers, params={"offset": offset, "length": 2}).json()
+        if result["end"] == offset:
+            break
+        parts.append(result["content"])
+        offset = result["end"]
+    assert "".join(parts) == TEXT
+
+    whole = client.get(f"/api/files/content/{file_id}", headers=headers)
+    assert whole.json()["content"] == TEXT
+    assert whole.headers["etag"] == whole.json()["etag"]
+
+def test_patch_by_offset(client, headers, root):
+    file_id = upload(client, headers, root, "a.txt", TEXT.encode("utf-8"))["id"]
+    etag = client.get(f"/api/files/content/{file_id}", headers=headers).json()["etag"]
+    data = TEXT.encode("utf-8")
+    start = data.index("第".encode("utf-8"))
+
+    response = client.patch(f"/api/files/content/{file_id}", headers={**headers, "If-Match": etag}, json={"edits": [
+        {"offset": start, "length": len("第 1 行".encode("utf-8")), "text": "line 1"},
+        {"offset": len(data), "text": "line 3\n"},
+        {"offset": 0, "length": 5},
+    ]})
+    assert response.status_code == 200, response.text
+    expected = "0\nline 1\nline 2\nline 3\n"
+    assert response.json()["size"] == len(expected)
+    assert response.headers["etag"] != etag
+    assert client.get(f"/api/files/content/{file_id}", headers=headers).json()["content"] == expected
+
+def test_patch_rejects_split_characters(client, headers, root):
+    file_id = upload(client, headers, root, "a.txt", TEXT.encode("utf-8"))["id"]
+    start = TEXT.encode("utf-8").index("第".encode("utf-8"))
+    response = client.patch(f"/api/files/content/{file_id}", headers=headers, json={"edits": [
+        {"offset": start + 1, "length": 1, "text": "x"},
+    ]})
+    assert response.status_code == 400
+    assert client.get(f"/api/files/content/{file_id}", headers=headers).json()["content"] == TEXT